@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark of the parser, dataset and export hot paths on synthetic diagrams (see pybpmn.synthetic).
+Each stage is timed separately, and reported with its throughput and the peak memory of the main process.
+With --baseline, the script exits with status 1 if the throughput of a stage regressed by more than --max_regression.
+"""
+import gc
+import json
+import logging
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import click
+from lxml import etree
+
+import pybpmn
+from pybpmn.constants import VALID_SPLITS
+from pybpmn.dataset import HdBpmnDataset
+from pybpmn.export import BpmnCocoDatasetExport
+from pybpmn.mode import Mode
+from pybpmn.synthetic import create_synthetic_dataset
+from pybpmn.uml_dataset import UmlDataset
+from pybpmn.util import create_model_id_index
+from pybpmn.vis import get_bpmn_bounding_box, get_bpmn_bounding_box_doc
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_N_ELEMENTS = (10, 100, 1000, 10000)
+
+
+@dataclass
+class StageResult:
+    mode: str
+    stage: str
+    n_elements: int
+    n_files: int
+    n_anns: int
+    seconds: float
+    peak_mem_mb: Optional[float]
+
+    @property
+    def files_per_s(self) -> float:
+        return self.n_files / self.seconds
+
+    @property
+    def elements_per_s(self) -> float:
+        return self.n_anns / self.seconds
+
+    @property
+    def key(self) -> Tuple[str, str, int]:
+        return self.mode, self.stage, self.n_elements
+
+    def to_dict(self) -> Dict:
+        return {**asdict(self), "files_per_s": self.files_per_s, "elements_per_s": self.elements_per_s}
+
+
+def _measure(fn: Callable[[], None], repeat: int, trace_memory: bool) -> Tuple[float, Optional[float]]:
+    """:return: the best wall time of repeat runs and the peak traced memory in MB of an additional run"""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    peak_mem_mb = None
+    if trace_memory:
+        # tracing slows down allocations considerably, therefore memory is measured in a separate run
+        gc.collect()
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_mem_mb = peak / 2 ** 20
+    return min(times), peak_mem_mb
+
+
+def _create_dataset(mode: Mode, dataset_root: Path, coco_root: Path, **parser_kwargs):
+    if mode == Mode.BPMN:
+        return HdBpmnDataset(hdbpmn_root=dataset_root, coco_dataset_root=coco_root, **parser_kwargs)
+    return UmlDataset(uml_dataset_root=dataset_root, coco_dataset_root=coco_root, **parser_kwargs)
+
+
+def _get_bpmn_img_paths(ds) -> List[Tuple[Path, Path]]:
+    bpmn_paths = [p for split in VALID_SPLITS for p in ds.split_to_bpmn_paths.get(split, [])]
+    return [(p, ds.get_img_path(p.stem)) for p in bpmn_paths]
+
+
+def benchmark_parsing(
+        mode: Mode, n_elements: int, n_files: int, work_dir: Path, repeat: int, trace_memory: bool
+) -> List[StageResult]:
+    dataset_root = create_synthetic_dataset(work_dir / f"{mode.value}_{n_elements}", mode, n_files, n_elements)
+    ds = _create_dataset(mode, dataset_root, work_dir / "coco_unused")
+    parser = ds.bpmn_parser
+    paths = _get_bpmn_img_paths(ds)
+    n_anns = sum(len(parser.parse_bpmn_anns(p)) for p, _ in paths)
+
+    def parse_documents():
+        return [etree.parse(str(p)) for p, _ in paths]
+
+    documents = parse_documents()
+
+    stages = {
+        "lxml_parse": parse_documents,
+        "create_id_to_obj_mapping": lambda: [create_model_id_index(d.getroot()) for d in documents],
+        "parse_bpmn_anns": lambda: [parser.parse_bpmn_anns(p) for p, _ in paths],
+        "parse_bpmn_img": lambda: [parser.parse_bpmn_img(p, img_p) for p, img_p in paths],
+        "get_bpmn_bounding_box": lambda: [get_bpmn_bounding_box(p) for p, _ in paths],
+        "get_bpmn_bounding_box_doc": lambda: [get_bpmn_bounding_box_doc(d) for d in documents],
+    }
+    results = []
+    for stage, fn in stages.items():
+        seconds, peak_mem_mb = _measure(fn, repeat, trace_memory)
+        results.append(StageResult(mode.value, stage, n_elements, len(paths), n_anns, seconds, peak_mem_mb))
+        _logger.info("%s", _format_result(results[-1]))
+    return results
+
+
+def benchmark_export(
+        mode: Mode, n_elements: int, n_files: int, work_dir: Path, n_jobs: int, trace_memory: bool
+) -> StageResult:
+    dataset_root = create_synthetic_dataset(work_dir / f"{mode.value}_{n_elements}_export", mode, n_files, n_elements)
+    coco_root = work_dir / f"coco_{mode.value}_{n_elements}"
+    ds = _create_dataset(mode, dataset_root, coco_root, lazy_img=True)
+    n_anns = sum(len(ds.bpmn_parser.parse_bpmn_anns(p)) for p, _ in _get_bpmn_img_paths(ds))
+
+    def export():
+        exporter = BpmnCocoDatasetExport(ds=ds, write_img=True, write_ann_img=False, n_jobs=n_jobs)
+        exporter.dump_splits(VALID_SPLITS)
+
+    # the export always rewrites the whole coco dataset, therefore a single run is sufficient
+    seconds, peak_mem_mb = _measure(export, 1, trace_memory)
+    result = StageResult(mode.value, "dump_coco", n_elements, n_files, n_anns, seconds, peak_mem_mb)
+    _logger.info("%s", _format_result(result))
+    return result
+
+
+def _format_result(r: StageResult) -> str:
+    mem = "" if r.peak_mem_mb is None else f"{r.peak_mem_mb:10.1f}"
+    return (
+        f"{r.mode:<10} {r.stage:<25} {r.n_elements:>8} {r.n_files:>6} {r.seconds:>9.3f} "
+        f"{r.files_per_s:>10.1f} {r.elements_per_s:>12.0f} {mem:>10}"
+    )
+
+
+def _print_table(results: List[StageResult]):
+    header = (
+        f"{'mode':<10} {'stage':<25} {'elements':>8} {'files':>6} {'seconds':>9} "
+        f"{'files/s':>10} {'elements/s':>12} {'peak MB':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(_format_result(r))
+
+
+def find_regressions(results: List[StageResult], baseline: List[Dict], max_regression: float) -> List[str]:
+    """
+    :param baseline: results of a previous run, as written with --json_out
+    :param max_regression: tolerated relative throughput decrease, e.g. 0.2 for 20%
+    :return: a description of each stage whose throughput regressed by more than max_regression
+    """
+    baseline_results = {(b["mode"], b["stage"], b["n_elements"]): b for b in baseline}
+    regressions = []
+    for r in results:
+        b = baseline_results.get(r.key)
+        if b is None:
+            continue
+        min_elements_per_s = b["elements_per_s"] * (1 - max_regression)
+        if r.elements_per_s < min_elements_per_s:
+            regressions.append(
+                f"{r.mode} {r.stage} ({r.n_elements} elements): {r.elements_per_s:.0f} elements/s "
+                f"< {min_elements_per_s:.0f} elements/s (baseline {b['elements_per_s']:.0f})"
+            )
+    return regressions
+
+
+@click.command()
+@click.option("--mode", "modes", multiple=True, default=[m.value for m in Mode],
+              type=click.Choice([m.value for m in Mode]))
+@click.option("--n_elements", "-n", multiple=True, default=list(DEFAULT_N_ELEMENTS), type=int,
+              help="approximate number of annotations per diagram")
+@click.option("--n_files", default=20, type=int, help="number of diagrams per parsing benchmark")
+@click.option("--export_n_elements", default=100, type=int, help="number of annotations per diagram for dump_coco")
+@click.option("--export_n_files", default=100, type=int, help="number of diagrams for dump_coco, 0 to skip")
+@click.option("--n_jobs", default=1, type=int, help="number of dump_coco workers")
+@click.option("--repeat", default=3, type=int, help="number of timed runs per parsing stage, the best run is reported")
+@click.option("--trace_memory", default=True, type=bool, help="measure the peak memory in a separate run")
+@click.option("--work_dir", default=None, type=click.Path(file_okay=False),
+              help="directory for the synthetic datasets, defaults to a temporary directory")
+@click.option("--json_out", default=None, type=click.Path(dir_okay=False), help="write the results to this file")
+@click.option("--baseline", default=None, type=click.Path(dir_okay=False, exists=True),
+              help="results of a previous run to compare against")
+@click.option("--max_regression", default=0.2, type=float, help="tolerated relative throughput decrease")
+@click.option("--quiet", "log_level", flag_value=logging.WARNING, default=True)
+@click.option("-v", "--verbose", "log_level", flag_value=logging.INFO)
+@click.version_option(pybpmn.__version__)
+def main(
+        modes: List[str],
+        n_elements: List[int],
+        n_files: int,
+        export_n_elements: int,
+        export_n_files: int,
+        n_jobs: int,
+        repeat: int,
+        trace_memory: bool,
+        work_dir: Optional[str],
+        json_out: Optional[str],
+        baseline: Optional[str],
+        max_regression: float,
+        log_level: int,
+):
+    logging.basicConfig(format="%(asctime)s %(levelname)s - %(message)s", level=log_level)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = Path(tmp_dir if work_dir is None else work_dir)
+        results = []
+        for mode in map(Mode, modes):
+            for n in n_elements:
+                results.extend(benchmark_parsing(mode, n, n_files, work_dir, repeat, trace_memory))
+            if export_n_files > 0:
+                result = benchmark_export(mode, export_n_elements, export_n_files, work_dir, n_jobs, trace_memory)
+                results.append(result)
+
+    _print_table(results)
+
+    if json_out is not None:
+        meta = {"pybpmn_version": pybpmn.__version__, "python_version": sys.version.split()[0]}
+        Path(json_out).write_text(json.dumps({"meta": meta, "results": [r.to_dict() for r in results]}, indent=2))
+
+    if baseline is not None:
+        regressions = find_regressions(results, json.loads(Path(baseline).read_text())["results"], max_regression)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
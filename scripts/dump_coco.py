@@ -1,28 +1,68 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import contextlib
 import logging
 import sys
-from typing import List, Optional
+from pathlib import Path
+from typing import List, Optional, Tuple
 
 import click
-from IPython.core import ultratb
-from yamlu.coco import CocoDatasetExport
 
 import pybpmn
 from pybpmn.constants import VALID_SPLITS, DEFAULT_MODE
 from pybpmn.dataset import HdBpmnDataset
+from pybpmn.export import BpmnCocoDatasetExport, merge_coco_shards
+from pybpmn.profiling import Profiler, profile_stage
+from pybpmn.stats import compute_stats, merge_stats, read_stats_json, write_stats_csv, write_stats_json
 
 # UML-Extension
 from pybpmn.mode import Mode
 from pybpmn.uml_dataset import UmlDataset
 
-# fallback to debugger on error
-sys.excepthook = ultratb.FormattedTB(mode="Verbose", color_scheme="Linux", call_pdb=1)
-
 _logger = logging.getLogger(__name__)
 
 
-@click.command()
+def install_debugger():
+    """fallback to debugger on error, only for interactive use since it blocks until the debugger is quit"""
+    from IPython.core import ultratb
+
+    sys.excepthook = ultratb.FormattedTB(mode="Verbose", color_scheme="Linux", call_pdb=1)
+
+
+class DefaultCommandGroup(click.Group):
+    """runs the export command if the first argument is not a command, i.e. `dump_coco.py SRC DST` still works"""
+
+    def parse_args(self, ctx, args):
+        if len(args) > 0 and args[0] not in self.commands and args[0] not in ctx.help_option_names + ["--version"]:
+            args = ["export"] + args
+        return super().parse_args(ctx, args)
+
+
+def parse_shard(ctx, param, value: Optional[str]) -> Optional[Tuple[int, int]]:
+    if value is None:
+        return None
+    try:
+        shard_idx, n_shards = (int(s) for s in value.split("/"))
+    except ValueError:
+        raise click.BadParameter(f"expected i/n, got {value}")
+    if not 0 <= shard_idx < n_shards:
+        raise click.BadParameter(f"expected 0 <= i < n, got {value}")
+    return shard_idx, n_shards
+
+
+def create_dataset(mode: Mode, hdbpmn_root: str, coco_dataset_root: str, **parser_kwargs):
+    if (mode == Mode.BPMN):
+        return HdBpmnDataset(hdbpmn_root=hdbpmn_root, coco_dataset_root=coco_dataset_root, **parser_kwargs)
+    return UmlDataset(uml_dataset_root=hdbpmn_root, coco_dataset_root=coco_dataset_root, **parser_kwargs)
+
+
+@click.group(cls=DefaultCommandGroup)
+@click.version_option(pybpmn.__version__)
+def main():
+    pass
+
+
+@main.command()
 @click.argument("hdbpmn_root", type=click.Path(file_okay=False, exists=True))
 @click.argument("coco_dataset_root", type=click.Path(file_okay=False))
 @click.option("--sample", default=None, type=int)
@@ -30,12 +70,28 @@ _logger = logging.getLogger(__name__)
 @click.option("--write_img", default=True, type=bool)
 @click.option("--write_ann_img", default=False, type=bool)
 @click.option("--mode", default=DEFAULT_MODE, type=Mode)
+@click.option("--cache_dir", default=None, type=click.Path(file_okay=False), help="cache parsed BPMN files here")
+@click.option("--streaming", default=False, type=bool, help="parse the BPMN XML incrementally, for very large files")
+@click.option("--target_max_size", default=None, type=int,
+              help="downscale images (and their annotations) whose larger side exceeds this size")
 @click.option("--splits", "-s", multiple=True, default=list(VALID_SPLITS))
+@click.option("--shared_pool", default=False, type=bool, help="process all splits with a single process pool")
+@click.option("--stream_json", default=False, type=bool, help="write coco json incrementally with flat memory usage")
+@click.option("--incremental", default=False, type=bool, help="only re-process items that changed since the last run")
+@click.option("--shard", default=None, callback=parse_shard,
+              help="i/n: only export the i-th of n shards of each split, combine the shards with the merge command")
+@click.option("--checkpoint", default=False, type=bool,
+              help="commit completed items to a journal, and report failed items instead of aborting")
+@click.option("--checkpoint_interval", default=100, type=int, help="number of items between journal commits")
+@click.option("--resume", is_flag=True, help="continue an interrupted checkpointed export, implies --checkpoint")
+@click.option("--debug", is_flag=True, help="fall back to the debugger on errors")
+@click.option("--profile", is_flag=True, help="print the time spent per stage and the slowest files")
+@click.option("--profile_trace", default=None, type=click.Path(dir_okay=False),
+              help="JSON trace of the profiled stages, defaults to <coco_dataset_root>/profile.json")
 @click.option("--quiet", "log_level", flag_value=logging.WARNING)
 @click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
 @click.option("-vv", "--very-verbose", "log_level", flag_value=logging.DEBUG)
-@click.version_option(pybpmn.__version__)
-def main(
+def export(
         hdbpmn_root: str,
         coco_dataset_root: str,
         sample: Optional[int],
@@ -43,26 +99,136 @@ def main(
         write_img: bool,
         write_ann_img: bool,
         mode: Mode,
+        cache_dir: Optional[str],
+        streaming: bool,
+        target_max_size: Optional[int],
         splits: List[str],
+        shared_pool: bool,
+        stream_json: bool,
+        incremental: bool,
+        shard: Optional[Tuple[int, int]],
+        checkpoint: bool,
+        checkpoint_interval: int,
+        resume: bool,
+        debug: bool,
+        profile: bool,
+        profile_trace: Optional[str],
         log_level: int,
 ):
+    """converts the BPMN XMLs and images of a dataset into a COCO dataset"""
+    if debug:
+        install_debugger()
     logging.basicConfig(format="%(asctime)s %(levelname)s - %(message)s", level=log_level)
     # logging.getLogger("yamlu.img").setLevel(logging.ERROR)
 
-    if (mode == Mode.BPMN):
-        ds = HdBpmnDataset(hdbpmn_root=hdbpmn_root, coco_dataset_root=coco_dataset_root)
-    else:
-        ds = UmlDataset(uml_dataset_root=hdbpmn_root, coco_dataset_root=coco_dataset_root)
+    # images are only decoded when the exporter writes them
+    parser_kwargs = {
+        "lazy_img": True,
+        "cache_dir": cache_dir,
+        "streaming": streaming,
+        "target_max_size": target_max_size,
+    }
+    ds = create_dataset(mode, hdbpmn_root, coco_dataset_root, **parser_kwargs)
 
-    exporter = CocoDatasetExport(
+    exporter = BpmnCocoDatasetExport(
         ds=ds,
         write_img=write_img,
         write_ann_img=write_ann_img,
         sample=sample,
         n_jobs=n_jobs,
+        stream_json=stream_json,
+        incremental=incremental,
+        shard=shard,
+        checkpoint=checkpoint,
+        resume=resume,
+        checkpoint_interval=checkpoint_interval,
     )
-    for split in splits:
-        exporter.dump_split(split)
+    profiler = Profiler() if profile else None
+    with profiler.activate() if profile else contextlib.nullcontext(), profile_stage("export"):
+        if shared_pool:
+            exporter.dump_splits(splits)
+        else:
+            for split in splits:
+                exporter.dump_split(split)
+
+    if profile:
+        click.echo(profiler.summary_table())
+        profile_trace = Path(coco_dataset_root) / "profile.json" if profile_trace is None else profile_trace
+        profiler.write_trace(profile_trace)
+        _logger.info("Wrote profile trace to %s", profile_trace)
+
+
+@main.command()
+@click.argument("coco_dataset_root", type=click.Path(file_okay=False, exists=True))
+@click.option("--sample", default=None, type=int, help="merge the shards of an export with this --sample")
+@click.option("--splits", "-s", multiple=True, help="splits to merge, defaults to all exported splits")
+@click.option("--quiet", "log_level", flag_value=logging.WARNING)
+@click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
+def merge(coco_dataset_root: str, sample: Optional[int], splits: List[str], log_level: int):
+    """combines the shards of a sharded export into the COCO JSON file of each split"""
+    logging.basicConfig(format="%(asctime)s %(levelname)s - %(message)s", level=log_level)
+    coco_json_dir = Path(coco_dataset_root)
+    if sample is not None:
+        coco_json_dir = coco_json_dir / f"sample_{sample}"
+    merge_coco_shards(coco_json_dir, list(splits) if len(splits) > 0 else None)
+
+
+@main.command()
+@click.argument("hdbpmn_root", type=click.Path(file_okay=False, exists=True))
+@click.option("--mode", default=DEFAULT_MODE, type=Mode)
+@click.option("--splits", "-s", multiple=True, default=list(VALID_SPLITS))
+@click.option("--n_jobs", default=1, type=int)
+@click.option("--cache_dir", default=None, type=click.Path(file_okay=False), help="cache parsed BPMN files here")
+@click.option("--target_max_size", default=None, type=int,
+              help="compute the stats for images downscaled to this size, as exported with the same option")
+@click.option("--shard", default=None, callback=parse_shard,
+              help="i/n: only process the i-th of n shards of each split, combine the shards with merge_stats")
+@click.option("--json_out", default=None, type=click.Path(dir_okay=False), help="write the stats to this JSON file")
+@click.option("--csv_out", default=None, type=click.Path(dir_okay=False), help="write the stats to this CSV file")
+@click.option("--quiet", "log_level", flag_value=logging.WARNING)
+@click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
+def stats(
+        hdbpmn_root: str,
+        mode: Mode,
+        splits: List[str],
+        n_jobs: int,
+        cache_dir: Optional[str],
+        target_max_size: Optional[int],
+        shard: Optional[Tuple[int, int]],
+        json_out: Optional[str],
+        csv_out: Optional[str],
+        log_level: int,
+):
+    """computes annotation statistics per split (category counts, bounding box sizes, edge lengths, ...)"""
+    logging.basicConfig(format="%(asctime)s %(levelname)s - %(message)s", level=log_level)
+    # nothing is written to the COCO dataset root, images are not decoded
+    ds = create_dataset(mode, hdbpmn_root, hdbpmn_root, lazy_img=True, cache_dir=cache_dir,
+                        target_max_size=target_max_size)
+    split_to_stats = compute_stats(ds, splits, n_jobs=n_jobs, shard=shard)
+    write_stats(split_to_stats, json_out, csv_out)
+
+
+@main.command("merge_stats")
+@click.argument("json_paths", nargs=-1, required=True, type=click.Path(dir_okay=False, exists=True))
+@click.option("--json_out", default=None, type=click.Path(dir_okay=False), help="write the stats to this JSON file")
+@click.option("--csv_out", default=None, type=click.Path(dir_okay=False), help="write the stats to this CSV file")
+def merge_stats_cmd(json_paths: List[str], json_out: Optional[str], csv_out: Optional[str]):
+    """combines the stats JSON files of e.g. the shards of a dataset"""
+    write_stats(merge_stats(read_stats_json(Path(p)) for p in json_paths), json_out, csv_out)
+
+
+def write_stats(split_to_stats, json_out: Optional[str], csv_out: Optional[str]):
+    for split, split_stats in split_to_stats.items():
+        d = split_stats.to_dict()
+        click.echo(f"{split}: {d['n_imgs']} images, {d['n_anns']} annotations, {len(d['errors'])} errors")
+        for category, count in sorted(d["category_counts"].items(), key=lambda kv: -kv[1]):
+            click.echo(f"  {category:<30} {count:>8}")
+    if json_out is not None:
+        write_stats_json(split_to_stats, Path(json_out))
+        _logger.info("Wrote stats to %s", json_out)
+    if csv_out is not None:
+        write_stats_csv(split_to_stats, Path(csv_out))
+        _logger.info("Wrote stats to %s", csv_out)
 
 
 if __name__ == "__main__":
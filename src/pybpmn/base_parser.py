@@ -0,0 +1,224 @@
+import abc
+import logging
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+import numpy as np
+import yamlu
+# noinspection PyProtectedMember
+from lxml.etree import _ElementTree as ElementTree
+from yamlu.img import AnnotatedImage, Annotation
+
+from pybpmn.batch import THREAD_EXECUTOR, ParseResult, parse_many
+from pybpmn.cache import ParseCache
+from pybpmn.columnar import ColumnarAnnotatedImage, ColumnarAnnotations
+from pybpmn.img import LazyAnnotatedImage, get_target_img_size, read_img_resized, read_img_size
+from pybpmn.notation import Notation
+from pybpmn.profiling import profile_stage, record_n_elements
+from pybpmn.streaming import iterparse_bpmn_anns
+from pybpmn.util import (
+    create_model_id_index,
+    find_annotation_background_width,
+    parse_bpmn_document,
+    scale_anns_to_img,
+)
+
+_logger = logging.getLogger(__name__)
+
+
+class DiagramParser(abc.ABC):
+    """
+    Parsing engine shared by all diagram types:
+    reads the BPMN XML (tree-based, streaming or cached), converts the BPMNDI elements with the rules of the notation,
+    links the annotations and scales them to the image.
+    Subclasses set notation and implement get_parse_config, _get_min_sizes and _link_anns.
+    """
+
+    notation: Notation
+
+    def __init__(
+            self,
+            img_max_size_ref: int = 1000,
+            excluded_categories: Set[str] = None,
+            lazy_img: bool = False,
+            cache_dir: Optional[Union[Path, str]] = None,
+            streaming: bool = False,
+            target_max_size: Optional[int] = None,
+    ):
+        """
+        Subclasses have to set their own options before calling this, since get_parse_config() is used for the cache.
+        :param img_max_size_ref: reference image size of the minimum edge sizes (see _get_min_sizes)
+        :param lazy_img: only read the image size from the image header in parse_bpmn_img,
+                         the image itself is decoded when the img attribute of the result is accessed
+        :param cache_dir: if set, parsed annotations are cached in this directory (see ParseCache)
+        :param streaming: parse the BPMN XML incrementally with lxml.etree.iterparse and free the BPMNDI elements
+                          once they are converted (see iterparse_bpmn_anns), for very large documents.
+                          The annotations are the same as without streaming.
+        :param target_max_size: downscale images whose larger side exceeds this size (see get_target_img_size).
+                                JPEGs are decoded at a reduced size already (see read_img_resized),
+                                and the annotations and minimum edge sizes are computed for the downscaled image.
+        """
+        self.img_max_size_ref = img_max_size_ref
+        self.excluded_categories = {} if excluded_categories is None else excluded_categories
+        self.lazy_img = lazy_img
+        self.streaming = streaming
+        self.target_max_size = target_max_size
+        self.parse_cache = None if cache_dir is None else ParseCache(cache_dir, self.get_parse_config())
+
+    @abc.abstractmethod
+    def get_parse_config(self) -> Dict:
+        """:return: the options that influence the parsing result"""
+
+    @abc.abstractmethod
+    def _get_min_sizes(self, anns: List[Annotation], img_w: int, img_h: int) -> np.ndarray:
+        """:return: per annotation the minimum width and height in the image, NaN for annotations without one"""
+
+    @abc.abstractmethod
+    def _link_anns(self, anns: List[Annotation]):
+        """replaces the ids of the notation's belongs_to_rel by the annotations"""
+
+    def _is_included_ann(self, a: Annotation) -> bool:
+        return a.category not in self.excluded_categories
+
+    def parse_bpmn_img(self, bpmn_path: Path, img_path: Path) -> AnnotatedImage:
+        """
+        :param bpmn_path: path to the BPMN XML file
+        :param img_path: path to the corresponding image
+        """
+        return self._parse_bpmn_img(bpmn_path, img_path, lazy_img=self.lazy_img)
+
+    def parse_bpmn_img_columnar(self, bpmn_path: Path, img_path: Path) -> ColumnarAnnotatedImage:
+        """
+        Same as parse_bpmn_img, but returns the annotations in columnar format.
+        Only the image header is read, use to_annotated_image() to convert the result into an AnnotatedImage.
+        """
+        ai = self._parse_bpmn_img(bpmn_path, img_path, lazy_img=True)
+        return ColumnarAnnotatedImage.from_annotated_image(ai)
+
+    # noinspection PyPropertyAccess
+    def _parse_bpmn_img(self, bpmn_path: Path, img_path: Path, lazy_img: bool) -> AnnotatedImage:
+        resize = self.target_max_size is not None
+        with profile_stage("read_img", bpmn_path):
+            if lazy_img or resize:
+                img_w, img_h = get_target_img_size(*read_img_size(img_path), self.target_max_size)
+            if not lazy_img:
+                img = read_img_resized(img_path, (img_w, img_h)) if resize else yamlu.read_img(img_path)
+                img_w, img_h = img.size
+
+        try:
+            img_w_annotation, anns = self._parse_bpmn_file(bpmn_path)
+            assert img_w_annotation is not None, f"{bpmn_path} has no meta comment"
+            with profile_stage("scale_bbs", bpmn_path):
+                scale = img_w / img_w_annotation
+                min_sizes = self._get_min_sizes(anns, img_w, img_h)
+                scale_anns_to_img(anns, scale, min_sizes, img_w, img_h, bpmn_path.name, _logger)
+        except Exception as e:
+            _logger.error("Error while processing: %s", bpmn_path)
+            raise e
+
+        anns = [a for a in anns if self._is_included_ann(a)]
+
+        if lazy_img:
+            return LazyAnnotatedImage(
+                img_path.name, width=img_w, height=img_h, annotations=anns, img_path=img_path, resize=resize
+            )
+
+        return AnnotatedImage(
+            img_path.name,
+            width=img.width,
+            height=img.height,
+            annotations=anns,
+            img=img,
+        )
+
+    def parse_bpmn_anns(self, bpmn_path: Path) -> List[Annotation]:
+        _, anns = self._parse_bpmn_file(bpmn_path)
+        return anns
+
+    def parse_bpmn_anns_columnar(self, bpmn_path: Path) -> ColumnarAnnotations:
+        return ColumnarAnnotations.from_anns(self.parse_bpmn_anns(bpmn_path))
+
+    def parse_many(
+            self,
+            bpmn_paths: Iterable[Path],
+            img_paths: Optional[Iterable[Path]] = None,
+            executor: str = THREAD_EXECUTOR,
+            n_jobs: Optional[int] = None,
+            chunksize: int = 1,
+    ) -> Iterator[ParseResult]:
+        """
+        Parses the BPMN files (and images, if img_paths are given) with a thread or process pool, see batch.parse_many
+        """
+        return parse_many(self, bpmn_paths, img_paths, executor=executor, n_jobs=n_jobs, chunksize=chunksize)
+
+    def _parse_bpmn_file(self, bpmn_path: Path) -> Tuple[Optional[float], List[Annotation]]:
+        """
+        :return: the annotation background width (None if the file has no meta comment) and the annotations
+        """
+        with profile_stage("parse_xml", bpmn_path):
+            if self.parse_cache is not None:
+                img_w_annotation, anns = self.parse_cache.get_or_parse(bpmn_path, self._parse_bpmn_source)
+            else:
+                img_w_annotation, anns = self._parse_bpmn_source(bpmn_path)
+        record_n_elements(bpmn_path, len(anns))
+        return img_w_annotation, anns
+
+    def _parse_bpmn_source(
+            self, bpmn_path: Path, source: Optional[BinaryIO] = None
+    ) -> Tuple[Optional[float], List[Annotation]]:
+        """:param source: file object with the content of bpmn_path, bpmn_path is read if None"""
+        if self.streaming:
+            img_w_annotation, anns = iterparse_bpmn_anns(
+                str(bpmn_path) if source is None else source, str(bpmn_path), self.notation
+            )
+            self._link_anns(anns)
+            return img_w_annotation, anns
+
+        document = parse_bpmn_document(bpmn_path, source)
+        return find_annotation_background_width(document), self.parse_bpmn_document_anns(document)
+
+    def parse_bpmn_document_anns(self, document: ElementTree) -> List[Annotation]:
+        notation = self.notation
+        root = document.getroot()
+
+        id_to_obj = create_model_id_index(root)
+
+        diagram = root.find("bpmndi:BPMNDiagram", root.nsmap)
+        plane = diagram[0]
+        shapes = plane.findall("bpmndi:BPMNShape", plane.nsmap)
+        shape_anns = yamlu.flatten(
+            notation.shape_to_anns(shape, id_to_obj[shape.get("bpmnElement")])
+            for shape in shapes
+        )
+        id_to_shape_ann = {a.id: a for a in shape_anns if a.category != notation.label_category}
+
+        edges = plane.findall("bpmndi:BPMNEdge", plane.nsmap)
+
+        edge_anns = []
+        for edge in edges:
+            model_id = edge.get("bpmnElement")
+            if model_id not in id_to_obj:
+                raise ValueError(f"{document.docinfo.URL}: {model_id} not in model element ids")
+            edge_anns.append(notation.edge_to_anns(edge, id_to_obj[model_id], id_to_shape_ann))
+
+        edge_anns = yamlu.flatten(edge_anns)
+
+        anns = shape_anns + edge_anns
+        self._link_anns(anns)
+        return anns
+
+    def _link_belongs_to_anns(self, anns: List[Annotation], two_way: bool):
+        """
+        Implementation of _link_anns.
+        :param two_way: also link the annotations that are referenced to the annotations that belong to them
+        """
+        notation = self.notation
+        id_to_ann = {a.id: a for a in anns if a.category != notation.label_category}
+
+        belongs_anns = [a for a in anns if a.category in notation.belongs_to_categories]
+
+        for belongs_ann in belongs_anns:
+            symb_ann = id_to_ann[belongs_ann.get(notation.belongs_to_rel)]
+            belongs_ann.set(notation.belongs_to_rel, symb_ann)
+            if two_way:
+                symb_ann.set(notation.belongs_to_rel, belongs_ann)
@@ -0,0 +1,136 @@
+import functools
+import itertools
+import logging
+import os
+import traceback
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+import joblib
+
+_logger = logging.getLogger(__name__)
+
+THREAD_EXECUTOR = "thread"
+PROCESS_EXECUTOR = "process"
+
+# parser of the current worker process, set once per worker by _init_worker
+_worker_parser = None
+
+
+@dataclass
+class ParseResult:
+    """
+    Result of parsing a single file with parse_many.
+    If parsing failed, result is None and error contains the exception type and message.
+    Exceptions themselves are not kept, since e.g. lxml exceptions cannot be sent back from worker processes.
+    """
+    bpmn_path: Path
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    traceback: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def parse_many(
+        parser,
+        bpmn_paths: Iterable[Path],
+        img_paths: Optional[Iterable[Path]] = None,
+        executor: str = THREAD_EXECUTOR,
+        n_jobs: Optional[int] = None,
+        chunksize: int = 1,
+) -> Iterator[ParseResult]:
+    """
+    Parses many BPMN files with parser.parse_bpmn_anns, or with parser.parse_bpmn_img if img_paths are given.
+    When parsing images with a process pool, use a parser with lazy_img=True to avoid sending decoded images back.
+    :param parser: BpmnParser or UmlParser, sent to each worker process once
+    :param executor: "thread" or "process" pool
+    :param n_jobs: number of workers, defaults to the number of CPUs
+    :param chunksize: number of files that are sent to a worker process at once (ignored for thread pools)
+    :return: iterator of ParseResult in the order of bpmn_paths. Errors are reported per file and do not abort.
+             The paths are consumed lazily, only up to 4 * n_jobs chunks are submitted ahead of the caller.
+    """
+    if executor not in (THREAD_EXECUTOR, PROCESS_EXECUTOR):
+        raise ValueError(f"Unknown executor: {executor}, expected {THREAD_EXECUTOR} or {PROCESS_EXECUTOR}")
+
+    items = ((p, None) for p in bpmn_paths) if img_paths is None else zip(bpmn_paths, img_paths)
+    n_jobs = os.cpu_count() if n_jobs is None else effective_n_jobs(n_jobs)
+    return _iter_parse_results(parser, items, executor, n_jobs, chunksize)
+
+
+def effective_n_jobs(n_jobs: Optional[int]) -> int:
+    """
+    :return: the number of workers of a joblib-style n_jobs (see joblib.effective_n_jobs),
+             e.g. -1 for all CPUs and -2 for all but one, but at least 1.
+             n_jobs=0 is mapped to 1, since the default of CocoDatasetExport (number of CPUs - 2)
+             is 0 on machines with 2 CPUs, which joblib rejects.
+    """
+    if n_jobs == 0:
+        return 1
+    return joblib.effective_n_jobs(n_jobs)
+
+
+def _iter_parse_results(parser, items, executor: str, n_jobs: int, chunksize: int) -> Iterator[ParseResult]:
+    if executor == THREAD_EXECUTOR:
+        pool: Executor = ThreadPoolExecutor(n_jobs)
+        parse_chunk = functools.partial(_parse_chunk, parser)
+        chunksize = 1
+    else:
+        pool = ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=(parser,))
+        parse_chunk = _parse_chunk_in_worker
+
+    # unlike Executor.map, which submits all items upfront, only a bounded number of chunks is in flight
+    max_pending = 4 * n_jobs
+    pending: "deque[Future]" = deque()
+    with pool:
+        try:
+            for chunk in _iter_chunks(items, chunksize):
+                pending.append(pool.submit(parse_chunk, chunk))
+                if len(pending) >= max_pending:
+                    yield from pending.popleft().result()
+            while len(pending) > 0:
+                yield from pending.popleft().result()
+        finally:
+            # the caller may stop early: do not parse the remaining chunks
+            for future in pending:
+                future.cancel()
+
+
+def _iter_chunks(items: Iterable, chunksize: int) -> Iterator[List]:
+    it = iter(items)
+    while True:
+        chunk = list(itertools.islice(it, chunksize))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def _parse(parser, item: Tuple[Path, Optional[Path]]) -> ParseResult:
+    bpmn_path, img_path = item
+    try:
+        if img_path is None:
+            result = parser.parse_bpmn_anns(bpmn_path)
+        else:
+            result = parser.parse_bpmn_img(bpmn_path, img_path)
+        return ParseResult(bpmn_path, result=result)
+    except Exception as e:
+        _logger.warning("Error while parsing %s: %s", bpmn_path, e)
+        return ParseResult(bpmn_path, error=f"{e.__class__.__name__}: {e}", traceback=traceback.format_exc())
+
+
+def _init_worker(parser):
+    global _worker_parser
+    _worker_parser = parser
+
+
+def _parse_chunk(parser, chunk: List[Tuple[Path, Optional[Path]]]) -> List[ParseResult]:
+    return [_parse(parser, item) for item in chunk]
+
+
+def _parse_chunk_in_worker(chunk: List[Tuple[Path, Optional[Path]]]) -> List[ParseResult]:
+    return _parse_chunk(_worker_parser, chunk)
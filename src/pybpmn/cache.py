@@ -0,0 +1,70 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+
+from yamlu.img import Annotation
+
+from pybpmn.columnar import ColumnarAnnotations
+
+_logger = logging.getLogger(__name__)
+
+# increment when the encoding of cache entries or the parser output changes
+CACHE_VERSION = 3
+
+
+class ParseCache:
+    def __init__(self, cache_dir: Union[Path, str], parser_config: Dict[str, Any]):
+        """
+        On-disk cache of parsed BPMN files.
+        Entries are keyed by the hash of the BPMN file content, and stored in a subdirectory per parser configuration,
+        i.e. changing the parser configuration or the file content invalidates the entry.
+        :param cache_dir: directory where the cache entries are stored
+        :param parser_config: parser options that influence the parsing result
+        """
+        config = {"version": CACHE_VERSION, **parser_config}
+        config_json = json.dumps(config, sort_keys=True, default=sorted)
+        config_hash = hashlib.sha1(config_json.encode()).hexdigest()[:16]
+
+        cache_dir = Path(cache_dir) if isinstance(cache_dir, str) else cache_dir
+        self.entries_dir = cache_dir / config_hash
+
+    def get_or_parse(
+            self,
+            bpmn_path: Path,
+            parse_source: Callable[[Path, BinaryIO], Tuple[Optional[float], List[Annotation]]],
+    ) -> Tuple[Optional[float], List[Annotation]]:
+        """
+        :param parse_source: called with bpmn_path and a file object of its content if there is no cache entry,
+                             returns the annotation background width and the annotations
+        :return: the annotation background width (None if the file has no meta comment) and the annotations,
+                 either from the cache or parsed with parse_source
+        """
+        bpmn_bytes = bpmn_path.read_bytes()
+        entry_path = self.entries_dir / f"{hashlib.sha1(bpmn_bytes).hexdigest()}.pkl"
+
+        if entry_path.exists():
+            try:
+                with entry_path.open("rb") as f:
+                    background_width, columnar_anns = pickle.load(f)
+                return background_width, columnar_anns.to_anns()
+            except (OSError, EOFError, pickle.UnpicklingError) as e:
+                _logger.warning("%s: ignoring invalid cache entry %s: %s", bpmn_path.name, entry_path, e)
+
+        background_width, anns = parse_source(bpmn_path, io.BytesIO(bpmn_bytes))
+        self._write_entry(entry_path, (background_width, ColumnarAnnotations.from_anns(anns)))
+        return background_width, anns
+
+    def _write_entry(self, entry_path: Path, entry):
+        self.entries_dir.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first so that concurrent workers never read partially written entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.entries_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, entry_path)
+
@@ -0,0 +1,180 @@
+import dataclasses
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from yamlu.img import AnnotatedImage, Annotation, BoundingBox
+
+from pybpmn.img import LazyAnnotatedImage
+
+WAYPOINTS_FIELD = "waypoints"
+
+
+@dataclass
+class ColumnarAnnotations:
+    """
+    Columnar representation of a list of annotations, which is much cheaper to store and pickle:
+    - category_ids: (N,) indices into category_names
+    - bbs: (N,4) bounding boxes in tlbr format
+    - bb_allow_neg_coords: (N,) allow_neg_coord of the bounding boxes
+    - bb_coord_type_ids: (N,4) indices into coord_types, the types of the tlbr coordinates (e.g. int or np.float64)
+    - waypoints: (M,2) waypoints of all annotations,
+      the waypoints of annotation i are waypoints[waypoint_offsets[i]:waypoint_offsets[i + 1]]
+    - waypoint_type_ids: (N,) indices into coord_types, the dtype of the waypoints of annotation i
+    - relations: relation field name -> (N,) index of the related annotation (-1 if not set)
+    - fields: field name -> (N,) list of values of the remaining fields (None if not set)
+    - field_orders, field_order_idxs: the (ordered) fields of annotation i are field_orders[field_order_idxs[i]]
+    """
+    category_names: List[str]
+    category_ids: np.ndarray
+    bbs: np.ndarray
+    bb_allow_neg_coords: np.ndarray
+    bb_coord_type_ids: np.ndarray
+    waypoints: np.ndarray
+    waypoint_offsets: np.ndarray
+    waypoint_type_ids: np.ndarray
+    coord_types: List[type]
+    relations: Dict[str, np.ndarray]
+    fields: Dict[str, List[Any]]
+    field_orders: List[Tuple[str, ...]]
+    field_order_idxs: np.ndarray
+
+    def __len__(self):
+        return len(self.category_ids)
+
+    @property
+    def categories(self) -> List[str]:
+        return [self.category_names[i] for i in self.category_ids]
+
+    def get_waypoints(self, idx: int) -> Optional[np.ndarray]:
+        start, end = self.waypoint_offsets[idx], self.waypoint_offsets[idx + 1]
+        if start == end:
+            return None
+        wps = self.waypoints[start:end]
+        return wps.astype(self.coord_types[self.waypoint_type_ids[idx]])
+
+    def replace_categories(self, categories: Sequence[str]) -> "ColumnarAnnotations":
+        """:return: a copy with the given category per annotation, e.g. the translated categories of a dataset"""
+        assert len(categories) == len(self), f"expected {len(self)} categories, got {len(categories)}"
+        category_names = {}
+        category_ids = np.array([category_names.setdefault(c, len(category_names)) for c in categories], dtype=np.int32)
+        return dataclasses.replace(self, category_names=list(category_names.keys()), category_ids=category_ids)
+
+    def copy_field(self, field: str, new_field: str) -> "ColumnarAnnotations":
+        """:return: a copy where new_field is set to the value of field, same as a.new_field = a.field per annotation"""
+        assert field in self.fields, f"{field} is not a (non-relation) field"
+        new_values = list(self.fields.get(new_field, [None] * len(self)))
+        field_order_to_idx = {}
+        field_order_idxs = np.zeros_like(self.field_order_idxs)
+        for i, order_idx in enumerate(self.field_order_idxs):
+            field_order = self.field_orders[order_idx]
+            if field in field_order:
+                new_values[i] = self.fields[field][i]
+                if new_field not in field_order:
+                    field_order = field_order + (new_field,)
+            field_order_idxs[i] = field_order_to_idx.setdefault(field_order, len(field_order_to_idx))
+
+        return dataclasses.replace(
+            self,
+            fields={**self.fields, new_field: new_values},
+            field_orders=list(field_order_to_idx.keys()),
+            field_order_idxs=field_order_idxs,
+        )
+
+    @classmethod
+    def from_anns(cls, anns: List[Annotation]) -> "ColumnarAnnotations":
+        n = len(anns)
+        ann_id_to_idx = {id(a): i for i, a in enumerate(anns)}
+
+        category_names = {}
+        category_ids = np.zeros(n, dtype=np.int32)
+        field_orders = {}
+        field_order_idxs = np.zeros(n, dtype=np.int32)
+        wp_arrays = []
+        wp_offsets = np.zeros(n + 1, dtype=np.int64)
+        coord_types = {}
+        bb_coord_type_ids = np.zeros((n, 4), dtype=np.int8)
+        wp_type_ids = np.zeros(n, dtype=np.int8)
+        relations = {}
+        fields = {}
+        for i, a in enumerate(anns):
+            category_ids[i] = category_names.setdefault(a.category, len(category_names))
+            bb_coord_type_ids[i] = [coord_types.setdefault(type(v), len(coord_types)) for v in a.bb.tlbr]
+
+            extra_fields = a.extra_fields
+            field_order_idxs[i] = field_orders.setdefault(tuple(extra_fields.keys()), len(field_orders))
+
+            wps = extra_fields.pop(WAYPOINTS_FIELD, None)
+            if wps is not None:
+                wp_arrays.append(wps)
+                wp_type_ids[i] = coord_types.setdefault(wps.dtype.type, len(coord_types))
+            wp_offsets[i + 1] = wp_offsets[i] + (0 if wps is None else len(wps))
+
+            for k, v in extra_fields.items():
+                if isinstance(v, Annotation):
+                    rel_idxs = relations.setdefault(k, np.full(n, -1, dtype=np.int32))
+                    rel_idxs[i] = ann_id_to_idx[id(v)]
+                else:
+                    fields.setdefault(k, [None] * n)[i] = v
+
+        return cls(
+            category_names=list(category_names.keys()),
+            category_ids=category_ids,
+            bbs=np.array([a.bb.tlbr for a in anns], dtype=np.float64).reshape(n, 4),
+            bb_allow_neg_coords=np.array([a.bb.allow_neg_coord for a in anns], dtype=bool),
+            bb_coord_type_ids=bb_coord_type_ids,
+            waypoints=np.concatenate(wp_arrays).astype(np.float64) if wp_arrays else np.zeros((0, 2)),
+            waypoint_offsets=wp_offsets,
+            waypoint_type_ids=wp_type_ids,
+            coord_types=list(coord_types.keys()),
+            relations=relations,
+            fields=fields,
+            field_orders=list(field_orders.keys()),
+            field_order_idxs=field_order_idxs,
+        )
+
+    def to_anns(self) -> List[Annotation]:
+        """inverse operation of from_anns, the types of the coordinates are restored as well"""
+        anns = []
+        for i, tlbr in enumerate(self.bbs.tolist()):
+            tlbr = [self.coord_types[type_id](v) for type_id, v in zip(self.bb_coord_type_ids[i], tlbr)]
+            bb = BoundingBox(*tlbr, allow_neg_coord=bool(self.bb_allow_neg_coords[i]))
+            anns.append(Annotation(self.category_names[self.category_ids[i]], bb))
+        for i, a in enumerate(anns):
+            for k in self.field_orders[self.field_order_idxs[i]]:
+                if k == WAYPOINTS_FIELD:
+                    a.set(k, self.get_waypoints(i))
+                elif k in self.relations and self.relations[k][i] >= 0:
+                    a.set(k, anns[self.relations[k][i]])
+                else:
+                    a.set(k, self.fields[k][i])
+        return anns
+
+
+@dataclass
+class ColumnarAnnotatedImage:
+    filename: str
+    width: int
+    height: int
+    annotations: ColumnarAnnotations
+    img_path: Optional[Path] = None
+    # the image is decoded at width and height, see LazyAnnotatedImage
+    resize: bool = False
+
+    @classmethod
+    def from_annotated_image(cls, ai: AnnotatedImage, img_path: Optional[Path] = None) -> "ColumnarAnnotatedImage":
+        anns = ColumnarAnnotations.from_anns(ai.annotations)
+        img_path = getattr(ai, "img_path", None) if img_path is None else img_path
+        resize = getattr(ai, "resize", False)
+        return cls(ai.filename, width=ai.width, height=ai.height, annotations=anns, img_path=img_path, resize=resize)
+
+    def to_annotated_image(self) -> AnnotatedImage:
+        """the image is read lazily from img_path, see LazyAnnotatedImage"""
+        anns = self.annotations.to_anns()
+        return LazyAnnotatedImage(
+            self.filename, self.width, self.height, annotations=anns, img_path=self.img_path, resize=self.resize
+        )
+
+    def __len__(self):
+        return len(self.annotations)
@@ -8,6 +8,8 @@ ARROW_PREV_REL = "arrow_prev"
 TEXT_BELONGS_TO_REL = "text_belongs_to"
 ARROW_KEYPOINT_FIELDS = ("tail", "head")
 ARROW_RELATIONS = (ARROW_PREV_REL, ARROW_NEXT_REL)
+# BPMN model element attributes of the arrow relations
+BPMN_ATTRIB_TO_RELATION = {"sourceRef": ARROW_PREV_REL, "targetRef": ARROW_NEXT_REL}
 
 # UML-Extension constants
 DEFAULT_MODE = Mode.UML_CLASS
@@ -1,21 +1,23 @@
 import logging
 from collections import defaultdict
 from pathlib import Path
-from typing import Dict, List, Union
+from typing import Dict, Iterator, List, Union
 
 import yamlu
 from yamlu.coco import Dataset
 from yamlu.img import AnnotatedImage
 
+from pybpmn.columnar import ColumnarAnnotatedImage
 from pybpmn.constants import ARROW_KEYPOINT_FIELDS, RELATIONS
 from pybpmn.parser import BpmnParser
+from pybpmn.prefetch import iter_split
 from pybpmn.syntax import (
     BPMNDI_EDGE_CATEGORIES,
     CATEGORY_GROUPS,
     CATEGORY_TO_LONG_NAME,
     EVENT_CATEGORY_TO_NO_POS_TYPE,
 )
-from pybpmn.util import split_img_id
+from pybpmn.util import create_img_path_index, split_img_id
 
 _logger = logging.getLogger(__name__)
 
@@ -37,6 +39,7 @@ class HdBpmnDataset(Dataset):
         self.category_translate_dict = category_translate_dict
 
         self.split_to_bpmn_paths = self.get_split_to_bpmn_paths()
+        self.img_id_to_paths = create_img_path_index(self.images_root, subdir_depth=1)
         self.bpmn_parser = BpmnParser(**parser_kwargs)
         super().__init__(
             dataset_path=coco_dataset_root,
@@ -67,6 +70,24 @@ class HdBpmnDataset(Dataset):
 
         return ai
 
+    def get_split_columnar_ann_img(self, split: str, idx: int) -> ColumnarAnnotatedImage:
+        """
+        Same as get_split_ann_img, but in columnar format (see DiagramParser.parse_bpmn_img_columnar),
+        i.e. only the image header is read, independent of the lazy_img option of the parser
+        """
+        bpmn_path = self.split_to_bpmn_paths[split][idx]
+        ai = self.bpmn_parser.parse_bpmn_img_columnar(bpmn_path, self.get_img_path(bpmn_path.stem))
+        anns = ai.annotations
+        if "id" in anns.fields:
+            # "id" is reserved in coco, therefore use other field name
+            anns = anns.copy_field("id", "bpmn_id")
+        ai.annotations = anns.replace_categories([self.category_translate_dict.get(c, c) for c in anns.categories])
+        return ai
+
+    def iter_split(self, split: str, **kwargs) -> Iterator[AnnotatedImage]:
+        """iterates over the annotated images of a split with background prefetching, see prefetch.iter_split"""
+        return iter_split(self, split, **kwargs)
+
     @property
     def annotations_root(self):
         return self.hdbpmn_root / "data" / "annotations"
@@ -76,9 +97,9 @@ class HdBpmnDataset(Dataset):
         return self.hdbpmn_root / "data" / "images"
 
     def get_img_path(self, img_id: str):
-        img_paths = yamlu.glob(self.images_root, f"*/{img_id}.*")
+        img_paths = self.img_id_to_paths.get(img_id, [])
         assert len(img_paths) == 1, f"{img_id}: {img_paths}"
-        return img_paths[0]
+        return self.images_root / img_paths[0]
 
     def _get_all_bpmn_paths(self) -> List[Path]:
         bpmn_paths = yamlu.glob(self.annotations_root, "**/*.bpmn")
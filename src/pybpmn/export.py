@@ -0,0 +1,793 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import traceback
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from tqdm import tqdm
+from yamlu.coco import CocoDatasetExport, CocoJsonExporter, Dataset
+from yamlu.img import AnnotatedImage
+
+from pybpmn.batch import effective_n_jobs
+from pybpmn.profiling import Profiler, get_profiler, profile_stage
+
+_logger = logging.getLogger(__name__)
+
+# increment when the format of the incremental export manifest changes
+MANIFEST_VERSION = 1
+# increment when the format of the partial COCO files of sharded exports changes
+SHARD_VERSION = 1
+# directory of the partial COCO files of sharded exports, next to the split COCO JSON files
+SHARDS_DIR_NAME = "shards"
+# directory of the journals of checkpointed exports, next to the split COCO JSON files
+JOURNAL_DIR_NAME = ".journal"
+# file name suffix of the images written with write_ann_img (default of AnnotatedImage.save_with_anns)
+ANN_IMG_SUFFIX = "_bb.jpg"
+
+# exporter of the current worker process, set once per worker by _init_worker
+_worker_exporter: Optional["BpmnCocoDatasetExport"] = None
+# whether the current worker process records its stages and sends them back to the parent process
+_worker_profile = False
+
+
+class BpmnCocoDatasetExport(CocoDatasetExport):
+    """
+    CocoDatasetExport that can additionally export several splits with a single process pool (see dump_splits)
+    """
+
+    def __init__(
+            self,
+            ds: Dataset,
+            stream_json: bool = False,
+            incremental: bool = False,
+            shard: Optional[Tuple[int, int]] = None,
+            checkpoint: bool = False,
+            resume: bool = False,
+            checkpoint_interval: int = 100,
+            ndigits: int = 3,
+            **kwargs,
+    ):
+        """
+        :param stream_json: write the COCO JSON image by image with a StreamingCocoJsonWriter,
+                            instead of keeping all annotated images of a split in memory.
+                            dump_split and dump_splits then return None.
+        :param incremental: only process the items whose BPMN file, image or export options changed since the last
+                            export, and reuse the images and COCO records of the other items (see dump_splits).
+                            dump_split and dump_splits then return None.
+        :param shard: (shard index, number of shards): only export the items of a split that belong to this shard
+                      (see get_shard), and write their COCO records to a partial COCO file in the shards directory.
+                      Image and annotation ids are the same as in an export of all items,
+                      use merge_coco_shards to combine the partial files of all shards into the split COCO JSON.
+                      Existing images are not removed, since shards may write to the same split directory.
+                      dump_split and dump_splits then return None.
+        :param checkpoint: commit the COCO records of completed items to a journal in the COCO output directory
+                           every checkpoint_interval items, so that an interrupted export can be resumed.
+                           Items that fail are written to an error report (<split>_errors.json)
+                           instead of aborting the export, and are left out of the COCO JSON.
+                           dump_split and dump_splits then return None.
+        :param resume: continue a checkpointed export from its journal: only the items that are not committed yet
+                       (including the failed ones) are processed. Implies checkpoint.
+        :param checkpoint_interval: number of completed items after which the journal is committed
+        """
+        super().__init__(ds, ndigits=ndigits, **kwargs)
+        # joblib accepts e.g. n_jobs=-1, ProcessPoolExecutor does not
+        self.n_jobs = effective_n_jobs(self.n_jobs)
+        checkpoint = checkpoint or resume
+        if shard is not None:
+            shard_idx, n_shards = shard
+            if not 0 <= shard_idx < n_shards:
+                raise ValueError(f"Invalid shard {shard_idx}/{n_shards}, expected 0 <= shard index < number of shards")
+        if sum([stream_json, incremental, shard is not None, checkpoint]) > 1:
+            raise ValueError("Only one of stream_json, incremental, shard and checkpoint/resume can be used")
+        assert checkpoint_interval > 0, f"checkpoint_interval must be positive: {checkpoint_interval}"
+        self.stream_json = stream_json
+        self.incremental = incremental
+        self.shard = shard
+        self.checkpoint = checkpoint
+        self.resume = resume
+        self.checkpoint_interval = checkpoint_interval
+        self.ndigits = ndigits
+
+    def dump_split(self, split: str):
+        if self.stream_json or self.incremental or self.shard is not None or self.checkpoint:
+            return self.dump_splits([split])
+        if get_profiler() is not None:
+            # the joblib workers of CocoDatasetExport.dump_split cannot send their recorded stages back
+            return self.dump_splits([split])[split]
+        return super().dump_split(split)
+
+    def dump_splits(self, splits: List[str]) -> Optional[Dict[str, List[AnnotatedImage]]]:
+        """
+        Same as calling dump_split for each split, but the images of all splits are processed by one process pool.
+        The exporter (including the dataset) is sent to each worker once instead of once per image.
+
+        In incremental mode, a manifest with the state of the BPMN and image file of each item and its COCO records
+        is kept next to the split directory. The resulting COCO JSON is the same as the one of a full export.
+        """
+        if self.incremental:
+            self._dump_splits_incremental(splits)
+            return None
+        if self.shard is not None:
+            self._dump_splits_shard(splits)
+            return None
+        if self.checkpoint:
+            self._dump_splits_checkpointed(splits)
+            return None
+
+        _logger.info("%s: starting splits=%s, write_img=%s, write_ann_img=%s, sample=%s, random_sample=%s",
+                     self.ds.name, splits, self.write_img, self.write_ann_img, self.sample, self.random_sample)
+
+        tasks = []
+        for split in splits:
+            assert split in self.ds.splits, f"{split} not in {self.ds.splits}"
+            split_path, ann_imgs_path = self._create_split_dirs(split)
+            tasks.extend((idx, split, split_path, ann_imgs_path) for idx in self._split_idxs(split))
+
+        if self.stream_json:
+            with ExitStack() as stack:
+                writers = {s: stack.enter_context(StreamingCocoJsonWriter(self.coco_json_exporter, s)) for s in splits}
+                for (_, split, _, _), ann_img in zip(tasks, self._iter_dump_images(tasks)):
+                    with profile_stage("write_coco_json"):
+                        writers[split].write(ann_img)
+            return None
+
+        split_to_ann_imgs = {split: [] for split in splits}
+        for (_, split, _, _), ann_img in zip(tasks, self._iter_dump_images(tasks)):
+            split_to_ann_imgs[split].append(ann_img)
+
+        for split, ann_imgs in split_to_ann_imgs.items():
+            with profile_stage("write_coco_json"):
+                self.coco_json_exporter.dump_split_coco_json(ann_imgs, split)
+
+        return split_to_ann_imgs
+
+    def dump_image(self, idx: int, split: str, split_path: Path, ann_imgs_path: Path) -> AnnotatedImage:
+        """same as CocoDatasetExport.dump_image, but records its stages with the active profiler"""
+        if get_profiler() is None:
+            return super().dump_image(idx, split, split_path, ann_imgs_path)
+
+        bpmn_path = self.ds.split_to_bpmn_paths[split][idx]
+        with profile_stage("dump_image", bpmn_path):
+            with profile_stage("get_split_ann_img", bpmn_path):
+                ann_img = self.ds.get_split_ann_img(split, idx)
+
+            if self.write_img:
+                # images of lazy parsers are only decoded here
+                with profile_stage("decode_img", bpmn_path):
+                    img = ann_img.img
+                with profile_stage("write_img", bpmn_path):
+                    img.save(split_path / ann_img.filename)
+
+            if self.write_ann_img:
+                with profile_stage("write_ann_img", bpmn_path):
+                    ann_img.save_with_anns(ann_imgs_path)
+
+            del ann_img.img
+        return ann_img
+
+    def _iter_dump_images(
+            self, tasks: List[tuple], catch_errors: bool = False
+    ) -> Iterator[Union[AnnotatedImage, Exception]]:
+        """
+        yields the annotated images in task order, with a bounded number of pending tasks
+        :param catch_errors: yield the exception of a task that failed instead of raising it.
+                             A crashed worker process (BrokenProcessPool) is still raised.
+        """
+        if self.n_jobs == 1:
+            for task in tqdm(tasks):
+                try:
+                    yield self.dump_image(*task)
+                except Exception as e:
+                    if not catch_errors:
+                        raise
+                    yield e
+            return
+
+        profiler = get_profiler()
+        max_pending = 4 * self.n_jobs
+        initargs = (self, profiler is not None)
+
+        def get_result(future: Future) -> Union[AnnotatedImage, Exception]:
+            try:
+                return _merge_worker_profiler(future.result(), profiler)
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                if not catch_errors:
+                    raise
+                return e
+
+        with ProcessPoolExecutor(self.n_jobs, initializer=_init_worker, initargs=initargs) as executor:
+            pending = deque()
+            for task in tqdm(tasks):
+                pending.append(executor.submit(_dump_image_in_worker, *task))
+                if len(pending) >= max_pending:
+                    yield get_result(pending.popleft())
+            while len(pending) > 0:
+                yield get_result(pending.popleft())
+
+    def _dump_splits_incremental(self, splits: List[str]):
+        _logger.info("%s: starting incremental export of splits=%s", self.ds.name, splits)
+        options = self._export_options()
+
+        tasks = []
+        split_to_entries = {}
+        split_to_dirs = {}
+        for split in splits:
+            assert split in self.ds.splits, f"{split} not in {self.ds.splits}"
+            split_path, ann_imgs_path = self._create_split_dirs(split, remove_existing=False)
+            split_to_dirs[split] = split_path, ann_imgs_path
+
+            manifest = self._read_manifest(split_path, split)
+            if manifest.get("options") != options:
+                manifest = {"items": {}}
+
+            entries = {}
+            for idx in self._split_idxs(split):
+                bpmn_path = self.ds.split_to_bpmn_paths[split][idx]
+                img_path = self.ds.get_img_path(bpmn_path.stem)
+                key = str(bpmn_path.relative_to(self.ds.annotations_root))
+
+                entry = manifest["items"].get(key)
+                if entry is not None and self._is_entry_unchanged(
+                        entry, bpmn_path, img_path, split_path, ann_imgs_path
+                ):
+                    entries[key] = entry
+                else:
+                    entries[key] = None
+                    tasks.append((idx, split, split_path, ann_imgs_path))
+
+            n_deleted = len(set(manifest["items"].keys()).difference(entries.keys()))
+            _logger.info("%s: %d unchanged, %d new or modified, %d deleted items", split,
+                         sum(e is not None for e in entries.values()), sum(e is None for e in entries.values()),
+                         n_deleted)
+            split_to_entries[split] = entries
+
+        for (idx, split, _, _), ann_img in zip(tasks, self._iter_dump_images(tasks)):
+            bpmn_path = self.ds.split_to_bpmn_paths[split][idx]
+            img_path = self.ds.get_img_path(bpmn_path.stem)
+            key = str(bpmn_path.relative_to(self.ds.annotations_root))
+            split_to_entries[split][key] = self._create_entry(ann_img, bpmn_path, img_path)
+
+        for split, entries in split_to_entries.items():
+            split_path, ann_imgs_path = split_to_dirs[split]
+            self._remove_stale_files(entries.values(), split_path, ann_imgs_path)
+
+            with profile_stage("write_coco_json"):
+                images, annotations = [], []
+                for img_id, entry in enumerate(entries.values()):
+                    images.append({**entry["image"], "id": img_id})
+                    annotations.extend(self._with_img_id(coco_ann, img_id) for coco_ann in entry["annotations"])
+                self._write_coco_json(split, images, annotations)
+            self._write_manifest(split_path, split, {"options": options, "items": entries})
+
+    def _dump_splits_shard(self, splits: List[str]):
+        shard_idx, n_shards = self.shard
+        _logger.info("%s: starting shard %d/%d of splits=%s", self.ds.name, shard_idx, n_shards, splits)
+
+        tasks = []
+        img_ids = []
+        split_to_n_imgs = {}
+        for split in splits:
+            assert split in self.ds.splits, f"{split} not in {self.ds.splits}"
+            split_path, ann_imgs_path = self._create_split_dirs(split, remove_existing=False)
+            split_idxs = self._split_idxs(split)
+            split_to_n_imgs[split] = len(split_idxs)
+            # the image id of an item is its position among all items of the split, independent of the shard
+            for img_id, idx in enumerate(split_idxs):
+                if get_shard(self.ds.split_to_bpmn_paths[split][idx].stem, n_shards) == shard_idx:
+                    tasks.append((idx, split, split_path, ann_imgs_path))
+                    img_ids.append(img_id)
+
+        split_to_records = {split: ([], []) for split in splits}
+        for (_, split, _, _), img_id, ann_img in zip(tasks, img_ids, self._iter_dump_images(tasks)):
+            images, annotations = split_to_records[split]
+            images.append(_create_image_dict(ann_img, img_id))
+            # noinspection PyProtectedMember
+            annotations.extend(self.coco_json_exporter._create_img_anns((img_id, ann_img)))
+
+        for split, (images, annotations) in split_to_records.items():
+            with profile_stage("write_coco_json"):
+                shard = {
+                    "version": SHARD_VERSION,
+                    "split": split,
+                    "shard": shard_idx,
+                    "n_shards": n_shards,
+                    "n_images": split_to_n_imgs[split],
+                    "indent": None if self.sample is None else 2,
+                    "images": images,
+                    "annotations": annotations,
+                    "categories": self.ds.coco_categories,
+                }
+                # noinspection PyProtectedMember
+                shards_dir = self.coco_json_exporter._split_coco_json_path(split).parent / SHARDS_DIR_NAME
+                shard_path = shards_dir / f"{split}_{shard_idx}_of_{n_shards}.json"
+                _write_json_atomic(shard_path, shard)
+            _logger.info("%s: wrote %d of %d images to %s", split, len(images), split_to_n_imgs[split], shard_path)
+
+    def _dump_splits_checkpointed(self, splits: List[str]):
+        _logger.info("%s: starting checkpointed export of splits=%s, resume=%s", self.ds.name, splits, self.resume)
+        options = self._export_options()
+
+        tasks = []
+        split_to_entries = {}
+        split_to_journal = {}
+        with ExitStack() as stack:
+            for split in splits:
+                assert split in self.ds.splits, f"{split} not in {self.ds.splits}"
+                split_path, ann_imgs_path = self._create_split_dirs(split, remove_existing=not self.resume)
+
+                # noinspection PyProtectedMember
+                journal_path = self.coco_json_exporter._split_coco_json_path(split).parent / JOURNAL_DIR_NAME
+                journal = stack.enter_context(ExportJournal(journal_path / f"{split}.jsonl", options, self.resume))
+                split_to_journal[split] = journal
+
+                entries = {}
+                for idx in self._split_idxs(split):
+                    key = self._item_key(split, idx)
+                    entries[key] = journal.entries.get(key)
+                    if entries[key] is None:
+                        tasks.append((idx, split, split_path, ann_imgs_path))
+                _logger.info("%s: %d committed, %d remaining items", split,
+                             sum(e is not None for e in entries.values()), sum(e is None for e in entries.values()))
+                split_to_entries[split] = entries
+
+            n_completed = 0
+            for (idx, split, _, _), result in zip(tasks, self._iter_dump_images(tasks, catch_errors=True)):
+                key = self._item_key(split, idx)
+                if isinstance(result, Exception):
+                    _logger.error("%s: failed to export %s: %r", split, key, result)
+                    entry = {"error": repr(result), "traceback": "".join(traceback.format_exception(
+                        type(result), result, result.__traceback__))}
+                else:
+                    # noinspection PyProtectedMember
+                    entry = {
+                        "image": _create_image_dict(result, 0),
+                        "annotations": self.coco_json_exporter._create_img_anns((0, result)),
+                    }
+                split_to_entries[split][key] = split_to_journal[split].add(key, entry)
+
+                n_completed += 1
+                if n_completed % self.checkpoint_interval == 0:
+                    for journal in split_to_journal.values():
+                        journal.commit()
+
+        for split, entries in split_to_entries.items():
+            errors = [{"bpmn": key, **entry} for key, entry in entries.items() if "error" in entry]
+            with profile_stage("write_coco_json"):
+                images, annotations = [], []
+                for img_id, entry in enumerate(e for e in entries.values() if "error" not in e):
+                    images.append({**entry["image"], "id": img_id})
+                    annotations.extend(self._with_img_id(coco_ann, img_id) for coco_ann in entry["annotations"])
+                self._write_coco_json(split, images, annotations)
+
+            # noinspection PyProtectedMember
+            error_report_path = self.coco_json_exporter._split_coco_json_path(split).with_name(f"{split}_errors.json")
+            if len(errors) > 0:
+                _write_json_atomic(error_report_path, errors)
+                _logger.error("%s: %d of %d items failed, see %s. Use resume to retry them",
+                              split, len(errors), len(entries), error_report_path)
+            else:
+                if error_report_path.exists():
+                    error_report_path.unlink()
+                # the export of the split is complete, so there is nothing left to resume
+                split_to_journal[split].journal_path.unlink()
+
+    def _item_key(self, split: str, idx: int) -> str:
+        return str(self.ds.split_to_bpmn_paths[split][idx].relative_to(self.ds.annotations_root))
+
+    def _export_options(self) -> Dict[str, Any]:
+        """options that influence the exported images and COCO records"""
+        options = {
+            "version": MANIFEST_VERSION,
+            "dataset": self.ds.__class__.__name__,
+            "parser": self.ds.bpmn_parser.get_parse_config(),
+            "category_translate_dict": getattr(self.ds, "category_translate_dict", None),
+            "unite_categories": getattr(self.ds, "unite_categories", None),
+            "split_association": getattr(self.ds, "split_association", None),
+            "coco_categories": self.ds.coco_categories,
+            "keypoint_fields": list(self.ds.keypoint_fields),
+            "relation_fields": list(self.ds.relation_fields),
+            "write_img": self.write_img,
+            "write_ann_img": self.write_ann_img,
+            "ndigits": self.ndigits,
+        }
+        # json round trip, so that the options compare equal to the ones read from a manifest or journal.
+        # Sets (e.g. excluded_categories) are stored as sorted lists, as in ParseCache
+        return json.loads(json.dumps(options, default=sorted))
+
+    def _create_entry(self, ann_img: AnnotatedImage, bpmn_path: Path, img_path: Path) -> Dict[str, Any]:
+        # COCO records are stored with img_id 0, and are shifted to the actual img_id when writing the COCO JSON
+        # noinspection PyProtectedMember
+        coco_anns = self.coco_json_exporter._create_img_anns((0, ann_img))
+        entry = {
+            "bpmn": _file_state(bpmn_path),
+            "img": _file_state(img_path),
+            "image": {"file_name": ann_img.filename, "height": int(ann_img.height), "width": int(ann_img.width)},
+            "annotations": coco_anns,
+        }
+        # json round trip, so that records of new and reused entries are identical
+        return json.loads(json.dumps(entry))
+
+    def _is_entry_unchanged(self, entry, bpmn_path: Path, img_path: Path, split_path: Path, ann_imgs_path: Path):
+        if not _is_file_unchanged(bpmn_path, entry["bpmn"]) or not _is_file_unchanged(img_path, entry["img"]):
+            return False
+        file_name = entry["image"]["file_name"]
+        if self.write_img and not (split_path / file_name).exists():
+            return False
+        if self.write_ann_img and not (ann_imgs_path / f"{Path(file_name).stem}{ANN_IMG_SUFFIX}").exists():
+            return False
+        return True
+
+    def _with_img_id(self, coco_ann: Dict[str, Any], img_id: int) -> Dict[str, Any]:
+        # annotation ids are created as img_id * 1000 + i, see CocoJsonExporter._create_img_anns
+        id_fields = {"id", *self.ds.relation_fields}
+        return {
+            k: img_id if k == "image_id" else v + img_id * 1000 if k in id_fields and v is not None else v
+            for k, v in coco_ann.items()
+        }
+
+    def _remove_stale_files(self, entries, split_path: Path, ann_imgs_path: Path):
+        file_names = {e["image"]["file_name"] for e in entries}
+        if self.write_img:
+            for p in split_path.iterdir():
+                if p.name not in file_names:
+                    p.unlink()
+        if self.write_ann_img:
+            ann_img_names = {f"{Path(f).stem}{ANN_IMG_SUFFIX}" for f in file_names}
+            for p in ann_imgs_path.iterdir():
+                if p.name not in ann_img_names:
+                    p.unlink()
+
+    def _write_coco_json(self, split: str, images: List[Dict], annotations: List[Dict]):
+        """writes the same COCO JSON as CocoJsonExporter.dump_split_coco_json, but for already created records"""
+        # noinspection PyProtectedMember
+        coco_json_path = self.coco_json_exporter._split_coco_json_path(split)
+        _logger.info("Start dumping coco %d annotations to %s", len(images), coco_json_path)
+        coco = {"images": images, "annotations": annotations, "categories": self.ds.coco_categories}
+        coco_json_path.parent.mkdir(exist_ok=True, parents=True)
+        with coco_json_path.open("w") as f:
+            json.dump(coco, f, indent=None if self.sample is None else 2)
+
+    @staticmethod
+    def _manifest_path(split_path: Path, split: str) -> Path:
+        return split_path.parent / ".manifest" / f"{split}.json"
+
+    def _read_manifest(self, split_path: Path, split: str) -> Dict[str, Any]:
+        manifest_path = self._manifest_path(split_path, split)
+        if not manifest_path.exists():
+            return {"items": {}}
+        with manifest_path.open() as f:
+            return json.load(f)
+
+    def _write_manifest(self, split_path: Path, split: str, manifest: Dict[str, Any]):
+        _write_json_atomic(self._manifest_path(split_path, split), manifest)
+
+    def _create_split_dirs(self, split: str, remove_existing: bool = True):
+        split_path = self.create_split_path_dir(split, remove_existing_images=remove_existing and self.write_img)
+
+        ann_imgs_path = split_path.parent / f"{split}_annotated"
+        if self.write_ann_img:
+            ann_imgs_path.mkdir(exist_ok=True, parents=True)
+            if remove_existing:
+                # remove existing files in directory
+                for p in ann_imgs_path.iterdir():
+                    p.unlink()
+
+        return split_path, ann_imgs_path
+
+    def _split_idxs(self, split: str) -> List[int]:
+        """same sampling as CocoDatasetExport.dump_split"""
+        idxs = list(range(self.ds.split_n_imgs[split]))
+        if self.sample is not None and len(idxs) > self.sample:
+            if self.random_sample:
+                random.seed(0)
+                idxs = random.sample(idxs, self.sample)
+            else:
+                idxs = idxs[:self.sample]
+        return idxs
+
+
+class ExportJournal:
+    def __init__(self, journal_path: Path, options: Dict[str, Any], resume: bool):
+        """
+        Append-only JSON lines file with the entries (COCO records or error) of the completed items of a split.
+        The first line holds the export options, a journal of an export with other options is not resumed.
+        Entries are buffered and only written to the journal file by commit(), which is also called on exit.
+        Errors are not resumed, so that failed items are retried.
+        :param resume: read the committed entries of the existing journal, instead of starting a new one
+        """
+        self.journal_path = journal_path
+        self.options = options
+        self.resume = resume
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._buffer: List[str] = []
+        self._f = None
+
+    def __enter__(self) -> "ExportJournal":
+        self.journal_path.parent.mkdir(exist_ok=True, parents=True)
+        if self.resume and self.journal_path.exists():
+            self._read()
+
+        if len(self.entries) > 0:
+            self._f = self.journal_path.open("a")
+        else:
+            self._f = self.journal_path.open("w")
+            self._f.write(json.dumps({"options": self.options}) + "\n")
+            self._f.flush()
+        return self
+
+    def _read(self):
+        with self.journal_path.open() as f:
+            lines = f.readlines()
+        # the last line is incomplete if the export was interrupted while committing
+        if len(lines) > 0 and not lines[-1].endswith("\n"):
+            lines = lines[:-1]
+        if len(lines) == 0 or json.loads(lines[0]).get("options") != self.options:
+            _logger.warning("%s: export options changed, starting a new export", self.journal_path)
+            return
+        for line in lines[1:]:
+            record = json.loads(line)
+            if "error" in record["entry"]:
+                self.entries.pop(record["key"], None)
+            else:
+                self.entries[record["key"]] = record["entry"]
+        _logger.info("%s: resuming with %d committed items", self.journal_path, len(self.entries))
+
+    def add(self, key: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """:return: the entry after a json round trip, so that resumed and new entries are identical"""
+        line = json.dumps({"key": key, "entry": entry})
+        self._buffer.append(line + "\n")
+        return json.loads(line)["entry"]
+
+    def commit(self):
+        if len(self._buffer) == 0:
+            return
+        self._f.write("".join(self._buffer))
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._buffer = []
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # commit the completed items also if the export is interrupted
+        try:
+            self.commit()
+        finally:
+            self._f.close()
+
+
+class StreamingCocoJsonWriter:
+    def __init__(self, coco_json_exporter: CocoJsonExporter, split: str):
+        """
+        Writes the same COCO JSON file as CocoJsonExporter.dump_split_coco_json, but image by image,
+        so that memory usage does not depend on the split size.
+        Images are written to a temporary file next to the COCO JSON file,
+        annotations are spooled to another temporary file and appended when the writer is closed.
+        Only then the COCO JSON file is replaced (as in _write_json_atomic),
+        so that an interrupted export does not leave a truncated COCO JSON file behind.
+        """
+        self.coco_json_exporter = coco_json_exporter
+        self.coco_json_path = coco_json_exporter._split_coco_json_path(split)
+        self.tmp_path = self.coco_json_path.with_suffix(".tmp")
+        self.indent = None if coco_json_exporter.sample is None else 2
+
+        self.n_imgs = 0
+        self.n_anns = 0
+        self._f = None
+        self._anns_f = None
+
+    def __enter__(self) -> "StreamingCocoJsonWriter":
+        _logger.info("Start streaming coco annotations to %s", self.coco_json_path)
+        self.coco_json_path.parent.mkdir(exist_ok=True, parents=True)
+        self._f = self.tmp_path.open("w")
+        self._anns_f = tempfile.TemporaryFile("w+", dir=self.coco_json_path.parent)
+        self._f.write(self._dict_key_prefix("images", first=True) + "[")
+        return self
+
+    def write(self, ann_img: AnnotatedImage):
+        img_id = self.n_imgs
+        self._write_list_item(self._f, _create_image_dict(ann_img, img_id), self.n_imgs)
+        self.n_imgs += 1
+
+        # noinspection PyProtectedMember
+        for coco_ann in self.coco_json_exporter._create_img_anns((img_id, ann_img)):
+            self._write_list_item(self._anns_f, coco_ann, self.n_anns)
+            self.n_anns += 1
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        completed = False
+        try:
+            if exc_type is None:
+                self._f.write(self._list_suffix(self.n_imgs))
+                self._f.write(self._dict_key_prefix("annotations") + "[")
+                self._anns_f.seek(0)
+                shutil.copyfileobj(self._anns_f, self._f)
+                self._f.write(self._list_suffix(self.n_anns))
+                categories = self.coco_json_exporter.ds.coco_categories
+                self._f.write(self._dict_key_prefix("categories") + self._dumps(categories, 1))
+                self._f.write("}" if self.indent is None else "\n}")
+                completed = True
+        finally:
+            self._anns_f.close()
+            self._f.close()
+            if completed:
+                os.replace(self.tmp_path, self.coco_json_path)
+                _logger.info("Finished writing coco json with %d images and %d annotations to %s",
+                             self.n_imgs, self.n_anns, self.coco_json_path)
+            elif self.tmp_path.exists():
+                # the previous COCO JSON file (if any) is kept
+                self.tmp_path.unlink()
+
+    def _dumps(self, obj: Any, level: int) -> str:
+        """json.dumps of obj nested at the given level of the COCO dict"""
+        if self.indent is None:
+            return json.dumps(obj)
+        return json.dumps(obj, indent=self.indent).replace("\n", "\n" + " " * self.indent * level)
+
+    def _dict_key_prefix(self, key: str, first: bool = False) -> str:
+        if self.indent is None:
+            return ("{" if first else ", ") + f"{json.dumps(key)}: "
+        return ("{" if first else ",") + "\n" + " " * self.indent + f"{json.dumps(key)}: "
+
+    def _write_list_item(self, f, obj: Any, idx: int):
+        if self.indent is None:
+            f.write(("" if idx == 0 else ", ") + self._dumps(obj, 2))
+        else:
+            f.write(("" if idx == 0 else ",") + "\n" + " " * self.indent * 2 + self._dumps(obj, 2))
+
+    def _list_suffix(self, n_items: int) -> str:
+        if self.indent is None or n_items == 0:
+            return "]"
+        return "\n" + " " * self.indent + "]"
+
+
+def get_shard(bpmn_stem: str, n_shards: int) -> int:
+    """:return: the shard of an item, based on a hash of its BPMN file stem that is stable across machines"""
+    return int(hashlib.sha1(bpmn_stem.encode()).hexdigest(), 16) % n_shards
+
+
+def merge_coco_shards(coco_json_dir: Path, splits: Optional[List[str]] = None) -> Dict[str, Path]:
+    """
+    Combines the partial COCO files that the shards of a sharded export (see BpmnCocoDatasetExport)
+    wrote to the shards directory into the split COCO JSON files, without parsing anything.
+    The result is the same as the COCO JSON of an export without shards.
+    :param coco_json_dir: directory of the split COCO JSON files, i.e. the COCO dataset root or its sample directory
+    :param splits: splits to merge, defaults to all splits in the shards directory
+    :return: the path of the COCO JSON file of each merged split
+    """
+    shards_dir = Path(coco_json_dir) / SHARDS_DIR_NAME
+    split_to_shards = {}
+    for shard_path in sorted(shards_dir.glob("*.json")):
+        with shard_path.open() as f:
+            shard = json.load(f)
+        if shard.get("version") != SHARD_VERSION:
+            raise ValueError(f"{shard_path}: unsupported shard version {shard.get('version')}")
+        if splits is None or shard["split"] in splits:
+            split_to_shards.setdefault(shard["split"], []).append(shard)
+
+    missing_splits = set() if splits is None else set(splits).difference(split_to_shards.keys())
+    if len(split_to_shards) == 0 or len(missing_splits) > 0:
+        raise ValueError(f"{shards_dir}: missing the shards of splits {sorted(missing_splits) or splits}")
+
+    split_to_coco_json_path = {}
+    for split, shards in split_to_shards.items():
+        images, annotations = _merge_split_shards(split, shards)
+        first = shards[0]
+        coco = {"images": images, "annotations": annotations, "categories": first["categories"]}
+        coco_json_path = Path(coco_json_dir) / f"{split}.json"
+        with coco_json_path.open("w") as f:
+            json.dump(coco, f, indent=first["indent"])
+        _logger.info("%s: merged %d shards with %d images to %s", split, len(shards), len(images), coco_json_path)
+        split_to_coco_json_path[split] = coco_json_path
+    return split_to_coco_json_path
+
+
+def _merge_split_shards(split: str, shards: List[Dict[str, Any]]) -> Tuple[List[Dict], List[Dict]]:
+    """:return: the images and annotations of all shards, in the order of an export without shards"""
+    first = shards[0]
+    n_shards = first["n_shards"]
+    for shard in shards:
+        for key in ["n_shards", "n_images", "indent", "categories"]:
+            if shard[key] != first[key]:
+                raise ValueError(f"{split}: shard {shard['shard']} and {first['shard']} differ in {key}")
+    shard_idxs = sorted(shard["shard"] for shard in shards)
+    if shard_idxs != list(range(n_shards)):
+        missing = sorted(set(range(n_shards)).difference(shard_idxs))
+        raise ValueError(f"{split}: expected shards 0 to {n_shards - 1}, missing {missing}, got {shard_idxs}")
+
+    images = sorted((img for shard in shards for img in shard["images"]), key=lambda img: img["id"])
+    if [img["id"] for img in images] != list(range(first["n_images"])):
+        raise ValueError(f"{split}: the shards do not contain each of the {first['n_images']} images exactly once")
+
+    # annotations are grouped by image, in the order in which they were created
+    img_id_to_anns = {img["id"]: [] for img in images}
+    for shard in shards:
+        for ann in shard["annotations"]:
+            img_id_to_anns[ann["image_id"]].append(ann)
+    annotations = [ann for img in images for ann in img_id_to_anns[img["id"]]]
+    return images, annotations
+
+
+def _create_image_dict(ann_img: AnnotatedImage, img_id: int) -> Dict[str, Any]:
+    # same fields as yamlu.coco._create_images_dict
+    return {
+        "file_name": ann_img.filename,
+        "height": int(ann_img.height),
+        "width": int(ann_img.width),
+        "id": img_id,
+    }
+
+
+def _write_json_atomic(path: Path, obj: Any):
+    path.parent.mkdir(exist_ok=True, parents=True)
+    tmp_path = path.with_suffix(".tmp")
+    with tmp_path.open("w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def _file_state(path: Path) -> Dict[str, Any]:
+    stat = path.stat()
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha1": _sha1(path)}
+
+
+def _is_file_unchanged(path: Path, state: Dict[str, Any]) -> bool:
+    """compares mtime and size first, and only falls back to the content hash if the mtime changed"""
+    stat = path.stat()
+    if stat.st_size != state["size"]:
+        return False
+    if stat.st_mtime_ns == state["mtime_ns"]:
+        return True
+    if _sha1(path) != state["sha1"]:
+        return False
+    state["mtime_ns"] = stat.st_mtime_ns
+    return True
+
+
+def _sha1(path: Path) -> str:
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def _init_worker(exporter: BpmnCocoDatasetExport, profile: bool = False):
+    global _worker_exporter, _worker_profile
+    _worker_exporter = exporter
+    _worker_profile = profile
+
+
+def _dump_image_in_worker(
+        idx: int, split: str, split_path: Path, ann_imgs_path: Path
+) -> Tuple[AnnotatedImage, Optional[Profiler]]:
+    """:return: the annotated image, and the stages recorded while dumping it if the parent process profiles"""
+    try:
+        if not _worker_profile:
+            return _worker_exporter.dump_image(idx, split, split_path, ann_imgs_path), None
+
+        profiler = Profiler()
+        with profiler.activate():
+            ann_img = _worker_exporter.dump_image(idx, split, split_path, ann_imgs_path)
+        return ann_img, profiler
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            # exceptions are pickled to be sent to the parent, which fails e.g. for lxml's XMLSyntaxError.
+            # The traceback sent to the parent still contains the original exception as context.
+            raise RuntimeError(f"{type(e).__name__}: {e}")
+        raise
+
+
+def _merge_worker_profiler(result: Tuple[AnnotatedImage, Optional[Profiler]], profiler: Optional[Profiler]):
+    ann_img, worker_profiler = result
+    if worker_profiler is not None:
+        profiler.merge(worker_profiler)
+    return ann_img
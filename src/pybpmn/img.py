@@ -0,0 +1,90 @@
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import yamlu
+from PIL import Image
+from yamlu.img import AnnotatedImage, Annotation, exif_transpose
+
+EXIF_ORIENTATION_TAG = 0x0112
+# EXIF orientations for which yamlu.read_img transposes the image, i.e. swaps width and height
+TRANSPOSED_EXIF_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def read_img_size(img_path: Union[Path, str]) -> Tuple[int, int]:
+    """
+    Reads the (width, height) of an image from its header without decoding the pixel data.
+    The EXIF orientation is taken into account, i.e. the result equals yamlu.read_img(img_path).size
+    """
+    with Image.open(img_path) as img:
+        w, h = img.size
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG)
+    if orientation in TRANSPOSED_EXIF_ORIENTATIONS:
+        return h, w
+    return w, h
+
+
+def get_target_img_size(img_w: int, img_h: int, target_max_size: Optional[int]) -> Tuple[int, int]:
+    """:return: the (width, height) of an image downscaled so that its larger side is target_max_size at most"""
+    if target_max_size is None or max(img_w, img_h) <= target_max_size:
+        return img_w, img_h
+    scale = target_max_size / max(img_w, img_h)
+    return max(round(img_w * scale), 1), max(round(img_h * scale), 1)
+
+
+def read_img_resized(img_path: Union[Path, str], size: Tuple[int, int]) -> Image.Image:
+    """
+    Similar to yamlu.read_img(img_path).resize(size), but JPEGs are decoded in draft mode,
+    i.e. the decoder already downscales by a power of two to the smallest size that is at least the requested size.
+    This is considerably faster and needs less memory than decoding the full image.
+    The remaining downscaling (less than a factor of two for JPEGs) is done with (antialiased) bilinear filtering.
+    :param size: (width, height) after the EXIF orientation is applied
+    """
+    img = Image.open(img_path)
+    w, h = size
+    orientation = img.getexif().get(EXIF_ORIENTATION_TAG)
+    # the draft size refers to the stored image, before it is transposed
+    img.draft(img.mode, (h, w) if orientation in TRANSPOSED_EXIF_ORIENTATIONS else (w, h))
+    img = exif_transpose(img)
+    if img.size != (w, h):
+        img = img.resize((w, h), Image.BILINEAR)
+    return img
+
+
+class LazyAnnotatedImage(AnnotatedImage):
+    """
+    AnnotatedImage whose image is only read from img_path when the img attribute is accessed.
+    Width and height have to be known upfront, e.g. from read_img_size().
+    """
+
+    def __init__(
+            self,
+            filename: str,
+            width: int,
+            height: int,
+            annotations: List[Annotation],
+            img_path: Path,
+            resize: bool = False,
+    ):
+        """:param resize: the image is decoded at width and height (see read_img_resized) instead of its own size"""
+        self.img_path = img_path
+        self.resize = resize
+        super().__init__(filename, width=width, height=height, annotations=annotations)
+
+    @property
+    def img(self) -> Optional[Image.Image]:
+        if self._img is None and self.img_path is not None:
+            if self.resize:
+                self._img = read_img_resized(self.img_path, (self.width, self.height))
+            else:
+                self._img = yamlu.read_img(self.img_path)
+        return self._img
+
+    @img.setter
+    def img(self, img: Optional[Image.Image]):
+        self._img = img
+
+    @img.deleter
+    def img(self):
+        # same semantics as deleting the img of an AnnotatedImage: afterwards img is None
+        self._img = None
+        self.img_path = None
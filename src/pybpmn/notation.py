@@ -0,0 +1,29 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, FrozenSet, List
+
+# noinspection PyProtectedMember
+from lxml.etree import _Element as Element
+from yamlu.img import Annotation
+
+ShapeToAnns = Callable[[Element, Element], List[Annotation]]
+EdgeToAnns = Callable[[Element, Element, Dict[str, Annotation]], List[Annotation]]
+
+
+@dataclass(frozen=True)
+class Notation:
+    """
+    Rules of a diagram notation, which DiagramParser uses to convert the BPMNDI elements into annotations.
+    A new diagram type only needs a Notation and a DiagramParser subclass with its parser options.
+    """
+
+    name: str
+    # converts a BPMNShape and its model element to annotations
+    shape_to_anns: ShapeToAnns
+    # converts a BPMNEdge, its model element and the id to (non-label) shape annotation mapping to annotations
+    edge_to_anns: EdgeToAnns
+    # category of label annotations, which are neither connected by edges nor targets of belongs_to_rel
+    label_category: str
+    # relation of label-like annotations to the annotation they belong to, parsed as id and linked after parsing
+    belongs_to_rel: str
+    # categories of the annotations that have a belongs_to_rel
+    belongs_to_categories: FrozenSet[str]
@@ -1,34 +1,38 @@
+import functools
 import logging
 from pathlib import Path
-from typing import Dict, List, Optional, Set
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 import numpy as np
-import yamlu
-from lxml import etree
 # noinspection PyProtectedMember
 from lxml.etree import _Element as Element
-from yamlu.img import AnnotatedImage, Annotation, BoundingBox
+from yamlu.img import Annotation, BoundingBox
 
 from pybpmn import syntax
 from pybpmn.constants import (
     ARROW_NEXT_REL,
     ARROW_PREV_REL,
     ARROW_RELATIONS,
+    BPMN_ATTRIB_TO_RELATION,
     TEXT_BELONGS_TO_REL,
 )
+from pybpmn.base_parser import DiagramParser
+from pybpmn.notation import Notation
 from pybpmn.syntax import EVENT_DEFINITIONS
-from pybpmn.util import bounds_to_bb, to_int_or_float, get_omgdi_ns, parse_annotation_background_width
+from pybpmn.util import (
+    child_bounds_to_bb,
+    get_tag_without_ns,
+    parse_waypoints,
+)
 
 _logger = logging.getLogger(__name__)
 
-BPMN_ATTRIB_TO_RELATION = {"sourceRef": ARROW_PREV_REL, "targetRef": ARROW_NEXT_REL}
-
 
 def parse_bpmn_anns(bpmn_path: Path):
     return BpmnParser().parse_bpmn_anns(bpmn_path)
 
 
-class BpmnParser:
+class BpmnParser(DiagramParser):
     def __init__(
             self,
             arrow_min_wh: int = 20,
@@ -36,18 +40,29 @@ class BpmnParser:
             excluded_categories: Set[str] = None,
             excluded_label_categories: Set[str] = None,
             link_text_rel_two_way: bool = False,
+            lazy_img: bool = False,
+            cache_dir: Optional[Union[Path, str]] = None,
+            streaming: bool = False,
+            target_max_size: Optional[int] = None,
     ):
         """
         :param arrow_min_wh: pad edge bounding boxes so that their w and h is at least arrow_min_wh
                              when the image is scaled to img_max_size_ref
         :param img_max_size_ref: reference image size to consider for arrow_min_wh
         :param excluded_label_categories: categories for which label annotations should not be parsed
+        :param lazy_img: see DiagramParser
+        :param cache_dir: see DiagramParser
+        :param streaming: see DiagramParser
+        :param target_max_size: see DiagramParser
         """
         self.arrow_min_wh = arrow_min_wh
-        self.img_max_size_ref = img_max_size_ref
-        self.excluded_categories = {} if excluded_categories is None else excluded_categories
         self.excluded_label_categories = {} if excluded_label_categories is None else excluded_label_categories
         self.link_text_rel_two_way = link_text_rel_two_way
+        super().__init__(img_max_size_ref, excluded_categories, lazy_img, cache_dir, streaming, target_max_size)
+
+    @property
+    def notation(self) -> Notation:
+        return BPMN_NOTATION
 
     def _is_included_ann(self, a: Annotation) -> bool:
         if a.category in self.excluded_categories:
@@ -56,158 +71,91 @@ class BpmnParser:
             return False
         return True
 
-    # noinspection PyPropertyAccess
-    def parse_bpmn_img(self, bpmn_path: Path, img_path: Path) -> AnnotatedImage:
-        """
-        :param bpmn_path: path to the BPMN XML file
-        :param img_path: path to the corresponding BPMN image
-        """
-        img = yamlu.read_img(img_path)
-        img_w, img_h = img.size
-
-        img_w_annotation = parse_annotation_background_width(bpmn_path)
-        scale = img_w / img_w_annotation
-        arrow_min_wh_scaled = self.arrow_min_wh * max(img.size) / self.img_max_size_ref
-
-        try:
-            anns = self.parse_bpmn_anns(bpmn_path)
-            for a in anns:
-                a.bb = a.bb.scale(scale)
-
-                if a.category in syntax.BPMNDI_EDGE_CATEGORIES:
-                    a.bb = a.bb.pad_min_size(
-                        w_min=arrow_min_wh_scaled, h_min=arrow_min_wh_scaled
-                    )
-
-                if not a.bb.is_within_img(img_w, img_h):
-                    _logger.debug(
-                        "%s: clipping bb %s to img (%d,%d)",
-                        bpmn_path.name,
-                        a.bb,
-                        img_w,
-                        img_h,
-                    )
-                    a.bb = a.bb.clip_to_image(img_w, img_h)
-            for a in anns:
-                if "waypoints" in a:
-                    a.waypoints = a.waypoints * scale
-
-                    a.tail = a.waypoints[0]
-                    a.head = a.waypoints[-1]
-        except Exception as e:
-            _logger.error("Error while processing: %s", bpmn_path)
-            raise e
-
-        anns = [a for a in anns if self._is_included_ann(a)]
-
-        return AnnotatedImage(
-            img_path.name,
-            width=img.width,
-            height=img.height,
-            annotations=anns,
-            img=img,
-        )
-
-    def parse_bpmn_anns(self, bpmn_path: Path) -> List[Annotation]:
-        document = etree.parse(str(bpmn_path))
-        root = document.getroot()
-
-        id_to_obj = {}
-
-        for collaboration in root.findall("collaboration", root.nsmap):
-            id_to_obj.update(_create_id_to_obj_mapping(collaboration))
-
-        for process in root.findall("process", root.nsmap):
-            id_to_obj.update(_create_id_to_obj_mapping(process))
-
-        diagram = root.find("bpmndi:BPMNDiagram", root.nsmap)
-        plane = diagram[0]
-        shapes = plane.findall("bpmndi:BPMNShape", plane.nsmap)
-        shape_anns = yamlu.flatten(
-            _shape_to_anns(shape, id_to_obj[shape.get("bpmnElement")])
-            for shape in shapes
-        )
-        id_to_shape_ann = {a.id: a for a in shape_anns if a.category != "label"}
-
-        edges = plane.findall("bpmndi:BPMNEdge", plane.nsmap)
-
-        edge_anns = []
-        for edge in edges:
-            model_id = edge.get("bpmnElement")
-            if model_id not in id_to_obj:
-                raise ValueError(f"{bpmn_path}: {model_id} not in model element ids")
-            edge_anns.append(_edge_to_anns(edge, id_to_obj[model_id], id_to_shape_ann))
-
-        edge_anns = yamlu.flatten(edge_anns)
-
-        anns = shape_anns + edge_anns
-        self._link_text_rel_anns(anns)
-        return anns
-
-    def _link_text_rel_anns(self, anns):
-        id_to_ann = {a.id: a for a in anns if a.category != "label"}
-
-        lbl_anns = [a for a in anns if a.category == "label"]
-
-        for lbl_ann in lbl_anns:
-            symb_ann = id_to_ann[lbl_ann.get(TEXT_BELONGS_TO_REL)]
-            lbl_ann.set(TEXT_BELONGS_TO_REL, symb_ann)
-            if self.link_text_rel_two_way:
-                symb_ann.set(TEXT_BELONGS_TO_REL, lbl_ann)
-
-
-def get_tag_without_ns(element: Element):
-    tag_str = element.tag
-    return tag_str[tag_str.find("}") + 1:]
+    def _get_min_sizes(self, anns: List[Annotation], img_w: int, img_h: int) -> np.ndarray:
+        arrow_min_wh_scaled = self.arrow_min_wh * max(img_w, img_h) / self.img_max_size_ref
+        return np.array([
+            arrow_min_wh_scaled if a.category in syntax.BPMNDI_EDGE_CATEGORIES else np.nan for a in anns
+        ], dtype=np.float64)
+
+    def get_parse_config(self) -> Dict:
+        """:return: the options that influence the parsing result"""
+        return {
+            "parser": self.__class__.__name__,
+            "arrow_min_wh": self.arrow_min_wh,
+            "img_max_size_ref": self.img_max_size_ref,
+            "target_max_size": self.target_max_size,
+            "excluded_categories": self.excluded_categories,
+            "excluded_label_categories": self.excluded_label_categories,
+            "link_text_rel_two_way": self.link_text_rel_two_way,
+        }
+
+    def _link_anns(self, anns: List[Annotation]):
+        self._link_belongs_to_anns(anns, self.link_text_rel_two_way)
+
+
+# model element tags that are renamed to a category, after event definitions are prepended
+CATEGORY_RENAMES = {
+    "intermediateThrowEvent": syntax.INTERMEDIATE_EVENT,
+    "timerIntermediateCatchEvent": syntax.TIMER_INTERMEDIATE_EVENT,
+    "participant": syntax.POOL,
+    "dataInputAssociation": syntax.DATA_ASSOCIATION,
+    "dataOutputAssociation": syntax.DATA_ASSOCIATION,
+    # remove 'Reference' suffix
+    "dataObjectReference": syntax.DATA_OBJECT,
+    "dataStoreReference": syntax.DATA_STORE,
+}
+_EVENT_DEFINITION_SUFFIX = "EventDefinition"
 
 
 def get_category(bpmndi_element: Element, model_element: Element):
     """inverse operation of get_tag"""
-
-    # remove namespace from tag
-    category: str = get_tag_without_ns(model_element)
-
+    tag = model_element.tag
+    event_definitions = ()
+    is_expanded = False
     # startEvent, endEvent, intermediateCatchEvent, intermediateThrowEvent
-    if category.endswith("Event"):
-        for event_type in EVENT_DEFINITIONS:
-            # types are definition childrens: terminateEventDefinition, messageEventDefinition, timerEventDefinition
-            if model_element.find(f"{event_type}EventDefinition", model_element.nsmap) is not None:
-                # startEvent -> messageStartEvent, endEvent -> terminateEndEvent, ...
-                category = f"{event_type}{category[0].upper()}{category[1:]}"
-    # further shortening of untyped  and terminate events
-    if category == "intermediateThrowEvent":
-        category = syntax.INTERMEDIATE_EVENT
-    elif category == "timerIntermediateCatchEvent":
-        category = syntax.TIMER_INTERMEDIATE_EVENT
-    elif category == "participant":
-        category = syntax.POOL
-    elif category == "subProcess":
+    if tag.endswith("Event"):
+        event_definitions = _find_event_definitions(model_element)
+    elif tag.endswith("}subProcess") or tag == "subProcess":
         # <bpmndi:BPMNShape id="Activity_1cnm0ru_di" bpmnElement="Activity_1cnm0ru" isExpanded="true">
         #         <omgdc:Bounds x="473" y="455" width="452" height="190" />
         #       </bpmndi:BPMNShape>
         is_expanded = bpmndi_element.get("isExpanded", "false").lower() == "true"
-        category = "subProcessExpanded" if is_expanded else "subProcessCollapsed"
-    elif category in ["dataInputAssociation", "dataOutputAssociation"]:
-        category = syntax.DATA_ASSOCIATION
-    elif category in ["dataObjectReference", "dataStoreReference"]:
-        # remove 'Reference' suffix
-        category = category[: -len("Reference")]
+    return _resolve_category(tag, event_definitions, is_expanded)
 
-    assert category in syntax.ALL_CATEGORIES, f"unknown category: {category}"
 
-    return category
+def _find_event_definitions(model_element: Element) -> Tuple[str, ...]:
+    """
+    :return: the event definitions of an event in the order of EVENT_DEFINITIONS, found in one pass over its children.
+    The definitions are children in the default namespace: terminateEventDefinition, messageEventDefinition, ...
+    """
+    nsmap = model_element.nsmap
+    prefix = f"{{{nsmap[None]}}}" if None in nsmap else ""
+    definitions = set()
+    for child in model_element:
+        child_tag = child.tag
+        # comments and processing instructions have no str tag
+        if isinstance(child_tag, str) and child_tag.startswith(prefix) and child_tag.endswith(_EVENT_DEFINITION_SUFFIX):
+            definitions.add(child_tag[len(prefix):-len(_EVENT_DEFINITION_SUFFIX)])
+    return tuple(event_type for event_type in EVENT_DEFINITIONS if event_type in definitions)
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve_category(tag: str, event_definitions: Tuple[str, ...], is_expanded: bool) -> str:
+    # remove namespace from tag
+    category = tag[tag.find("}") + 1:]
 
+    # startEvent -> messageStartEvent, endEvent -> terminateEndEvent, ...
+    for event_type in event_definitions:
+        category = f"{event_type}{category[0].upper()}{category[1:]}"
 
-def _create_id_to_obj_mapping(element):
-    id_to_obj = {}
-    to_visit = [element]
-    while len(to_visit) != 0:
-        element = to_visit.pop()
-        for child in element:
-            to_visit.append(child)
-            if child.get("id") is not None:
-                id_to_obj[child.get("id")] = child
-    return id_to_obj
+    if category == "subProcess":
+        category = "subProcessExpanded" if is_expanded else "subProcessCollapsed"
+    # further shortening of untyped and terminate events, ...
+    category = CATEGORY_RENAMES.get(category, category)
+
+    assert category in syntax.ALL_CATEGORIES_SET, f"unknown category: {category}"
+
+    return category
 
 
 def _edge_to_anns(edge: Element, model_element: Element, id_to_shape_ann: Dict[str, Annotation]):
@@ -228,11 +176,7 @@ def _edge_to_anns(edge: Element, model_element: Element, id_to_shape_ann: Dict[s
     """
     category = get_category(edge, model_element)
 
-    ns = get_omgdi_ns(edge)
-    waypoints = np.array(
-        [[to_int_or_float(wp.get("x")), to_int_or_float(wp.get("y"))] for wp in
-         edge.findall(f"{ns}:waypoint", edge.nsmap)]
-    )
+    waypoints = parse_waypoints(edge)
     bb = BoundingBox.from_points(waypoints, allow_neg_coord=True)
 
     attrib = _parse_edge_attribs(model_element)
@@ -251,7 +195,7 @@ def _edge_to_anns(edge: Element, model_element: Element, id_to_shape_ann: Dict[s
 def _shape_to_anns(shape: Element, model_element: Element) -> List[Annotation]:
     category = get_category(shape, model_element)
 
-    shape_ann = Annotation(category, bb=_child_bounds_to_bb(shape), **model_element.attrib)
+    shape_ann = Annotation(category, bb=child_bounds_to_bb(shape), **model_element.attrib)
     if get_tag_without_ns(model_element) == "textAnnotation":
         text_el = model_element.find("text", model_element.nsmap)
         if text_el is not None:
@@ -317,11 +261,16 @@ def _create_label_ann_if_exists(shape_or_edge, model_element) -> Optional[Annota
     if text is None or text.strip() == "":
         return None
 
-    a = Annotation(category="label", bb=_child_bounds_to_bb(label), name=text)
+    a = Annotation(category="label", bb=child_bounds_to_bb(label), name=text)
     a.set(TEXT_BELONGS_TO_REL, model_element.get("id"))
     return a
 
 
-def _child_bounds_to_bb(element: Element) -> BoundingBox:
-    bounds = element.find("omgdc:Bounds", element.nsmap)
-    return bounds_to_bb(bounds)
+BPMN_NOTATION = Notation(
+    name="bpmn",
+    shape_to_anns=_shape_to_anns,
+    edge_to_anns=_edge_to_anns,
+    label_category="label",
+    belongs_to_rel=TEXT_BELONGS_TO_REL,
+    belongs_to_categories=frozenset({"label"}),
+)
@@ -0,0 +1,68 @@
+import random
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator, List, Optional
+
+from yamlu.coco import Dataset
+from yamlu.img import AnnotatedImage
+
+
+def split_order(n_imgs: int, shuffle: bool = False, seed: int = 0) -> List[int]:
+    """:return: the indexes of a split in the order of iter_split, a permutation that only depends on the seed"""
+    idxs = list(range(n_imgs))
+    if shuffle:
+        random.Random(seed).shuffle(idxs)
+    return idxs
+
+
+def iter_split(
+        ds: Dataset,
+        split: str,
+        prefetch: int = 8,
+        n_workers: Optional[int] = None,
+        shuffle: bool = False,
+        seed: int = 0,
+        decode_img: bool = True,
+) -> Iterator[AnnotatedImage]:
+    """
+    Iterates over the annotated images of a split, e.g. to feed a training loop without dumping COCO to disk.
+    Up to prefetch items are read by a thread pool in the background while the caller processes the current one,
+    which overlaps the XML parsing and image decoding of different items (both mostly release the GIL).
+    Items are yielded in a fixed order, independent of which worker finishes first.
+    Exceptions of an item are raised when the item is reached.
+    :param ds: HdBpmnDataset or UmlDataset (or any dataset with get_split_ann_img)
+    :param prefetch: maximum number of items that are read ahead, i.e. the size of the queue
+    :param n_workers: number of threads, defaults to prefetch
+    :param shuffle: iterate in a random order given by seed (see split_order), use e.g. seed=epoch for new orders
+    :param decode_img: decode the images of lazy parsers in the background, instead of on first access of img
+    """
+    assert prefetch > 0, f"prefetch must be positive: {prefetch}"
+    idxs = split_order(ds.split_n_imgs[split], shuffle, seed)
+    return _iter_prefetched(ds, split, idxs, prefetch, prefetch if n_workers is None else n_workers, decode_img)
+
+
+def _iter_prefetched(
+        ds: Dataset, split: str, idxs: List[int], prefetch: int, n_workers: int, decode_img: bool
+) -> Iterator[AnnotatedImage]:
+    pool = ThreadPoolExecutor(n_workers)
+    pending: "deque[Future]" = deque()
+    try:
+        for idx in idxs:
+            pending.append(pool.submit(_read_item, ds, split, idx, decode_img))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+    finally:
+        # the caller may stop early, e.g. with break: do not read the remaining items
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+
+def _read_item(ds: Dataset, split: str, idx: int, decode_img: bool) -> AnnotatedImage:
+    ann_img = ds.get_split_ann_img(split, idx)
+    if decode_img:
+        # decodes the image of a LazyAnnotatedImage
+        _ = ann_img.img
+    return ann_img
@@ -0,0 +1,170 @@
+import contextlib
+import json
+import time
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+# profiler of the current context, stages are only timed while a profiler is active (see Profiler.activate)
+_profiler: "ContextVar[Optional[Profiler]]" = ContextVar("pybpmn_profiler", default=None)
+# returned by profile_stage when profiling is disabled, so that disabled hooks do not allocate anything
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+@dataclass
+class StageStats:
+    count: int = 0
+    total_s: float = 0.0
+    max_s: float = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total_s += seconds
+        self.max_s = max(self.max_s, seconds)
+
+
+@dataclass
+class FileStats:
+    total_s: float = 0.0
+    n_elements: Optional[int] = None
+    stages: Dict[str, float] = field(default_factory=dict)
+
+
+class Profiler:
+    """
+    Records the duration of pipeline stages, and per file the duration of its stages and its number of elements.
+    Profilers are not thread-safe. Profilers of worker processes can be sent to the parent and combined with merge().
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, StageStats] = {}
+        self.files: Dict[str, FileStats] = {}
+        # file -> number of active stages of this file
+        self._file_depths: Dict[str, int] = {}
+
+    @contextlib.contextmanager
+    def activate(self):
+        """records the stages of the current context (and of contexts copied from it) with this profiler"""
+        token = _profiler.set(self)
+        try:
+            yield self
+        finally:
+            _profiler.reset(token)
+
+    def add_stage(self, stage: str, seconds: float, file: Optional[str] = None, outermost: bool = True):
+        """
+        :param file: file that was processed in the stage, if any
+        :param outermost: whether the stage was not nested in another stage of the same file,
+                          only these count for the file total
+        """
+        self.stages.setdefault(stage, StageStats()).add(seconds)
+        if file is not None:
+            file_stats = self.files.setdefault(file, FileStats())
+            file_stats.stages[stage] = file_stats.stages.get(stage, 0.0) + seconds
+            if outermost:
+                file_stats.total_s += seconds
+
+    def set_n_elements(self, file: str, n_elements: int):
+        self.files.setdefault(file, FileStats()).n_elements = n_elements
+
+    def merge(self, other: "Profiler"):
+        for stage, stats in other.stages.items():
+            own_stats = self.stages.setdefault(stage, StageStats())
+            own_stats.count += stats.count
+            own_stats.total_s += stats.total_s
+            own_stats.max_s = max(own_stats.max_s, stats.max_s)
+        for file, stats in other.files.items():
+            own_stats = self.files.setdefault(file, FileStats())
+            own_stats.total_s += stats.total_s
+            if stats.n_elements is not None:
+                own_stats.n_elements = stats.n_elements
+            for stage, seconds in stats.stages.items():
+                own_stats.stages[stage] = own_stats.stages.get(stage, 0.0) + seconds
+
+    def slowest_files(self, n: int = 10) -> List[str]:
+        return sorted(self.files.keys(), key=lambda f: self.files[f].total_s, reverse=True)[:n]
+
+    def to_dict(self, n_slowest: int = 10) -> Dict[str, Any]:
+        return {
+            "stages": {stage: asdict(stats) for stage, stats in self.stages.items()},
+            "slowest_files": self.slowest_files(n_slowest),
+            "files": {file: asdict(stats) for file, stats in self.files.items()},
+        }
+
+    def write_trace(self, trace_path: Union[Path, str], n_slowest: int = 10):
+        trace_path = Path(trace_path)
+        trace_path.parent.mkdir(parents=True, exist_ok=True)
+        with trace_path.open("w") as f:
+            json.dump(self.to_dict(n_slowest), f, indent=2)
+
+    def summary_table(self, n_slowest: int = 10) -> str:
+        lines = [f"{'stage':<20} {'count':>8} {'total s':>10} {'mean ms':>10} {'max ms':>10}"]
+        for stage, stats in sorted(self.stages.items(), key=lambda kv: kv[1].total_s, reverse=True):
+            mean_ms = 1000 * stats.total_s / stats.count
+            lines.append(
+                f"{stage:<20} {stats.count:>8} {stats.total_s:>10.3f} {mean_ms:>10.2f} {1000 * stats.max_s:>10.2f}"
+            )
+
+        slowest_files = self.slowest_files(n_slowest)
+        if len(slowest_files) > 0:
+            lines += ["", f"{'slowest files':<60} {'total ms':>10} {'elements':>10}"]
+            for file in slowest_files:
+                stats = self.files[file]
+                n_elements = "" if stats.n_elements is None else stats.n_elements
+                lines.append(f"{_shorten(file, 60):<60} {1000 * stats.total_s:>10.2f} {n_elements:>10}")
+        return "\n".join(lines)
+
+
+class _StageTimer:
+    __slots__ = ("profiler", "stage", "file", "start")
+
+    def __init__(self, profiler: Profiler, stage: str, file: Optional[str]):
+        self.profiler = profiler
+        self.stage = stage
+        self.file = file
+
+    def __enter__(self):
+        file_depths = self.profiler._file_depths
+        if self.file is not None:
+            file_depths[self.file] = file_depths.get(self.file, 0) + 1
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        seconds = time.perf_counter() - self.start
+        outermost = True
+        if self.file is not None:
+            file_depths = self.profiler._file_depths
+            file_depths[self.file] -= 1
+            outermost = file_depths[self.file] == 0
+            if outermost:
+                del file_depths[self.file]
+        self.profiler.add_stage(self.stage, seconds, self.file, outermost=outermost)
+
+
+def get_profiler() -> Optional[Profiler]:
+    """:return: the active profiler, or None if profiling is disabled"""
+    return _profiler.get()
+
+
+def profile_stage(stage: str, file: Optional[Union[Path, str]] = None):
+    """
+    Context manager that records the duration of the enclosed code as stage with the active profiler.
+    If no profiler is active, a shared no-op context manager is returned.
+    :param file: file that is processed in the stage, used to find the slowest files
+    """
+    profiler = _profiler.get()
+    if profiler is None:
+        return _NULL_CONTEXT
+    return _StageTimer(profiler, stage, None if file is None else str(file))
+
+
+def record_n_elements(file: Union[Path, str], n_elements: int):
+    """records the number of elements of a file with the active profiler, if any"""
+    profiler = _profiler.get()
+    if profiler is not None:
+        profiler.set_n_elements(str(file), n_elements)
+
+
+def _shorten(s: str, max_len: int) -> str:
+    return s if len(s) <= max_len else "..." + s[-(max_len - 3):]
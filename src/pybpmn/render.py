@@ -0,0 +1,259 @@
+import math
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+# noinspection PyProtectedMember
+from lxml.etree import _ElementTree as ElementTree
+from yamlu.img import Annotation
+
+from pybpmn import syntax, uml_syntax
+from pybpmn.base_parser import DiagramParser
+from pybpmn.parser import BpmnParser
+from pybpmn.uml_parser import UmlParser
+from pybpmn.util import parse_bpmn_document
+
+# stroke width, font size and marker sizes in BPMNDI coordinates, roughly those of bpmn-js
+LINE_WIDTH = 2.0
+FONT_SIZE = 12.0
+ARROW_LENGTH = 11.0
+ARROW_WIDTH = 10.0
+DIAMOND_LENGTH = 18.0
+DIAMOND_WIDTH = 10.0
+CORNER_RADIUS = 10.0
+DASH = (8.0, 5.0)
+DOT = (2.0, 4.0)
+
+ELLIPSE = "ellipse"
+DIAMOND = "diamond"
+ROUNDED_RECT = "rounded_rect"
+RECT = "rect"
+
+# categories of both notations (and the category translations of the datasets) that are not drawn as rectangles
+CATEGORY_TO_SHAPE = {
+    **{c: ELLIPSE for c in syntax.EVENT_CATEGORIES + ["event", "messageEvent", "timerEvent"]},
+    **{c: DIAMOND for c in syntax.GATEWAY_CATEGORIES + [uml_syntax.N_ARY_ASSO_DIA]},
+    **{c: ROUNDED_RECT for c in syntax.ACTIVITY_CATEGORIES},
+}
+# categories whose name is drawn inside the shape (other names are separate label annotations)
+NAMED_SHAPE_CATEGORIES = frozenset(syntax.ACTIVITY_CATEGORIES + syntax.ANNOTATION_SHAPE_CATEGORIES)
+LABEL_CATEGORIES = frozenset([syntax.LABEL, uml_syntax.LABEL])
+
+FILLED_ARROW = "filled_arrow"
+OPEN_ARROW = "open_arrow"
+HOLLOW_TRIANGLE = "hollow_triangle"
+HOLLOW_DIAMOND = "hollow_diamond"
+FILLED_DIAMOND = "filled_diamond"
+
+# edge category -> (dash pattern, head marker, tail marker)
+EDGE_STYLES = {
+    syntax.SEQUENCE_FLOW: (None, FILLED_ARROW, None),
+    syntax.MESSAGE_FLOW: (DASH, HOLLOW_TRIANGLE, None),
+    syntax.DATA_ASSOCIATION: (DOT, OPEN_ARROW, None),
+    syntax.ASSOCIATION: (DOT, None, None),
+    uml_syntax.ASSOCIATION: (None, None, None),
+    uml_syntax.ASSOCIATION_UNIDIRECTIONAL: (None, OPEN_ARROW, None),
+    uml_syntax.ASSOCIATION_BIDIRECTIONAL: (None, None, None),
+    # the diamond of aggregations and compositions is at the source of the edge
+    uml_syntax.AGGREGATION: (None, None, HOLLOW_DIAMOND),
+    uml_syntax.COMPOSITION: (None, None, FILLED_DIAMOND),
+    uml_syntax.EXTENSION: (None, HOLLOW_TRIANGLE, None),
+    uml_syntax.DEPENDENCY: (DASH, OPEN_ARROW, None),
+    uml_syntax.REALIZATION: (DASH, HOLLOW_TRIANGLE, None),
+    uml_syntax.COMMENT_CONNECTION: (DASH, None, None),
+}
+
+BLACK = (0, 0, 0, 255)
+WHITE = (255, 255, 255, 255)
+
+
+def get_parser(document: ElementTree) -> DiagramParser:
+    """:return: UmlParser if the model elements are in the UML namespace, BpmnParser otherwise"""
+    root = document.getroot()
+    uml_ns = root.nsmap.get("uml")
+    if uml_ns is not None and root.find(f"./*/{{{uml_ns}}}*") is not None:
+        return UmlParser()
+    return BpmnParser()
+
+
+def render_bpmn(
+        bpmn_path: Path,
+        parser: Optional[DiagramParser] = None,
+        scale: float = 1.0,
+        size: Optional[Tuple[int, int]] = None,
+) -> Image.Image:
+    """
+    Renders a BPMN XML file of either notation, see render_anns
+    :param parser: parser of the notation of the file, detected with get_parser if None
+    """
+    document = parse_bpmn_document(bpmn_path)
+    parser = get_parser(document) if parser is None else parser
+    return render_anns(parser.parse_bpmn_document_anns(document), scale=scale, size=size)
+
+
+def render_anns(
+        anns: List[Annotation],
+        scale: float = 1.0,
+        size: Optional[Tuple[int, int]] = None,
+) -> Image.Image:
+    """
+    Draws the shapes, edges and labels of parsed annotations (in BPMNDI coordinates) in black on white,
+    at their BPMNDI positions multiplied by scale, i.e. without shifting the diagram to the origin.
+    :param scale: e.g. image width / annotation background width to render the diagram at the size of its image
+    :param size: (width, height) of the rendered image, defaults to the extent of the scaled diagram
+    :return: RGBA image
+    """
+    if size is None:
+        r, b = max([a.bb.r for a in anns], default=0), max([a.bb.b for a in anns], default=0)
+        size = math.ceil(r * scale) + 1, math.ceil(b * scale) + 1
+    img = Image.new("RGBA", size, WHITE)
+    _Renderer(ImageDraw.Draw(img), scale).draw(anns)
+    return img
+
+
+class _Renderer:
+    def __init__(self, draw: ImageDraw.ImageDraw, scale: float):
+        self.d = draw
+        self.scale = scale
+        self.width = max(1, round(LINE_WIDTH * scale))
+        self.font = _load_font(max(1, round(FONT_SIZE * scale)))
+
+    def draw(self, anns: List[Annotation]):
+        # shapes first, so that edges and labels are drawn on top of e.g. pools
+        for a in anns:
+            if "waypoints" not in a and a.category not in LABEL_CATEGORIES:
+                self.draw_shape(a)
+        for a in anns:
+            if "waypoints" in a:
+                self.draw_edge(a)
+        for a in anns:
+            if a.category in LABEL_CATEGORIES:
+                self.draw_text(_get_field(a, "name"), self._scaled_box(a))
+
+    def _scaled_box(self, a: Annotation) -> Tuple[float, float, float, float]:
+        s = self.scale
+        return a.bb.l * s, a.bb.t * s, a.bb.r * s, a.bb.b * s
+
+    def draw_shape(self, a: Annotation):
+        box = self._scaled_box(a)
+        shape = CATEGORY_TO_SHAPE.get(a.category, RECT)
+        if shape == ELLIPSE:
+            width = self.width * 2 if a.category in ("endEvent", syntax.TERMINATE_EVENT) else self.width
+            self.d.ellipse(box, outline=BLACK, width=width)
+        elif shape == DIAMOND:
+            l, t, r, b = box
+            x, y = (l + r) / 2, (t + b) / 2
+            self.d.polygon([(x, t), (r, y), (x, b), (l, y)], outline=BLACK, width=self.width)
+        elif shape == ROUNDED_RECT:
+            self.d.rounded_rectangle(box, radius=CORNER_RADIUS * self.scale, outline=BLACK, width=self.width)
+        else:
+            self.d.rectangle(box, outline=BLACK, width=self.width)
+
+        if a.category in NAMED_SHAPE_CATEGORIES:
+            self.draw_text(_get_field(a, "name"), box)
+
+    def draw_edge(self, a: Annotation):
+        pts = np.asarray(a.waypoints, dtype=np.float64) * self.scale
+        if len(pts) < 2:
+            return
+        dash, head, tail = EDGE_STYLES.get(a.category, (None, None, None))
+        if head is None and _get_field(a, "has_arrowhead") == "true":
+            head = OPEN_ARROW
+
+        if dash is None:
+            self.d.line([tuple(p) for p in pts], fill=BLACK, width=self.width, joint="curve")
+        else:
+            self._draw_dashed(pts, [v * self.scale for v in dash])
+
+        if head is not None:
+            self.draw_marker(head, pts[-2], pts[-1])
+        if tail is not None:
+            self.draw_marker(tail, pts[1], pts[0])
+
+    def _draw_dashed(self, pts: np.ndarray, dash: Sequence[float]):
+        on, off = dash
+        period = on + off
+        # distance along the polyline at which each segment starts, the dash pattern continues across segments
+        offset = 0.0
+        for p, q in zip(pts[:-1], pts[1:]):
+            length = float(np.hypot(*(q - p)))
+            if length == 0:
+                continue
+            direction = (q - p) / length
+            start = -(offset % period)
+            while start < length:
+                dash_start, dash_end = max(start, 0.0), min(start + on, length)
+                if dash_end > dash_start:
+                    self.d.line([tuple(p + direction * dash_start), tuple(p + direction * dash_end)],
+                                fill=BLACK, width=self.width)
+                start += period
+            offset += length
+
+    def draw_marker(self, marker: str, prev: np.ndarray, tip: np.ndarray):
+        """draws the marker at tip, pointing in the direction from prev to tip"""
+        v = tip - prev
+        length = float(np.hypot(*v))
+        if length == 0:
+            return
+        u = v / length
+        n = np.array([-u[1], u[0]])
+        s = self.scale
+        if marker in (FILLED_ARROW, OPEN_ARROW, HOLLOW_TRIANGLE):
+            base = tip - u * ARROW_LENGTH * s
+            left, right = base + n * ARROW_WIDTH / 2 * s, base - n * ARROW_WIDTH / 2 * s
+            if marker == OPEN_ARROW:
+                self.d.line([tuple(left), tuple(tip), tuple(right)], fill=BLACK, width=self.width)
+            else:
+                fill = BLACK if marker == FILLED_ARROW else WHITE
+                self.d.polygon([tuple(tip), tuple(left), tuple(right)], fill=fill, outline=BLACK, width=self.width)
+        elif marker in (HOLLOW_DIAMOND, FILLED_DIAMOND):
+            back = tip - u * DIAMOND_LENGTH * s
+            mid = tip - u * DIAMOND_LENGTH / 2 * s
+            left, right = mid + n * DIAMOND_WIDTH / 2 * s, mid - n * DIAMOND_WIDTH / 2 * s
+            fill = BLACK if marker == FILLED_DIAMOND else WHITE
+            pts = [tuple(tip), tuple(left), tuple(back), tuple(right)]
+            self.d.polygon(pts, fill=fill, outline=BLACK, width=self.width)
+        else:
+            raise ValueError(f"Unknown marker: {marker}")
+
+    def draw_text(self, text: Optional[str], box: Tuple[float, float, float, float]):
+        """draws the text word-wrapped and centered in the box"""
+        if text is None or text.strip() == "":
+            return
+        l, t, r, b = box
+        lines = _wrap(text, self.font, self.d, max(r - l, 1.0))
+        line_height = self.font.getbbox("Ag")[3] * 1.2
+        y = (t + b) / 2 - line_height * len(lines) / 2
+        for line in lines:
+            # centered manually, since bitmap fonts do not support text anchors
+            x = (l + r) / 2 - self.d.textlength(line, font=self.font) / 2
+            self.d.text((x, y), line, fill=BLACK, font=self.font)
+            y += line_height
+
+
+def _get_field(a: Annotation, name: str):
+    return a.get(name) if name in a else None
+
+
+def _wrap(text: str, font, draw: ImageDraw.ImageDraw, max_width: float) -> List[str]:
+    lines = []
+    for paragraph in text.splitlines():
+        line = ""
+        for word in paragraph.split():
+            candidate = word if line == "" else f"{line} {word}"
+            if line != "" and draw.textlength(candidate, font=font) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def _load_font(size: int):
+    try:
+        # scalable version of the default font, Pillow >= 10.1
+        return ImageFont.load_default(size)
+    except TypeError:
+        return ImageFont.load_default()
@@ -0,0 +1,293 @@
+import csv
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from tqdm import tqdm
+from yamlu.coco import Dataset
+
+from pybpmn.batch import effective_n_jobs
+from pybpmn.columnar import ColumnarAnnotations
+from pybpmn.export import get_shard
+
+_logger = logging.getLogger(__name__)
+
+STATS_VERSION = 1
+CSV_FIELDS = ["split", "metric", "category", "bin", "count"]
+
+# dataset of the current worker process, set once per worker by _init_stats_worker
+_stats_worker_ds = None
+
+
+@dataclass
+class Histogram:
+    """
+    Histogram with fixed bins, which makes histograms of different shards mergeable by adding their counts.
+    bins maps the lower edge of a bin to its count:
+    - exact histograms (e.g. for counts) have one bin per value
+    - log histograms (e.g. for sizes in pixels) have the bins [0, 1), [1, 2), [2, 4), [4, 8), ...
+    """
+    log: bool = False
+    bins: Dict[int, int] = field(default_factory=dict)
+    n: int = 0
+    total: float = 0.0
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+    @property
+    def mean(self) -> Optional[float]:
+        return None if self.n == 0 else self.total / self.n
+
+    def add(self, values: Union[np.ndarray, Iterable[float]]):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return
+        if self.log:
+            lower_edges = np.where(values < 1, 0, np.exp2(np.floor(np.log2(np.maximum(values, 1)))))
+        else:
+            lower_edges = np.floor(values)
+        for edge, count in zip(*np.unique(lower_edges.astype(np.int64), return_counts=True)):
+            self.bins[int(edge)] = self.bins.get(int(edge), 0) + int(count)
+        self.n += len(values)
+        self.total += float(values.sum())
+        self.min = float(values.min()) if self.min is None else min(self.min, float(values.min()))
+        self.max = float(values.max()) if self.max is None else max(self.max, float(values.max()))
+
+    def merge(self, other: "Histogram"):
+        assert self.log == other.log, "cannot merge exact and log histograms"
+        for edge, count in other.bins.items():
+            self.bins[edge] = self.bins.get(edge, 0) + count
+        self.n += other.n
+        self.total += other.total
+        self.min = _merge_opt(min, self.min, other.min)
+        self.max = _merge_opt(max, self.max, other.max)
+
+    def to_dict(self) -> Dict:
+        return {
+            "log": self.log,
+            "n": self.n,
+            "mean": self.mean,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "bins": {str(edge): count for edge, count in sorted(self.bins.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "Histogram":
+        bins = {int(edge): count for edge, count in d["bins"].items()}
+        return cls(log=d["log"], bins=bins, n=d["n"], total=d["total"], min=d["min"], max=d["max"])
+
+
+@dataclass
+class SplitStats:
+    """
+    Annotation statistics of a split in image coordinates, i.e. as in the exported COCO dataset.
+    Per-category histograms are keyed by the (translated) category name, edges are the annotations with waypoints.
+    Use merge to combine the stats of different shards or chunks of a split.
+    """
+    n_imgs: int = 0
+    errors: List[str] = field(default_factory=list)
+    category_counts: Dict[str, int] = field(default_factory=dict)
+    anns_per_img: Histogram = field(default_factory=Histogram)
+    bb_widths: Dict[str, Histogram] = field(default_factory=dict)
+    bb_heights: Dict[str, Histogram] = field(default_factory=dict)
+    edge_lengths: Dict[str, Histogram] = field(default_factory=dict)
+    n_waypoints: Dict[str, Histogram] = field(default_factory=dict)
+
+    def add_anns(self, anns: ColumnarAnnotations):
+        """adds the annotations of an image"""
+        self.n_imgs += 1
+        self.anns_per_img.add([len(anns)])
+        if len(anns) == 0:
+            return
+
+        tlbr = anns.bbs
+        widths, heights = tlbr[:, 3] - tlbr[:, 1], tlbr[:, 2] - tlbr[:, 0]
+        offsets = anns.waypoint_offsets
+        n_wps = np.diff(offsets)
+        # segment j connects waypoint j and j + 1, the cumulative sum includes segments between different edges,
+        # which are excluded by the start and end waypoint of each edge
+        segment_lengths = np.hypot(*np.diff(anns.waypoints, axis=0).T) if len(anns.waypoints) > 1 else np.zeros(0)
+        cum_lengths = np.concatenate([[0.0], np.cumsum(segment_lengths)])
+        has_wps = n_wps > 0
+        edge_lengths = np.zeros(len(anns))
+        edge_lengths[has_wps] = cum_lengths[offsets[1:][has_wps] - 1] - cum_lengths[offsets[:-1][has_wps]]
+
+        category_ids = anns.category_ids
+        for cat_id, category in enumerate(anns.category_names):
+            mask = category_ids == cat_id
+            self.category_counts[category] = self.category_counts.get(category, 0) + int(mask.sum())
+            _get_hist(self.bb_widths, category, log=True).add(widths[mask])
+            _get_hist(self.bb_heights, category, log=True).add(heights[mask])
+            edge_mask = mask & has_wps
+            if edge_mask.any():
+                _get_hist(self.edge_lengths, category, log=True).add(edge_lengths[edge_mask])
+                _get_hist(self.n_waypoints, category, log=False).add(n_wps[edge_mask])
+
+    def merge(self, other: "SplitStats"):
+        self.n_imgs += other.n_imgs
+        self.errors += other.errors
+        for category, count in other.category_counts.items():
+            self.category_counts[category] = self.category_counts.get(category, 0) + count
+        self.anns_per_img.merge(other.anns_per_img)
+        for name in ["bb_widths", "bb_heights", "edge_lengths", "n_waypoints"]:
+            category_to_hist = getattr(self, name)
+            for category, hist in getattr(other, name).items():
+                _get_hist(category_to_hist, category, log=hist.log).merge(hist)
+
+    def to_dict(self) -> Dict:
+        def hists_to_dict(category_to_hist: Dict[str, Histogram]) -> Dict:
+            return {c: h.to_dict() for c, h in sorted(category_to_hist.items())}
+
+        return {
+            "n_imgs": self.n_imgs,
+            "n_anns": sum(self.category_counts.values()),
+            "errors": sorted(self.errors),
+            "category_counts": dict(sorted(self.category_counts.items())),
+            "anns_per_img": self.anns_per_img.to_dict(),
+            "bb_widths": hists_to_dict(self.bb_widths),
+            "bb_heights": hists_to_dict(self.bb_heights),
+            "edge_lengths": hists_to_dict(self.edge_lengths),
+            "n_waypoints": hists_to_dict(self.n_waypoints),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "SplitStats":
+        def hists_from_dict(category_to_dict: Dict) -> Dict[str, Histogram]:
+            return {c: Histogram.from_dict(h) for c, h in category_to_dict.items()}
+
+        return cls(
+            n_imgs=d["n_imgs"],
+            errors=list(d["errors"]),
+            category_counts=dict(d["category_counts"]),
+            anns_per_img=Histogram.from_dict(d["anns_per_img"]),
+            bb_widths=hists_from_dict(d["bb_widths"]),
+            bb_heights=hists_from_dict(d["bb_heights"]),
+            edge_lengths=hists_from_dict(d["edge_lengths"]),
+            n_waypoints=hists_from_dict(d["n_waypoints"]),
+        )
+
+    def to_rows(self, split: str) -> List[Dict]:
+        """:return: long-format rows with the CSV_FIELDS, one per category count and histogram bin"""
+        rows = [{"split": split, "metric": "n_imgs", "category": "", "bin": "", "count": self.n_imgs},
+                {"split": split, "metric": "n_errors", "category": "", "bin": "", "count": len(self.errors)}]
+        rows += [{"split": split, "metric": "category_count", "category": c, "bin": "", "count": n}
+                 for c, n in sorted(self.category_counts.items())]
+        named_hists = [("anns_per_img", "", self.anns_per_img)]
+        for name in ["bb_widths", "bb_heights", "edge_lengths", "n_waypoints"]:
+            named_hists += [(name, c, h) for c, h in sorted(getattr(self, name).items())]
+        for name, category, hist in named_hists:
+            rows += [{"split": split, "metric": name, "category": category, "bin": edge, "count": n}
+                     for edge, n in sorted(hist.bins.items())]
+        return rows
+
+
+def compute_stats(
+        ds: Dataset,
+        splits: Iterable[str],
+        n_jobs: int = 1,
+        shard: Optional[Tuple[int, int]] = None,
+        chunksize: int = 16,
+) -> Dict[str, SplitStats]:
+    """
+    Computes the annotation statistics of dataset splits from the parsed annotations, without decoding any image.
+    Items that cannot be parsed are logged and listed in the errors of their split.
+    :param ds: HdBpmnDataset or UmlDataset, the items are parsed with get_split_columnar_ann_img,
+               which only reads the image headers
+    :param n_jobs: number of worker processes (joblib-style, e.g. -1 for all CPUs),
+                   the items are processed in-process if 1
+    :param shard: (i, n) to only process the items of shard i of n, as in a sharded export (see export.get_shard).
+                  The stats of all shards can be combined with merge_stats.
+    :param chunksize: number of items that a worker process aggregates before sending its stats back
+    """
+    n_jobs = effective_n_jobs(n_jobs)
+    split_to_stats = {}
+    for split in splits:
+        idxs = [
+            idx for idx, bpmn_path in enumerate(ds.split_to_bpmn_paths[split])
+            if shard is None or get_shard(bpmn_path.stem, shard[1]) == shard[0]
+        ]
+        chunks = [(split, idxs[i:i + chunksize]) for i in range(0, len(idxs), chunksize)]
+        stats = SplitStats()
+        with tqdm(total=len(idxs), desc=split) as pbar:
+            if n_jobs == 1:
+                results = (_compute_chunk_stats(ds, split, chunk_idxs) for split, chunk_idxs in chunks)
+                for chunk_stats in results:
+                    stats.merge(chunk_stats)
+                    pbar.update(chunk_stats.n_imgs + len(chunk_stats.errors))
+            else:
+                with ProcessPoolExecutor(n_jobs, initializer=_init_stats_worker, initargs=(ds,)) as executor:
+                    for chunk_stats in executor.map(_compute_chunk_stats_in_worker, chunks):
+                        stats.merge(chunk_stats)
+                        pbar.update(chunk_stats.n_imgs + len(chunk_stats.errors))
+        _logger.info("%s: computed stats of %d images, %d errors", split, stats.n_imgs, len(stats.errors))
+        split_to_stats[split] = stats
+    return split_to_stats
+
+
+def merge_stats(split_to_stats_list: Iterable[Dict[str, SplitStats]]) -> Dict[str, SplitStats]:
+    """combines the stats of e.g. the shards of a dataset, split by split"""
+    merged = {}
+    for split_to_stats in split_to_stats_list:
+        for split, stats in split_to_stats.items():
+            merged.setdefault(split, SplitStats()).merge(stats)
+    return merged
+
+
+def write_stats_json(split_to_stats: Dict[str, SplitStats], json_path: Path):
+    d = {"version": STATS_VERSION, "splits": {split: s.to_dict() for split, s in split_to_stats.items()}}
+    Path(json_path).write_text(json.dumps(d, indent=2))
+
+
+def read_stats_json(json_path: Path) -> Dict[str, SplitStats]:
+    d = json.loads(Path(json_path).read_text())
+    if d.get("version") != STATS_VERSION:
+        raise ValueError(f"{json_path}: unsupported stats version {d.get('version')}, expected {STATS_VERSION}")
+    return {split: SplitStats.from_dict(s) for split, s in d["splits"].items()}
+
+
+def write_stats_csv(split_to_stats: Dict[str, SplitStats], csv_path: Path):
+    with Path(csv_path).open("w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for split, stats in split_to_stats.items():
+            writer.writerows(stats.to_rows(split))
+
+
+def _compute_chunk_stats(ds: Dataset, split: str, idxs: List[int]) -> SplitStats:
+    stats = SplitStats()
+    for idx in idxs:
+        bpmn_path = ds.split_to_bpmn_paths[split][idx]
+        try:
+            stats.add_anns(ds.get_split_columnar_ann_img(split, idx).annotations)
+        except Exception as e:
+            _logger.warning("Error while computing the stats of %s: %s", bpmn_path, e)
+            stats.errors.append(bpmn_path.name)
+    return stats
+
+
+def _init_stats_worker(ds: Dataset):
+    global _stats_worker_ds
+    _stats_worker_ds = ds
+
+
+def _compute_chunk_stats_in_worker(chunk: Tuple[str, List[int]]) -> SplitStats:
+    split, idxs = chunk
+    return _compute_chunk_stats(_stats_worker_ds, split, idxs)
+
+
+def _get_hist(category_to_hist: Dict[str, Histogram], category: str, log: bool) -> Histogram:
+    if category not in category_to_hist:
+        category_to_hist[category] = Histogram(log=log)
+    return category_to_hist[category]
+
+
+def _merge_opt(fn, a: Optional[float], b: Optional[float]) -> Optional[float]:
+    if a is None or b is None:
+        return b if a is None else a
+    return fn(a, b)
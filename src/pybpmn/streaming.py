@@ -0,0 +1,125 @@
+import json
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+from lxml import etree
+# noinspection PyProtectedMember
+from lxml.etree import _Element as Element
+from yamlu.img import Annotation
+
+from pybpmn.notation import Notation
+from pybpmn.util import create_id_to_obj_mapping
+
+
+def iterparse_bpmn_anns(
+        source: Union[str, BinaryIO], url: str, notation: Notation
+) -> Tuple[Optional[float], List[Annotation]]:
+    """
+    Streaming counterpart of DiagramParser.parse_bpmn_document_anns, based on lxml.etree.iterparse.
+    The model elements (collaborations and processes) are kept, since shapes need e.g. their event definitions.
+    Each BPMNShape/BPMNEdge of the diagram plane is converted to annotations as soon as it is complete,
+    and removed from the tree afterwards, which bounds the memory of the (usually much larger) BPMNDI part.
+    Shapes and edges whose model element or connected shapes are not known yet
+    (i.e. the diagram precedes the model in the document) are kept until the end of the document.
+    :param source: file name or file object of the BPMN XML
+    :param url: file name used in error messages
+    :param notation: converts the shapes and edges to annotations
+    :return: the annotation background width (None if the file has no meta comment) and the annotations
+             in the same order as parse_bpmn_document_anns, i.e. all shape annotations followed by the edge annotations.
+             Belongs-to relations are not linked yet.
+    """
+    meta_comment = None
+    root = plane = diagram = None
+    tags = {}
+    collaboration_id_to_obj, process_id_to_obj = {}, {}
+
+    shape_anns: List[Optional[List[Annotation]]] = []
+    edge_anns: List[Optional[List[Annotation]]] = []
+    deferred_shapes: List[Tuple[int, Element]] = []
+    deferred_edges: List[Tuple[int, Element]] = []
+    id_to_shape_ann: Dict[str, Annotation] = {}
+
+    def get_model_element(model_id: str) -> Optional[Element]:
+        # processes take precedence over collaborations, as in create_model_id_index
+        if model_id in process_id_to_obj:
+            return process_id_to_obj[model_id]
+        return collaboration_id_to_obj.get(model_id)
+
+    def add_shape_anns(idx: int, anns: List[Annotation]):
+        shape_anns[idx] = anns
+        id_to_shape_ann.update((a.id, a) for a in anns if a.category != notation.label_category)
+
+    for event, elem in etree.iterparse(source, events=("start", "end", "comment")):
+        if event == "comment":
+            if root is None:
+                # the meta comment is the last comment in front of the root element
+                meta_comment = elem
+        elif event == "start":
+            if root is None:
+                root = elem
+                tags = _resolve_tags(root.nsmap)
+            elif diagram is None:
+                if elem.tag == tags["diagram"] and elem.getparent() is root:
+                    diagram = elem
+            elif plane is None and elem.getparent() is diagram:
+                plane = elem
+        else:
+            parent = elem.getparent()
+            if parent is root:
+                if elem.tag == tags["collaboration"]:
+                    collaboration_id_to_obj.update(create_id_to_obj_mapping(elem))
+                elif elem.tag == tags["process"]:
+                    process_id_to_obj.update(create_id_to_obj_mapping(elem))
+            elif plane is not None and parent is plane:
+                model_element = get_model_element(elem.get("bpmnElement"))
+                if elem.tag == tags["shape"]:
+                    shape_anns.append(None)
+                    if model_element is None:
+                        deferred_shapes.append((len(shape_anns) - 1, elem))
+                        continue
+                    add_shape_anns(len(shape_anns) - 1, notation.shape_to_anns(elem, model_element))
+                elif elem.tag == tags["edge"]:
+                    edge_anns.append(None)
+                    try:
+                        if model_element is None:
+                            raise KeyError(elem.get("bpmnElement"))
+                        edge_anns[-1] = notation.edge_to_anns(elem, model_element, id_to_shape_ann)
+                    except KeyError:
+                        # the model element or a connected shape comes later in the document
+                        deferred_edges.append((len(edge_anns) - 1, elem))
+                        continue
+                else:
+                    continue
+                elem.clear()
+                plane.remove(elem)
+
+    for idx, shape in deferred_shapes:
+        model_element = get_model_element(shape.get("bpmnElement"))
+        if model_element is None:
+            raise KeyError(shape.get("bpmnElement"))
+        add_shape_anns(idx, notation.shape_to_anns(shape, model_element))
+    for idx, edge in deferred_edges:
+        model_id = edge.get("bpmnElement")
+        model_element = get_model_element(model_id)
+        if model_element is None:
+            raise ValueError(f"{url}: {model_id} not in model element ids")
+        edge_anns[idx] = notation.edge_to_anns(edge, model_element, id_to_shape_ann)
+
+    if plane is None:
+        raise ValueError(f"{url}: no BPMNDiagram with a plane")
+
+    background_width = None if meta_comment is None else json.loads(meta_comment.text)["backgroundSize"]
+    anns = [a for anns in shape_anns for a in anns] + [a for anns in edge_anns for a in anns]
+    return background_width, anns
+
+
+def _resolve_tags(nsmap: Dict[Optional[str], str]) -> Dict[str, str]:
+    """qualified tags of the elements, resolved with the prefixes of the root element like the tree-based parsers"""
+    model_ns = f"{{{nsmap[None]}}}" if None in nsmap else ""
+    di_ns = f"{{{nsmap.get('bpmndi', '')}}}"
+    return {
+        "collaboration": f"{model_ns}collaboration",
+        "process": f"{model_ns}process",
+        "diagram": f"{di_ns}BPMNDiagram",
+        "shape": f"{di_ns}BPMNShape",
+        "edge": f"{di_ns}BPMNEdge",
+    }
@@ -87,6 +87,8 @@ BPMNDI_SHAPE_GROUPS = [
 ]
 
 ALL_CATEGORIES = yamlu.flatten(CATEGORY_GROUPS.values())
+# for fast membership tests
+ALL_CATEGORIES_SET = frozenset(ALL_CATEGORIES)
 
 EVENT_CATEGORY_TO_NO_POS_TYPE = {
     "startEvent": "event",
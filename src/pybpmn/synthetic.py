@@ -0,0 +1,250 @@
+import io
+import math
+import random
+from pathlib import Path
+from typing import List, Tuple, Union
+
+from PIL import Image
+
+from pybpmn.constants import VALID_SPLITS
+from pybpmn.mode import Mode
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>'
+DEFINITIONS_NS = (
+    'xmlns="http://www.omg.org/spec/BPMN/20100524/MODEL" '
+    'xmlns:bpmndi="http://www.omg.org/spec/BPMN/20100524/DI" '
+    'xmlns:omgdc="http://www.omg.org/spec/DD/20100524/DC" '
+    'xmlns:omgdi="http://www.omg.org/spec/DD/20100524/DI" '
+    'xmlns:uml="http://www.omg.org/spec/UML/20161101"'
+)
+
+# horizontal and vertical distance between the centers of neighbouring nodes
+GRID_DX = 200
+GRID_DY = 150
+
+# (tag, event definition, width, height, has label) of the BPMN nodes, the generator cycles through them
+BPMN_NODE_TYPES = [
+    ("task", None, 100, 80, False),
+    ("exclusiveGateway", None, 50, 50, True),
+    ("intermediateCatchEvent", "timer", 36, 36, True),
+    ("task", None, 100, 80, False),
+    ("parallelGateway", None, 50, 50, False),
+    ("intermediateThrowEvent", "message", 36, 36, True),
+]
+UML_NODE_TYPES = ["Class", "Interface", "Class", "AbstractClass", "Enumeration"]
+UML_EDGE_TYPES = ["Association", "Aggregation", "Extension", "Dependency", "Composition", "Realization"]
+
+
+class _Diagram:
+    """Collects the model and BPMNDI elements of a synthetic diagram on a grid layout"""
+
+    def __init__(self, n_nodes: int, seed: int):
+        rnd = random.Random(seed)
+        n_cols = max(1, math.ceil(math.sqrt(n_nodes)))
+        # jitter the positions a little so that not all diagrams share identical coordinates
+        self.node_centers = [
+            ((col + 1) * GRID_DX + rnd.randint(-5, 5), (row + 1) * GRID_DY + rnd.randint(-5, 5))
+            for row, col in (divmod(i, n_cols) for i in range(n_nodes))
+        ]
+        self.width = (n_cols + 1) * GRID_DX
+        self.height = (math.ceil(n_nodes / n_cols) + 1) * GRID_DY
+        self.model_elements: List[str] = []
+        self.di_elements: List[str] = []
+
+    def add_shape(self, elem_id: str, x: float, y: float, w: float, h: float, label_bounds=None):
+        label = "" if label_bounds is None else f"<bpmndi:BPMNLabel>{_bounds(*label_bounds)}</bpmndi:BPMNLabel>"
+        self.di_elements.append(
+            f'<bpmndi:BPMNShape id="{elem_id}_di" bpmnElement="{elem_id}">{_bounds(x, y, w, h)}{label}'
+            "</bpmndi:BPMNShape>"
+        )
+
+    def add_edge(self, elem_id: str, waypoints: List[Tuple[float, float]]):
+        wps = "".join(f'<omgdi:waypoint x="{x}" y="{y}" />' for x, y in waypoints)
+        self.di_elements.append(f'<bpmndi:BPMNEdge id="{elem_id}_di" bpmnElement="{elem_id}">{wps}</bpmndi:BPMNEdge>')
+
+    def to_xml(self) -> str:
+        lines = [
+            XML_HEADER,
+            f'<!-- {{"backgroundSize":{self.width}}} -->',
+            f'<definitions {DEFINITIONS_NS} id="Definitions_1" targetNamespace="">',
+            '  <process id="Process_1">',
+            *(f"    {e}" for e in self.model_elements),
+            "  </process>",
+            '  <bpmndi:BPMNDiagram id="Diagram_1">',
+            '    <bpmndi:BPMNPlane id="Plane_1" bpmnElement="Process_1">',
+            *(f"      {e}" for e in self.di_elements),
+            "    </bpmndi:BPMNPlane>",
+            "  </bpmndi:BPMNDiagram>",
+            "</definitions>",
+            "",
+        ]
+        return "\n".join(lines)
+
+
+def _bounds(x: float, y: float, w: float, h: float) -> str:
+    return f'<omgdc:Bounds x="{x}" y="{y}" width="{w}" height="{h}" />'
+
+
+def _edge_waypoints(src: Tuple[int, int], dst: Tuple[int, int]) -> List[Tuple[float, float]]:
+    """connects two node centers, with an orthogonal bend if they are not on the same row"""
+    if src[1] == dst[1]:
+        return [src, dst]
+    return [src, (src[0], (src[1] + dst[1]) // 2), (dst[0], (src[1] + dst[1]) // 2), dst]
+
+
+def _n_nodes(n_elements: int, elements_per_node: float) -> int:
+    return max(2, math.ceil(n_elements / elements_per_node))
+
+
+def generate_bpmn_diagram(n_elements: int, seed: int = 0) -> Tuple[str, Tuple[int, int]]:
+    """
+    Generates a BPMN diagram with roughly n_elements annotations (nodes, sequence flows and labels).
+    The nodes are laid out on a grid and connected to a chain of sequence flows.
+    :return: the BPMN XML and the (width, height) of the diagram
+    """
+    # each node contributes the node itself, the incoming sequence flow and (for every other node) a label
+    n_nodes = _n_nodes(n_elements, 2.5)
+    diagram = _Diagram(n_nodes, seed)
+
+    for i in range(n_nodes):
+        if i == 0:
+            tag, definition, w, h, has_label = "startEvent", "message", 36, 36, True
+        elif i == n_nodes - 1:
+            tag, definition, w, h, has_label = "endEvent", "terminate", 36, 36, True
+        else:
+            tag, definition, w, h, has_label = BPMN_NODE_TYPES[i % len(BPMN_NODE_TYPES)]
+
+        node_id = f"Node_{i}"
+        flows = []
+        if i > 0:
+            flows.append(f"<incoming>Flow_{i - 1}</incoming>")
+        if i < n_nodes - 1:
+            flows.append(f"<outgoing>Flow_{i}</outgoing>")
+        if definition is not None:
+            flows.append(f'<{definition}EventDefinition id="Def_{i}" />')
+        name = f' name="{tag} {i}"' if has_label or tag == "task" else ""
+        diagram.model_elements.append(f'<{tag} id="{node_id}"{name}>{"".join(flows)}</{tag}>')
+
+        cx, cy = diagram.node_centers[i]
+        label_bounds = (cx - 30, cy + h // 2 + 5, 60, 14) if has_label else None
+        diagram.add_shape(node_id, cx - w // 2, cy - h // 2, w, h, label_bounds)
+
+        if i > 0:
+            flow_id = f"Flow_{i - 1}"
+            diagram.model_elements.append(
+                f'<sequenceFlow id="{flow_id}" sourceRef="Node_{i - 1}" targetRef="{node_id}" />'
+            )
+            diagram.add_edge(flow_id, _edge_waypoints(diagram.node_centers[i - 1], (cx, cy)))
+
+    return diagram.to_xml(), (diagram.width, diagram.height)
+
+
+def generate_uml_diagram(n_elements: int, seed: int = 0) -> Tuple[str, Tuple[int, int]]:
+    """
+    Generates a UML class diagram with roughly n_elements annotations (nodes, edges and labels).
+    Each node has a name and an attribute label, consecutive nodes are connected by an edge.
+    :return: the BPMN XML and the (width, height) of the diagram
+    """
+    # each node contributes the node itself, two labels, the incoming edge and (for every other edge) an edge label
+    n_nodes = _n_nodes(n_elements, 4.5)
+    diagram = _Diagram(n_nodes, seed)
+
+    w, h = 120, 80
+    node_ids = []
+    for i in range(n_nodes):
+        tag = UML_NODE_TYPES[i % len(UML_NODE_TYPES)]
+        node_id = f"{tag}_{i}"
+        node_ids.append(node_id)
+        cx, cy = diagram.node_centers[i]
+        diagram.model_elements.append(f'<uml:{tag} id="{node_id}" />')
+        diagram.add_shape(node_id, cx - w // 2, cy - h // 2, w, h)
+
+        for j, (label_type, text, dy) in enumerate([("name", f"{tag}{i}", -35), ("attribute", f"-attr{i}", 5)]):
+            label_id = f"Label_{i}_{j}"
+            diagram.model_elements.append(
+                f'<uml:Label id="{label_id}" belongs_to="{node_id}" label_type="{label_type}"><text>{text}</text>'
+                "</uml:Label>"
+            )
+            diagram.add_shape(label_id, cx - 50, cy + dy, 100, 25)
+
+        if i > 0:
+            edge_tag = UML_EDGE_TYPES[i % len(UML_EDGE_TYPES)]
+            edge_id = f"{edge_tag}_{i}"
+            src_id = node_ids[i - 1]
+            arrowhead = ' has_arrowhead="true"' if edge_tag == "Association" and i % 3 == 0 else ""
+            diagram.model_elements.append(
+                f'<uml:{edge_tag} id="{edge_id}" sourceRef="{src_id}" targetRef="{node_id}"{arrowhead} />'
+            )
+            src_center = diagram.node_centers[i - 1]
+            diagram.add_edge(edge_id, _edge_waypoints(src_center, (cx, cy)))
+
+            if i % 2 == 0:
+                label_id = f"Label_{i}_edge"
+                diagram.model_elements.append(
+                    f'<uml:Label id="{label_id}" belongs_to="{edge_id}" label_type="edge_labeling">'
+                    f"<text>e{i}</text></uml:Label>"
+                )
+                diagram.add_shape(label_id, (src_center[0] + cx) // 2 - 20, cy - 20, 40, 15)
+
+    return diagram.to_xml(), (diagram.width, diagram.height)
+
+
+def create_synthetic_dataset(
+        dataset_root: Union[Path, str],
+        mode: Mode,
+        n_files: int,
+        n_elements: int,
+        img_max_size: int = 1000,
+        seed: int = 0,
+) -> Path:
+    """
+    Creates a dataset with the same layout as hdBPMN (Mode.BPMN) or the UML example dataset (Mode.UML_CLASS),
+    that can be loaded with HdBpmnDataset and UmlDataset respectively.
+    All images are blank JPEGs whose aspect ratio matches the diagram.
+    :param n_files: number of diagrams, which are distributed round-robin over the splits
+    :param n_elements: approximate number of annotations per diagram
+    :param img_max_size: size of the longer image side
+    :return: the dataset root
+    """
+    dataset_root = Path(dataset_root)
+    annotations_root = dataset_root / "data" / "annotations"
+    images_root = dataset_root / "data" / "images"
+    generate_diagram = generate_bpmn_diagram if mode == Mode.BPMN else generate_uml_diagram
+
+    img_bytes = None
+    split_rows = []
+    for i in range(n_files):
+        split = VALID_SPLITS[i % len(VALID_SPLITS)]
+        if mode == Mode.BPMN:
+            # hdBPMN layout: data/annotations/<exercise>/<exercise>_<writer>.bpmn, one writer per diagram
+            exercise, writer = f"ex{i % 10}", f"w{i}"
+            rel_stem = Path(exercise) / f"{exercise}_{writer}"
+            split_rows.append(f"{writer},{split}")
+        else:
+            rel_stem = Path(f"diagram{i}")
+            split_rows.append(f"{rel_stem.name},{split}")
+
+        bpmn_xml, (diagram_w, diagram_h) = generate_diagram(n_elements, seed=seed + i)
+        bpmn_path = annotations_root / rel_stem.with_suffix(".bpmn")
+        bpmn_path.parent.mkdir(parents=True, exist_ok=True)
+        bpmn_path.write_text(bpmn_xml)
+
+        if img_bytes is None:
+            # all diagrams of a dataset have the same size, therefore the image is only encoded once
+            img_bytes = _create_blank_jpeg(diagram_w, diagram_h, img_max_size)
+        img_path = images_root / rel_stem.with_suffix(".jpg")
+        img_path.parent.mkdir(parents=True, exist_ok=True)
+        img_path.write_bytes(img_bytes)
+
+    header = "writer,split" if mode == Mode.BPMN else "filename,split"
+    csv_name = "writer_split.csv" if mode == Mode.BPMN else "filename_split.csv"
+    (dataset_root / "data" / csv_name).write_text("\n".join([header, *split_rows]) + "\n")
+    return dataset_root
+
+
+def _create_blank_jpeg(diagram_w: int, diagram_h: int, img_max_size: int) -> bytes:
+    scale = min(1.0, img_max_size / max(diagram_w, diagram_h))
+    size = max(1, round(diagram_w * scale)), max(1, round(diagram_h * scale))
+    buf = io.BytesIO()
+    Image.new("RGB", size, "white").save(buf, format="JPEG")
+    return buf.getvalue()
@@ -1,14 +1,17 @@
 import logging
 from collections import defaultdict
 from pathlib import Path
-from typing import Dict, List, Union
+from typing import Dict, Iterator, List, Union
 
 import yamlu
 from yamlu.coco import Dataset
 from yamlu.img import AnnotatedImage
 
+from pybpmn.columnar import ColumnarAnnotatedImage
 from pybpmn.constants import ARROW_KEYPOINT_FIELDS, RELATIONS, UNITE_CATEGORIES, SPLIT_ASSOCIATION
+from pybpmn.prefetch import iter_split
 from pybpmn.uml_parser import UmlParser
+from pybpmn.util import create_img_path_index
 from pybpmn.uml_syntax import (
     ASSOCIATION,
     ASSOCIATION_BIDIRECTIONAL,
@@ -43,6 +46,7 @@ class UmlDataset(Dataset):
         self.split_association = split_association
 
         self.split_to_bpmn_paths = self.get_split_to_bpmn_paths()
+        self.img_id_to_paths = create_img_path_index(self.images_root, subdir_depth=0)
         self.bpmn_parser = UmlParser(**parser_kwargs)
         super().__init__(
             dataset_path=coco_dataset_root,
@@ -80,6 +84,32 @@ class UmlDataset(Dataset):
                     a.category = ASSOCIATION_BIDIRECTIONAL
         return ai
 
+    def get_split_columnar_ann_img(self, split: str, idx: int) -> ColumnarAnnotatedImage:
+        """
+        Same as get_split_ann_img, but in columnar format (see DiagramParser.parse_bpmn_img_columnar),
+        i.e. only the image header is read, independent of the lazy_img option of the parser
+        """
+        bpmn_path = self.split_to_bpmn_paths[split][idx]
+        ai = self.bpmn_parser.parse_bpmn_img_columnar(bpmn_path, self.get_img_path(bpmn_path.stem))
+        anns = ai.annotations
+        if "id" in anns.fields:
+            # "id" is reserved in coco, therefore use other field name
+            anns = anns.copy_field("id", "bpmn_id")
+        directed = anns.fields.get("directed", [None] * len(anns))
+        categories = []
+        for category, is_directed in zip(anns.categories, directed):
+            if self.unite_categories:
+                category = self.category_translate_dict.get(category, category)
+            if self.split_association and category == ASSOCIATION:
+                category = ASSOCIATION_UNIDIRECTIONAL if is_directed == "true" else ASSOCIATION_BIDIRECTIONAL
+            categories.append(category)
+        ai.annotations = anns.replace_categories(categories)
+        return ai
+
+    def iter_split(self, split: str, **kwargs) -> Iterator[AnnotatedImage]:
+        """iterates over the annotated images of a split with background prefetching, see prefetch.iter_split"""
+        return iter_split(self, split, **kwargs)
+
     @property
     def annotations_root(self):
         return self.uml_dataset_root / "data" / "annotations"
@@ -89,9 +119,9 @@ class UmlDataset(Dataset):
         return self.uml_dataset_root / "data" / "images"
 
     def get_img_path(self, img_id: str):
-        img_paths = yamlu.glob(self.images_root, f"{img_id}.*")
+        img_paths = self.img_id_to_paths.get(img_id, [])
         assert len(img_paths) == 1, f"{img_id}: {img_paths}"
-        return img_paths[0]
+        return self.images_root / img_paths[0]
 
     def _get_all_bpmn_paths(self) -> List[Path]:
         bpmn_paths = yamlu.glob(self.annotations_root, "**/*.bpmn")
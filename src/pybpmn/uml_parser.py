@@ -1,35 +1,37 @@
+import functools
 import logging
 from pathlib import Path
-from typing import Dict, List, Optional, Set
+from typing import Dict, List, Optional, Set, Union
 
 import numpy as np
-import yamlu
-from lxml import etree
 # noinspection PyProtectedMember
 from lxml.etree import _Element as Element
-from yamlu.img import AnnotatedImage, Annotation, BoundingBox
+from yamlu.img import Annotation, BoundingBox
 
 from pybpmn import uml_syntax
 from pybpmn.constants import (
-    ARROW_NEXT_REL,
-    ARROW_PREV_REL,
     ARROW_RELATIONS,
+    BPMN_ATTRIB_TO_RELATION,
     BELONGS_TO_REL      # UML-Extension: belongs_to is used instead of text_belongs_to because
                         # other elements than text also can have a belongs to relation (e.g. quantifier)
 )
 
-from pybpmn.util import bounds_to_bb, to_int_or_float, get_omgdi_ns, parse_annotation_background_width
+from pybpmn.base_parser import DiagramParser
+from pybpmn.notation import Notation
+from pybpmn.util import (
+    child_bounds_to_bb,
+    get_tag_without_ns,
+    parse_waypoints,
+)
 
 _logger = logging.getLogger(__name__)
 
-BPMN_ATTRIB_TO_RELATION = {"sourceRef": ARROW_PREV_REL, "targetRef": ARROW_NEXT_REL}
-
 
 def parse_bpmn_anns(bpmn_path: Path):
     return UmlParser().parse_bpmn_anns(bpmn_path)
 
-# Slightly adjusted version of .parser.py to UML context
-class UmlParser:
+# UML class diagram rules on top of the shared parsing engine, see DiagramParser
+class UmlParser(DiagramParser):
     def __init__(
             self,
             # Defines min width and height of edge bounding boxes, because marker sizes (e.g. arrow heads) are not considered in BPMN XML file
@@ -45,151 +47,68 @@ class UmlParser:
             img_max_size_ref: int = 1000,
             excluded_categories: Set[str] = None,
             link_belongs_rel_two_way: bool = False,
+            lazy_img: bool = False,
+            cache_dir: Optional[Union[Path, str]] = None,
+            streaming: bool = False,
+            target_max_size: Optional[int] = None,
     ):
         """
         :param marker_min_widths: pad edge bounding boxes so that their w and h is at least marker_min_width of specific edge type
                              when the image is scaled to img_max_size_ref
         :param img_max_size_ref: reference image size to consider for marker_min_widths
+        :param lazy_img: see DiagramParser
+        :param cache_dir: see DiagramParser
+        :param streaming: see DiagramParser
+        :param target_max_size: see DiagramParser
         """
         self.marker_min_widths = marker_min_widths
-        self.img_max_size_ref = img_max_size_ref
-        self.excluded_categories = {} if excluded_categories is None else excluded_categories
         self.link_belongs_rel_two_way = link_belongs_rel_two_way
-
-    def _is_included_ann(self, a: Annotation) -> bool:
-        if a.category in self.excluded_categories:
-            return False
-        return True
-
-    # noinspection PyPropertyAccess
-    def parse_bpmn_img(self, bpmn_path: Path, img_path: Path) -> AnnotatedImage:
-        """
-        :param bpmn_path: path to the BPMN XML file
-        :param img_path: path to the corresponding UML image
-        """
-        img = yamlu.read_img(img_path)
-        img_w, img_h = img.size
-
-        img_w_annotation = parse_annotation_background_width(bpmn_path)
-        scale = img_w / img_w_annotation
-        marker_min_widhts_scaled = {key: (value * max(img.size) / self.img_max_size_ref) for (key, value) in self.marker_min_widths.items()}
-
-        try:
-            anns = self.parse_bpmn_anns(bpmn_path)
-            for a in anns:
-                a.bb = a.bb.scale(scale)
-
-                if a.category in uml_syntax.UML_EDGE_CATEGORIES:
-                    marker_min_width = marker_min_widhts_scaled.get(a.category)
-                    a.bb = a.bb.pad_min_size(
-                        w_min=marker_min_width, h_min=marker_min_width
-                    )
-
-                if not a.bb.is_within_img(img_w, img_h):
-                    _logger.debug(
-                        "%s: clipping bb %s to img (%d,%d)",
-                        bpmn_path.name,
-                        a.bb,
-                        img_w,
-                        img_h,
-                    )
-                    a.bb = a.bb.clip_to_image(img_w, img_h)
-            for a in anns:
-                if "waypoints" in a:
-                    a.waypoints = a.waypoints * scale
-
-                    a.tail = a.waypoints[0]
-                    a.head = a.waypoints[-1]
-        except Exception as e:
-            _logger.error("Error while processing: %s", bpmn_path)
-            raise e
-
-        anns = [a for a in anns if self._is_included_ann(a)]
-
-        return AnnotatedImage(
-            img_path.name,
-            width=img.width,
-            height=img.height,
-            annotations=anns,
-            img=img,
-        )
-
-    def parse_bpmn_anns(self, bpmn_path: Path) -> List[Annotation]:
-        document = etree.parse(str(bpmn_path))
-        root = document.getroot()
-
-        id_to_obj = {}
-
-        for collaboration in root.findall("collaboration", root.nsmap):
-            id_to_obj.update(_create_id_to_obj_mapping(collaboration))
-
-        for process in root.findall("process", root.nsmap):
-            id_to_obj.update(_create_id_to_obj_mapping(process))
-
-        diagram = root.find("bpmndi:BPMNDiagram", root.nsmap)
-        plane = diagram[0]
-        shapes = plane.findall("bpmndi:BPMNShape", plane.nsmap)
-        shape_anns = yamlu.flatten(
-            _shape_to_anns(shape, id_to_obj[shape.get("bpmnElement")])
-            for shape in shapes
-        )
-        id_to_shape_ann = {a.id: a for a in shape_anns if a.category != uml_syntax.LABEL}
-
-        edges = plane.findall("bpmndi:BPMNEdge", plane.nsmap)
-
-        edge_anns = []
-        for edge in edges:
-            model_id = edge.get("bpmnElement")
-            if model_id not in id_to_obj:
-                raise ValueError(f"{bpmn_path}: {model_id} not in model element ids")
-            edge_anns.append(_edge_to_anns(edge, id_to_obj[model_id], id_to_shape_ann))
-
-        edge_anns = yamlu.flatten(edge_anns)
-
-        anns = shape_anns + edge_anns
-        self._link_belongs_rel_anns(anns)
-        return anns
-
-    def _link_belongs_rel_anns(self, anns):
-        id_to_ann = {a.id: a for a in anns if a.category != uml_syntax.LABEL}
-
-        belongs_anns = [a for a in anns if (a.category == uml_syntax.LABEL or a.category == uml_syntax.QUALIFIER)]
-
-        for belongs_ann in belongs_anns:
-            symb_ann = id_to_ann[belongs_ann.get(BELONGS_TO_REL)]
-            belongs_ann.set(BELONGS_TO_REL, symb_ann)
-            if self.link_belongs_rel_two_way:
-                symb_ann.set(BELONGS_TO_REL, belongs_ann)
-
-
-def get_tag_without_ns(element: Element):
-    tag_str = element.tag
-    return tag_str[tag_str.find("}") + 1:]
+        super().__init__(img_max_size_ref, excluded_categories, lazy_img, cache_dir, streaming, target_max_size)
+
+    @property
+    def notation(self) -> Notation:
+        return UML_NOTATION
+
+    def _get_min_sizes(self, anns: List[Annotation], img_w: int, img_h: int) -> np.ndarray:
+        marker_min_widths_scaled = {
+            key: (value * max(img_w, img_h) / self.img_max_size_ref)
+            for (key, value) in self.marker_min_widths.items()
+        }
+        return np.array([
+            marker_min_widths_scaled[a.category] if a.category in uml_syntax.UML_EDGE_CATEGORIES else np.nan
+            for a in anns
+        ], dtype=np.float64)
+
+    def get_parse_config(self) -> Dict:
+        """:return: the options that influence the parsing result"""
+        return {
+            "parser": self.__class__.__name__,
+            "marker_min_widths": self.marker_min_widths,
+            "img_max_size_ref": self.img_max_size_ref,
+            "target_max_size": self.target_max_size,
+            "excluded_categories": self.excluded_categories,
+            "link_belongs_rel_two_way": self.link_belongs_rel_two_way,
+        }
+
+    def _link_anns(self, anns: List[Annotation]):
+        self._link_belongs_to_anns(anns, self.link_belongs_rel_two_way)
 
 
 def get_category(model_element: Element):
     """inverse operation of get_tag"""
+    return _resolve_category(model_element.tag)
+
 
+@functools.lru_cache(maxsize=None)
+def _resolve_category(tag: str) -> str:
     # remove namespace from tag
-    category: str = get_tag_without_ns(model_element)
+    category = tag[tag.find("}") + 1:]
 
-    assert category in uml_syntax.ALL_CATEGORIES, f"unknown category: {category}"
+    assert category in uml_syntax.ALL_CATEGORIES_SET, f"unknown category: {category}"
 
     return category
 
 
-def _create_id_to_obj_mapping(element):
-    id_to_obj = {}
-    to_visit = [element]
-    while len(to_visit) != 0:
-        element = to_visit.pop()
-        for child in element:
-            to_visit.append(child)
-            if child.get("id") is not None:
-                id_to_obj[child.get("id")] = child
-    return id_to_obj
-
-
 def _edge_to_anns(edge: Element, model_element: Element, id_to_shape_ann: Dict[str, Annotation]):
     """
     Parses edges (see uml_syntax.BPMNDI_EDGE_CATEGORIES)
@@ -207,11 +126,7 @@ def _edge_to_anns(edge: Element, model_element: Element, id_to_shape_ann: Dict[s
     """
     category = get_category(model_element)
 
-    ns = get_omgdi_ns(edge)
-    waypoints = np.array(
-        [[to_int_or_float(wp.get("x")), to_int_or_float(wp.get("y"))] for wp in
-         edge.findall(f"{ns}:waypoint", edge.nsmap)]
-    )
+    waypoints = parse_waypoints(edge)
     bb = BoundingBox.from_points(waypoints, allow_neg_coord=True)
 
     attrib = _parse_edge_attribs(model_element)
@@ -226,7 +141,7 @@ def _edge_to_anns(edge: Element, model_element: Element, id_to_shape_ann: Dict[s
 def _shape_to_anns(shape: Element, model_element: Element) -> List[Annotation]:
     category = get_category(model_element)
 
-    shape_ann = Annotation(category, bb=_child_bounds_to_bb(shape), **model_element.attrib)
+    shape_ann = Annotation(category, bb=child_bounds_to_bb(shape), **model_element.attrib)
     if get_tag_without_ns(model_element) == uml_syntax.LABEL:
         text_el = model_element.find("text", model_element.nsmap)
         if text_el is not None:
@@ -264,6 +179,11 @@ def _parse_edge_attribs(model_element):
     return attrib
 
 
-def _child_bounds_to_bb(element: Element) -> BoundingBox:
-    bounds = element.find("omgdc:Bounds", element.nsmap)
-    return bounds_to_bb(bounds)
\ No newline at end of file
+UML_NOTATION = Notation(
+    name="uml_class",
+    shape_to_anns=_shape_to_anns,
+    edge_to_anns=_edge_to_anns,
+    label_category=uml_syntax.LABEL,
+    belongs_to_rel=BELONGS_TO_REL,
+    belongs_to_categories=frozenset({uml_syntax.LABEL, uml_syntax.QUALIFIER}),
+)
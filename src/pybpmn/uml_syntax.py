@@ -73,6 +73,8 @@ CATEGORY_TO_LONG_NAME = {
 }
 
 ALL_CATEGORIES = yamlu.flatten(CATEGORY_GROUPS.values())
+# for fast membership tests
+ALL_CATEGORIES_SET = frozenset(ALL_CATEGORIES)
 
 # Maps categories to a new category if "UNITE_CATEGORIES" in ./constants.py is True
 CATEGORY_TRANSLATE_DICT = {
@@ -1,10 +1,16 @@
 import json
+import logging
+import os
+from collections import defaultdict
 from pathlib import Path
-from typing import Tuple
+from typing import BinaryIO, Dict, List, Optional, Tuple
 
+import numpy as np
+
+from lxml import etree
 # noinspection PyProtectedMember
-from lxml.etree import _Element as Element
-from yamlu.img import BoundingBox
+from lxml.etree import _Element as Element, _ElementTree as ElementTree
+from yamlu.img import Annotation, BoundingBox
 
 
 def bounds_to_bb(bounds: Element) -> BoundingBox:
@@ -16,6 +22,101 @@ def bounds_to_bb(bounds: Element) -> BoundingBox:
     return bb
 
 
+def scale_anns_to_img(
+        anns: List[Annotation],
+        scale: float,
+        min_sizes: np.ndarray,
+        img_w: int,
+        img_h: int,
+        name: str,
+        logger: logging.Logger,
+):
+    """
+    Scales the bounding boxes and waypoints of the annotations in place, with array operations over all annotations.
+    Bounding boxes with a min size are padded around their center (see BoundingBox.pad_min_size),
+    and bounding boxes that are not within the image are clipped to it (see BoundingBox.clip_to_image).
+    The result is the same as applying these BoundingBox methods to each annotation.
+    :param min_sizes: (N,) min width and height of each bounding box, NaN for bounding boxes that are not padded
+    :param name: name of the file for log messages
+    """
+    n = len(anns)
+    bbs = np.array([a.bb.tlbr for a in anns], dtype=np.float64).reshape(n, 4) * scale
+
+    padded = ~np.isnan(min_sizes)
+    negative_padded = np.zeros(n, dtype=bool)
+    if padded.any():
+        t, l, b, r = bbs[padded].T
+        w, h = r - l, b - t
+        # like pad_min_size, the bounding box is recomputed from its center even if it is large enough already
+        x, y = l + w / 2, t + h / 2
+        w_new = np.maximum(w, min_sizes[padded])
+        h_new = np.maximum(h, min_sizes[padded])
+        bbs[padded] = np.stack([y - h_new / 2, x - w_new / 2, y + h_new / 2, x + w_new / 2], axis=1)
+        # pad_min_size returns bounding boxes that do not allow negative coordinates
+        negative_padded = padded & (bbs < 0).any(axis=1)
+
+    t, l, b, r = bbs.T
+    clipped = (t < 0) | (l < 0) | (b > img_h) | (r > img_w)
+    # clipping bounding boxes that are completely outside of the image results in invalid bounding boxes
+    invalid_clipped = clipped & (
+            (np.maximum(t, 0) > np.minimum(b, img_h)) | (np.maximum(l, 0) > np.minimum(r, img_w))
+    )
+    invalid = negative_padded | invalid_clipped
+    if invalid.any():
+        # raise the same error as the BoundingBox methods for the first invalid bounding box
+        i = np.flatnonzero(invalid)[0]
+        tlbr = _clip_tlbr(*bbs[i], img_w, img_h) if not negative_padded[i] else bbs[i]
+        BoundingBox(*tlbr)
+
+    if clipped.any() and logger.isEnabledFor(logging.DEBUG):
+        for tlbr in bbs[clipped]:
+            bb = BoundingBox(*tlbr, allow_neg_coord=True)
+            logger.debug("%s: clipping bb %s to img (%d,%d)", name, bb, img_w, img_h)
+
+    # The coordinates are kept as np.float64 like the result of BoundingBox.scale, since e.g. yamlu's COCO export
+    # rounds them with np.round, which can differ from round() of python floats.
+    # Clipping is done per bounding box, the (few) clipped bounding boxes then have the same types as with clip_to_image
+    for a, tlbr, is_padded, is_clipped in zip(anns, bbs, padded.tolist(), clipped.tolist()):
+        if is_clipped:
+            a.bb = BoundingBox(*_clip_tlbr(*tlbr, img_w, img_h))
+        else:
+            # padded bounding boxes do not allow negative coordinates anymore
+            a.bb = BoundingBox(*tlbr, allow_neg_coord=not is_padded and a.bb.allow_neg_coord)
+
+    wp_anns = [a for a in anns if "waypoints" in a]
+    if len(wp_anns) > 0:
+        wp_offsets = np.cumsum([len(a.waypoints) for a in wp_anns])[:-1]
+        waypoints = np.concatenate([a.waypoints for a in wp_anns]) * scale
+        for a, a_waypoints in zip(wp_anns, np.split(waypoints, wp_offsets)):
+            a.waypoints = a_waypoints
+            a.tail = a_waypoints[0]
+            a.head = a_waypoints[-1]
+
+
+def _clip_tlbr(t, l, b, r, img_w: int, img_h: int) -> Tuple:
+    """same as BoundingBox.clip_to_image"""
+    return max(t, 0), max(l, 0), min(b, img_h), min(r, img_w)
+
+
+def child_bounds_to_bb(element: Element) -> BoundingBox:
+    bounds = element.find("omgdc:Bounds", element.nsmap)
+    return bounds_to_bb(bounds)
+
+
+def parse_waypoints(edge: Element) -> np.ndarray:
+    """:return: (N,2) waypoints of a BPMNDI edge"""
+    ns = get_omgdi_ns(edge)
+    return np.array(
+        [[to_int_or_float(wp.get("x")), to_int_or_float(wp.get("y"))] for wp in
+         edge.findall(f"{ns}:waypoint", edge.nsmap)]
+    )
+
+
+def get_tag_without_ns(element: Element):
+    tag_str = element.tag
+    return tag_str[tag_str.find("}") + 1:]
+
+
 def to_int_or_float(s):
     v = float(s)
     return int(v) if v.is_integer() else v
@@ -29,17 +130,86 @@ def get_omgdi_ns(element):
     return "di"
 
 
+def create_id_to_obj_mapping(element: Element) -> Dict[str, Element]:
+    """maps the ids of the descendants of element to the descendants, in a single pass over the subtree"""
+    id_to_obj = {}
+    for child in element.iterdescendants(etree.Element):
+        obj_id = child.get("id")
+        if obj_id is not None:
+            id_to_obj[obj_id] = child
+    return id_to_obj
+
+
+def create_model_id_index(root: Element) -> Dict[str, Element]:
+    """
+    Maps the ids of the model elements, i.e. the descendants of all collaborations and processes, to the elements.
+    Process elements take precedence over collaboration elements with the same id.
+    """
+    id_to_obj = {}
+    for model_root in root.findall("collaboration", root.nsmap) + root.findall("process", root.nsmap):
+        id_to_obj.update(create_id_to_obj_mapping(model_root))
+    return id_to_obj
+
+
+def parse_bpmn_document(bpmn_path: Path, source: Optional[BinaryIO] = None) -> ElementTree:
+    """:param source: file object with the content of bpmn_path, bpmn_path is read if None"""
+    if source is None:
+        return etree.parse(str(bpmn_path))
+    return etree.parse(source, base_url=str(bpmn_path))
+
+
 def parse_annotation_background_width(bpmn_path: Path):
     """Get the width the image was resized to when annotating in the BPMN Annotator tool"""
     assert bpmn_path.suffix == ".bpmn", f"{bpmn_path}"
-    img_meta_line = bpmn_path.read_text().split("\n")[1]
-    assert img_meta_line.startswith(
-        "<!--"
-    ), f"{bpmn_path} has no meta line, line 1: {img_meta_line}"
-    img_meta = json.loads(img_meta_line.replace("<!-- ", "").replace(" -->", ""))
+    return get_annotation_background_width(parse_bpmn_document(bpmn_path))
+
+
+def get_annotation_background_width(document: ElementTree):
+    """
+    Same as parse_annotation_background_width, but for an already parsed document.
+    The BPMN Annotator tool stores the image meta data as comment in front of the root element:
+    <!-- {"backgroundSize":1000} -->
+    """
+    background_width = find_annotation_background_width(document)
+    assert background_width is not None, f"{document.docinfo.URL} has no meta comment"
+    return background_width
+
+
+def find_annotation_background_width(document: ElementTree) -> Optional[float]:
+    """Same as get_annotation_background_width, but returns None if the document has no meta comment"""
+    root = document.getroot()
+    img_meta_comment = next(root.itersiblings(etree.Comment, preceding=True), None)
+    if img_meta_comment is None:
+        return None
+    img_meta = json.loads(img_meta_comment.text)
     return img_meta["backgroundSize"]
 
 
 def split_img_id(img_id: str) -> Tuple[str, str]:
     exercise, writer = img_id.split("_")
     return exercise, writer
+
+
+def create_img_path_index(images_root: Path, subdir_depth: int = 0) -> Dict[str, List[str]]:
+    """
+    Maps image ids (file stems) to the image files under images_root, scanning each directory only once.
+    The paths are relative to images_root, so that the index can be cheaply sent to worker processes.
+    :param subdir_depth: directory depth of the images below images_root,
+                         e.g. 1 for images_root/<exercise>/<img_id>.jpg
+    """
+    dir_paths = [images_root]
+    for _ in range(subdir_depth):
+        dir_paths = [Path(e.path) for d in dir_paths for e in _scandir_sorted(d) if e.is_dir()]
+
+    img_id_to_paths = defaultdict(list)
+    for dir_path in dir_paths:
+        for entry in _scandir_sorted(dir_path):
+            if entry.is_file():
+                rel_path = Path(entry.path).relative_to(images_root)
+                img_id_to_paths[rel_path.stem].append(str(rel_path))
+    return dict(img_id_to_paths)
+
+
+def _scandir_sorted(path: Path) -> List[os.DirEntry]:
+    with os.scandir(path) as it:
+        return sorted((e for e in it if not e.name.startswith(".")), key=lambda e: e.name)
@@ -1,53 +1,59 @@
 import functools
 import logging
 import math
-import subprocess
-import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import numpy as np
 import yamlu
-from PIL import Image
-from lxml import etree
+from PIL import Image, ImageChops, ImageDraw, ImageFont
 # noinspection PyProtectedMember
-from lxml.etree import _Element as Element
-from yamlu import img_ops
-from yamlu.img import BoundingBox
+from lxml.etree import _Element as Element, _ElementTree as ElementTree
+from matplotlib import colors
+from tqdm import tqdm
+from yamlu.coco import Dataset
+from yamlu.img import Annotation, BoundingBox
 
-from pybpmn.util import bounds_to_bb, to_int_or_float, get_omgdi_ns, parse_annotation_background_width
+from pybpmn.base_parser import DiagramParser
+from pybpmn.batch import effective_n_jobs
+from pybpmn.img import get_target_img_size, read_img_resized, read_img_size
+from pybpmn.render import get_parser, render_anns, render_bpmn
+from pybpmn.util import (
+    get_annotation_background_width,
+    get_omgdi_ns,
+    parse_bpmn_document,
+    to_int_or_float,
+)
 
 _logger = logging.getLogger(__name__)
 
+# space between the tiles of a contact sheet
+CONTACT_SHEET_PADDING = 8
 
-def bpmn_to_image(bpmn_path: Path, png_path: Path, shift_to_origin=False):
+
+def bpmn_to_image(
+        bpmn_path: Path,
+        png_path: Optional[Path] = None,
+        shift_to_origin=False,
+        parser: Optional[DiagramParser] = None,
+) -> Image.Image:
     """
+    Renders a BPMN XML of either notation in-process (see render.render_bpmn)
     :param bpmn_path: path to BPMN XML
-    :param png_path: path where the rendered bpmn should be saved to
-    :param shift_to_origin: bpmn-to-image aligns diagrams to origin, i.e. it creates an image with diagram shifted
-        such that its top-left is close to (0,0), and does not render elements at exact BPMNDI positions.
-        when set to False, we undo this operation.
+    :param png_path: path where the rendered bpmn should be saved to, if any
+    :param shift_to_origin: crop the image to the diagram, i.e. shift the diagram such that its top-left is at (0,0).
+        By default, elements are rendered at their exact BPMNDI positions.
+    :param parser: parser of the notation of the file, detected with render.get_parser if None
     """
-    cmd = ["bpmn-to-image", "--no-title", "--no-footer", f"{bpmn_path}:{png_path}"]
-    _logger.debug("Executing: %s", " ".join(cmd))
-    subprocess.run(cmd, check=True, capture_output=True)
-    img: Image.Image = Image.open(png_path)
+    img = render_bpmn(bpmn_path, parser)
 
-    if not shift_to_origin:
-        #  get bounding box from xml, and revert this shifting operation
+    if shift_to_origin:
         bb = get_bpmn_bounding_box(bpmn_path)
+        img = img.crop((math.floor(max(bb.l, 0)), math.floor(max(bb.t, 0)), math.ceil(bb.r) + 1, math.ceil(bb.b) + 1))
 
-        left_offset = bb.lr_mid - img.width / 2.0
-        top_offset = bb.tb_mid - img.height / 2.0
-
-        size = math.ceil(left_offset + img.width), math.ceil(top_offset + img.height)
-        img_orig_size = Image.new("RGBA", size, (255, 255, 255, 0))
-        img_orig_size.paste(img, box=(int(round(left_offset)), int(round(top_offset))))
-        img = img_orig_size
-
-    img.save(png_path)
-    # print("rendered bpmn img size:", bpmn_img.size)
-    # print("actual bounding box of all bpmn symbols:", bb, "w/h:", bb.w, bb.h)
+    if png_path is not None:
+        img.save(png_path)
     return img
 
 
@@ -62,57 +68,248 @@ class Visualizer:
         img = yamlu.read_img(img_path)
         return cls(img, **kwargs)
 
-    def create_bpmn_overlay_img(self, bpmn_path: Path):
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            img_bpmn = bpmn_to_image(bpmn_path, png_path=Path(tmpdirname) / f"{bpmn_path.stem}.png")
-        img_w = parse_annotation_background_width(bpmn_path)
-        return self.create_overlayed_hw_img(img_bpmn, img_w=img_w)
+    def create_bpmn_overlay_img(self, bpmn_path: Path, parser: Optional[DiagramParser] = None):
+        """
+        :param parser: parser of the notation of the file, detected with render.get_parser if None
+        """
+        document = parse_bpmn_document(bpmn_path)
+        parser = get_parser(document) if parser is None else parser
+        img_w = get_annotation_background_width(document)
+        return self.create_anns_overlay_img(parser.parse_bpmn_document_anns(document), img_w)
 
-    def create_overlayed_hw_img(self, img_bpmn: Image.Image, img_w=None) -> Image.Image:
-        scale = self.img.width / img_w
+    def create_anns_overlay_img(self, anns: List[Annotation], img_w: float) -> Image.Image:
+        """
+        Same as create_bpmn_overlay_img, but for already parsed annotations (in BPMNDI coordinates)
+        :param img_w: annotation background width of the BPMN file
+        """
+        # the diagram is rendered at the size of the image right away, instead of rendering and resizing it
+        img_bpmn = render_anns(anns, scale=self.img.width / img_w, size=self.img.size)
+        return self.create_overlayed_hw_img(img_bpmn)
 
-        # https://stackoverflow.com/questions/13027169/scale-images-with-pil-preserving-transparency-and-color
-        target_size = round(img_bpmn.width * scale), round(img_bpmn.height * scale)
-        # img_bpmn = img_bpmn.resize(target_size)
-        bands = img_bpmn.split()
-        # TODO use other upsamling method?
-        bands = [b.resize(target_size, Image.LINEAR) for b in bands]
-        img_bpmn = Image.merge("RGBA", bands)
+    def create_overlayed_hw_img(
+            self, img_bpmn: Image.Image, img_w: Optional[float] = None, resample=Image.BILINEAR
+    ) -> Image.Image:
+        """
+        Overlays a rendered diagram (black on white) over the image:
+        non-white pixels of the render are blended over the image with self.alpha, black pixels in self.color.
+        With color "black", the opacity of a pixel is its darkness instead (see img_ops.grayscale_transparency).
+        The masks are computed with PIL band operations and applied with a single masked paste,
+        i.e. without intermediate RGBA copies or NumPy conversions of the (potentially large) images.
+        :param img_bpmn: rendered diagram with its origin at the origin of the image, e.g. of bpmn_to_image
+                         (its alpha is ignored)
+        :param img_w: annotation background width of the BPMN file, the render is scaled by image width / img_w.
+                      None if the render is already at the scale of the image, e.g. of create_anns_overlay_img.
+        :param resample: PIL resampling filter of the resize
+        :return: RGBA image
+        """
+        scale = 1.0 if img_w is None else self.img.width / img_w
+        if scale != 1.0:
+            img_bpmn = img_bpmn.resize((round(img_bpmn.width * scale), round(img_bpmn.height * scale)), resample)
+        if img_bpmn.size != self.img.size:
+            # parts of the render outside of the image are cut off, the image is not covered outside of the render
+            img_padded = Image.new(img_bpmn.mode, self.img.size, "white")
+            img_padded.paste(img_bpmn)
+            img_bpmn = img_padded
 
-        img_overlay = self.img.convert("RGBA").copy()
+        alpha = self.alpha
         if self.color == "black":
-            img_bpmn_transparent = img_ops.grayscale_transparency(img_bpmn)
-            img_overlay.alpha_composite(img_bpmn_transparent)
+            img_bpmn = img_bpmn.convert("RGB")
+            mask = img_bpmn.convert("L").point(lambda v: round((255 - v) * alpha))
         else:
-            img_bpmn_transparent = img_ops.white_to_transparency(img_bpmn, thresh=200)
-            img_bpmn_transparent = img_ops.black_to_color(img_bpmn_transparent, self.color)
-            if self.alpha < 1.0:
-                # noinspection PyTypeChecker
-                img_np = np.asarray(img_bpmn_transparent).copy()
-                img_np[..., -1] = np.round(img_np[..., -1] * self.alpha).astype(img_np.dtype)
-                img_bpmn_transparent = Image.fromarray(img_np)
-            img_overlay.paste(img_bpmn_transparent, mask=img_bpmn_transparent)
+            r, g, b = img_bpmn.split()[:3]
+            # same thresholds as img_ops.white_to_transparency(thresh=200) and img_ops.black_to_color
+            min_band = ImageChops.darker(ImageChops.darker(r, g), b)
+            mask = min_band.point(lambda v: round(255 * alpha) if v < 200 else 0)
 
+        img_overlay = self.img.convert("RGBA")
+        # the masked pastes are restricted to the part of the image that is covered by the diagram
+        bbox = mask.getbbox()
+        if bbox is None:
+            return img_overlay
+        mask = mask.crop(bbox)
+        if self.color == "black":
+            img_bpmn = img_bpmn.crop(bbox)
+        else:
+            r, g, b = r.crop(bbox), g.crop(bbox), b.crop(bbox)
+            max_band = ImageChops.lighter(ImageChops.lighter(r, g), b)
+            black_mask = max_band.point(lambda v: 255 if v <= 128 else 0)
+            img_bpmn = Image.merge("RGB", (r, g, b))
+            rgb = (np.array(colors.to_rgb(self.color)) * 255.).astype(np.uint8)
+            img_bpmn.paste(tuple(rgb.tolist()), mask=black_mask)
+        img_overlay.paste(img_bpmn, bbox[:2], mask=mask)
         return img_overlay
 
 
-def get_bpmn_bounding_box(bpmn_path):
-    document = etree.parse(str(bpmn_path))
-    return get_bpmn_bounding_box_doc(document)
+def create_split_overlays(
+        ds: Dataset,
+        split: str,
+        out_dir: Optional[Path] = None,
+        contact_sheet_path: Optional[Path] = None,
+        tile_size: int = 256,
+        n_cols: Optional[int] = None,
+        n_jobs: int = 1,
+        color: str = "orange",
+        alpha: float = 1.0,
+) -> List[Path]:
+    """
+    Creates the overlays of all items of a split, e.g. to review the annotations of a dataset.
+    Each BPMN file and image is read once, the parsed document is used for the annotations and background width.
+    Items that fail are logged and shown as empty tiles, but do not abort.
+    :param ds: HdBpmnDataset or UmlDataset, its parser is used for the annotations
+    :param out_dir: write each overlay to <out_dir>/<bpmn stem>.jpg
+    :param contact_sheet_path: write the overlays as tiles of a single image, see create_contact_sheet.
+                               If out_dir is None, the images are decoded and rendered at tile size right away.
+    :param n_jobs: number of worker processes (joblib-style, e.g. -1 for all CPUs)
+    :return: the paths of the written images
+    """
+    assert out_dir is not None or contact_sheet_path is not None, "out_dir or contact_sheet_path is required"
+    if out_dir is not None:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+
+    kwargs = dict(
+        split=split,
+        out_dir=None if out_dir is None else Path(out_dir),
+        tile_size=None if contact_sheet_path is None else tile_size,
+        color=color,
+        alpha=alpha,
+    )
+    idxs = range(ds.split_n_imgs[split])
+    n_jobs = effective_n_jobs(n_jobs)
+    if n_jobs == 1:
+        results = [_create_split_overlay(ds, idx, **kwargs) for idx in tqdm(idxs)]
+    else:
+        create_overlay = functools.partial(_create_split_overlay_in_worker, **kwargs)
+        with ProcessPoolExecutor(n_jobs, initializer=_init_overlay_worker, initargs=(ds,)) as executor:
+            results = list(tqdm(executor.map(create_overlay, idxs, chunksize=4), total=len(idxs)))
+
+    written_paths = [overlay_path for _, overlay_path, _ in results if overlay_path is not None]
+    if contact_sheet_path is not None:
+        tiles = [(name, tile) for name, _, tile in results]
+        create_contact_sheet(tiles, tile_size, n_cols).save(contact_sheet_path)
+        written_paths.append(Path(contact_sheet_path))
+    return written_paths
+
+
+def create_contact_sheet(
+        tiles: List[Tuple[str, Optional[Image.Image]]], tile_size: int = 256, n_cols: Optional[int] = None
+) -> Image.Image:
+    """
+    :param tiles: (caption, image) of each tile, images are downscaled to tile_size if necessary, None is left empty
+    :param n_cols: number of tiles per row, defaults to a square grid
+    :return: RGB image with the tiles in rows, each with its caption below
+    """
+    n_cols = max(math.ceil(math.sqrt(len(tiles))), 1) if n_cols is None else n_cols
+    n_rows = max(math.ceil(len(tiles) / n_cols), 1)
+    font = ImageFont.load_default()
+    caption_h = 14
+    cell_w, cell_h = tile_size + CONTACT_SHEET_PADDING, tile_size + caption_h + CONTACT_SHEET_PADDING
+
+    sheet = Image.new("RGB", (n_cols * cell_w, n_rows * cell_h), "white")
+    draw = ImageDraw.Draw(sheet)
+    for i, (caption, tile) in enumerate(tiles):
+        x, y = (i % n_cols) * cell_w, (i // n_cols) * cell_h
+        if tile is not None:
+            tile = tile.copy()
+            tile.thumbnail((tile_size, tile_size))
+            # centered in the cell
+            sheet.paste(tile.convert("RGB"), (x + (tile_size - tile.width) // 2, y + (tile_size - tile.height) // 2))
+        draw.text((x, y + tile_size + 1), caption, fill="black", font=font)
+    return sheet
+
+
+# dataset of the current worker process of create_split_overlays, set once per worker by _init_overlay_worker
+_overlay_worker_ds: Optional[Dataset] = None
+
+
+def _init_overlay_worker(ds: Dataset):
+    global _overlay_worker_ds
+    _overlay_worker_ds = ds
+
 
+def _create_split_overlay_in_worker(idx: int, **kwargs) -> Tuple[str, Optional[Path], Optional[Image.Image]]:
+    return _create_split_overlay(_overlay_worker_ds, idx, **kwargs)
 
-def get_bpmn_bounding_box_doc(document):
+
+def _create_split_overlay(
+        ds: Dataset, idx: int, split: str, out_dir: Optional[Path], tile_size: Optional[int], color: str, alpha: float
+) -> Tuple[str, Optional[Path], Optional[Image.Image]]:
+    """
+    :return: the BPMN file stem, the path of the written overlay if out_dir is given,
+             and the overlay downscaled to tile_size if tile_size is given
+    """
+    bpmn_path = ds.split_to_bpmn_paths[split][idx]
+    try:
+        img_path = ds.get_img_path(bpmn_path.stem)
+        document = parse_bpmn_document(bpmn_path)
+        anns = ds.bpmn_parser.parse_bpmn_document_anns(document)
+        img_w = get_annotation_background_width(document)
+
+        if out_dir is None:
+            # only the tile is needed: decode the image at tile size and render the diagram at that size
+            img = read_img_resized(img_path, get_target_img_size(*read_img_size(img_path), tile_size))
+        else:
+            img = yamlu.read_img(img_path)
+        overlay = Visualizer(img, color=color, alpha=alpha).create_anns_overlay_img(anns, img_w).convert("RGB")
+
+        overlay_path = None
+        if out_dir is not None:
+            overlay_path = out_dir / f"{bpmn_path.stem}.jpg"
+            overlay.save(overlay_path)
+        if tile_size is None:
+            return bpmn_path.stem, overlay_path, None
+        overlay.thumbnail((tile_size, tile_size))
+        return bpmn_path.stem, overlay_path, overlay
+    except Exception as e:
+        _logger.warning("Error while creating the overlay of %s: %s", bpmn_path, e)
+        return bpmn_path.stem, None, None
+
+
+def get_bpmn_bounding_box(bpmn_path: Path) -> BoundingBox:
+    return get_bpmn_bounding_box_doc(parse_bpmn_document(bpmn_path))
+
+
+def get_bpmn_bounding_box_doc(document: ElementTree) -> BoundingBox:
     """
+    Same as get_bpmn_bounding_box, but for an already parsed document.
+    The coordinates are gathered with one XPath attribute query per coordinate
+    and reduced with a single NumPy min/max, without creating a BoundingBox per diagram element.
     :return: the smallest bounding box that covers all diagram symbols
     """
-    bounds, waypoints = get_bpmn_bounds_waypoints(document)
+    root = document.getroot()
+    diagram = root.find("bpmndi:BPMNDiagram", root.nsmap)
+    # the prefixes in scope of the diagram (which includes those of the root), as in get_bpmn_bounds_waypoints.
+    # XPath does not support the default namespace, which is not needed for the BPMNDI elements
+    nsmap = {k: v for k, v in diagram.nsmap.items() if k is not None}
+    ns = get_omgdi_ns(diagram)
+
+    def query(path: str) -> np.ndarray:
+        # a union query of all attributes is much slower, since libxml2 sorts the union in document order
+        return np.array(diagram.xpath(path, namespaces=nsmap, smart_strings=False), dtype=np.float64)
+
+    x, y, w, h = (query(f".//omgdc:Bounds/@{k}") for k in ["x", "y", "width", "height"])
+    wp_x, wp_y = query(f".//{ns}:waypoint/@x"), query(f".//{ns}:waypoint/@y")
+    if len(x) + len(wp_x) == 0:
+        raise ValueError(f"{document.docinfo.URL}: diagram has no elements")
+    # +1 for waypoints, as in BoundingBox.from_points
+    l, r = _min_max(np.concatenate([x, wp_x]), np.concatenate([x + w, wp_x + 1]))
+    t, b = _min_max(np.concatenate([y, wp_y]), np.concatenate([y + h, wp_y + 1]))
+    return BoundingBox(t=t, l=l, b=b, r=r, allow_neg_coord=True)
+
+
+def get_anns_bounding_box(anns: List[Annotation]) -> BoundingBox:
+    """
+    Same as get_bpmn_bounding_box, but for the annotations of a BPMN file in BPMNDI coordinates,
+    e.g. the (cached, see ParseCache) result of DiagramParser.parse_bpmn_anns, which avoids parsing the XML.
+    """
+    assert len(anns) > 0, "no annotations"
+    ltrb = np.array([(a.bb.l, a.bb.t, a.bb.r, a.bb.b) for a in anns], dtype=np.float64)
+    l, t = ltrb[:, :2].min(axis=0).tolist()
+    r, b = ltrb[:, 2:].max(axis=0).tolist()
+    return BoundingBox(t=t, l=l, b=b, r=r, allow_neg_coord=True)
 
-    pts = np.array([[to_int_or_float(wp.get("x")), to_int_or_float(wp.get("y"))] for wp in waypoints])
-    pts_bbs = [BoundingBox.from_points(pts, allow_neg_coord=True)] if len(pts) > 0 else []
 
-    bounds_bbs = [bounds_to_bb(bound) for bound in bounds]
-    bb = functools.reduce(lambda bb1, bb2: bb1.union(bb2), bounds_bbs + pts_bbs)
-    return bb
+def _min_max(mins: np.ndarray, maxs: np.ndarray) -> Tuple[float, float]:
+    return to_int_or_float(mins.min()), to_int_or_float(maxs.max())
 
 
 def get_bpmn_bounds_waypoints(document) -> Tuple[List[Element], List[Element]]:
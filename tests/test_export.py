@@ -0,0 +1,227 @@
+import json
+import re
+import shutil
+from pathlib import Path
+
+import pytest
+
+from pybpmn.dataset import HdBpmnDataset
+from pybpmn.export import BpmnCocoDatasetExport, StreamingCocoJsonWriter, merge_coco_shards
+from pybpmn.mode import Mode
+from pybpmn.profiling import Profiler
+from pybpmn.synthetic import create_synthetic_dataset
+from pybpmn.uml_dataset import UmlDataset
+
+UML_DATASET_ROOT = Path(__file__).resolve().parent.parent / "example-dataset" / "uml-dataset"
+
+
+@pytest.mark.parametrize("n_jobs", [2, -1, 0])
+def test_dump_splits_process_pool(tmp_path, n_jobs):
+    ds = UmlDataset(UML_DATASET_ROOT, tmp_path / "coco", lazy_img=True)
+    BpmnCocoDatasetExport(ds, write_img=False, n_jobs=1).dump_split("train")
+    coco_json = (tmp_path / "coco" / "train.json").read_text()
+
+    ds_pool = UmlDataset(UML_DATASET_ROOT, tmp_path / "coco_pool", lazy_img=True)
+    # joblib-style values such as -1, and 0 (the default of yamlu on 2 CPUs) are mapped to a valid number of workers
+    exporter = BpmnCocoDatasetExport(ds_pool, write_img=False, n_jobs=n_jobs)
+    assert exporter.n_jobs >= 1
+    exporter.dump_splits(["train", "test"])
+    assert (tmp_path / "coco_pool" / "train.json").read_text() == coco_json
+
+
+@pytest.mark.parametrize("sample", [None, 1])
+def test_stream_json(tmp_path, sample):
+    ds = UmlDataset(UML_DATASET_ROOT, tmp_path / "coco", lazy_img=True)
+    exporter = BpmnCocoDatasetExport(ds, write_img=False, n_jobs=1, sample=sample)
+    exporter.dump_split("train")
+    # noinspection PyProtectedMember
+    coco_json_path = exporter.coco_json_exporter._split_coco_json_path("train")
+    coco_json = coco_json_path.read_text()
+
+    exporter = BpmnCocoDatasetExport(ds, write_img=False, n_jobs=1, sample=sample, stream_json=True)
+    exporter.dump_split("train")
+    assert coco_json_path.read_text() == coco_json
+
+    # an interrupted export keeps the previous COCO JSON file
+    with pytest.raises(KeyboardInterrupt):
+        with StreamingCocoJsonWriter(exporter.coco_json_exporter, "train") as writer:
+            writer.write(ds.get_split_ann_img("train", 0))
+            raise KeyboardInterrupt
+    assert coco_json_path.read_text() == coco_json
+    assert sorted(p.name for p in coco_json_path.parent.iterdir() if p.is_file()) == [coco_json_path.name]
+
+
+def test_incremental(tmp_path):
+    ds = UmlDataset(UML_DATASET_ROOT, tmp_path / "coco", lazy_img=True)
+    BpmnCocoDatasetExport(ds, write_img=False, n_jobs=1).dump_split("train")
+    coco_json = (tmp_path / "coco" / "train.json").read_text()
+
+    ds_incremental = UmlDataset(UML_DATASET_ROOT, tmp_path / "coco_incremental", lazy_img=True)
+    for _ in range(2):
+        BpmnCocoDatasetExport(ds_incremental, write_img=False, n_jobs=1, incremental=True).dump_split("train")
+        assert (tmp_path / "coco_incremental" / "train.json").read_text() == coco_json
+
+
+def test_incremental_excluded_categories(tmp_path, monkeypatch):
+    ds = UmlDataset(UML_DATASET_ROOT, tmp_path / "coco", lazy_img=True, excluded_categories={"Label", "Comment"})
+    BpmnCocoDatasetExport(ds, write_img=False, n_jobs=1).dump_split("train")
+    coco_json = (tmp_path / "coco" / "train.json").read_text()
+
+    ds_incremental = UmlDataset(
+        UML_DATASET_ROOT, tmp_path / "coco_incremental", lazy_img=True, excluded_categories={"Comment", "Label"}
+    )
+    BpmnCocoDatasetExport(ds_incremental, write_img=False, n_jobs=1, incremental=True).dump_split("train")
+    assert (tmp_path / "coco_incremental" / "train.json").read_text() == coco_json
+
+    # the options read from the manifest match, so the unchanged items are reused
+    def fail_dump_image(*args):
+        raise AssertionError("unchanged item was exported again")
+
+    monkeypatch.setattr(BpmnCocoDatasetExport, "dump_image", fail_dump_image)
+    BpmnCocoDatasetExport(ds_incremental, write_img=False, n_jobs=1, incremental=True).dump_split("train")
+    assert (tmp_path / "coco_incremental" / "train.json").read_text() == coco_json
+
+
+def test_incremental_modify_delete(tmp_path, monkeypatch):
+    dataset_root = create_synthetic_dataset(tmp_path / "dataset", Mode.BPMN, n_files=6, n_elements=10)
+
+    n_dumped = []
+    dump_image = BpmnCocoDatasetExport.dump_image
+
+    def count_dump_image(self, *args):
+        n_dumped.append(args)
+        return dump_image(self, *args)
+
+    def export_incremental():
+        ds = HdBpmnDataset(hdbpmn_root=dataset_root, coco_dataset_root=tmp_path / "coco_incremental", lazy_img=True)
+        n_dumped.clear()
+        monkeypatch.setattr(BpmnCocoDatasetExport, "dump_image", count_dump_image)
+        BpmnCocoDatasetExport(ds, n_jobs=1, incremental=True).dump_split("train")
+        monkeypatch.setattr(BpmnCocoDatasetExport, "dump_image", dump_image)
+        return ds, (tmp_path / "coco_incremental" / "train.json").read_text()
+
+    def export_full(name: str) -> str:
+        ds = HdBpmnDataset(hdbpmn_root=dataset_root, coco_dataset_root=tmp_path / name, lazy_img=True)
+        BpmnCocoDatasetExport(ds, write_img=False, n_jobs=1).dump_split("train")
+        return (tmp_path / name / "train.json").read_text()
+
+    ds, coco_json = export_incremental()
+    assert len(n_dumped) == ds.split_n_imgs["train"] == 2
+    assert coco_json == export_full("coco_full")
+    # unchanged items are not processed again
+    assert export_incremental()[1] == coco_json and len(n_dumped) == 0
+
+    # modified BPMN file
+    bpmn_path = ds.split_to_bpmn_paths["train"][1]
+    # moves the first shape by 5 units
+    bpmn_path.write_text(re.sub(r'<omgdc:Bounds x="(\d+)"', lambda m: f'<omgdc:Bounds x="{int(m[1]) + 5}"',
+                                bpmn_path.read_text(), count=1))
+    _, coco_json_modified = export_incremental()
+    assert len(n_dumped) == 1
+    assert coco_json_modified == export_full("coco_full_modified") != coco_json
+
+    # deleted item in front of an unchanged one, whose image and annotation ids are shifted
+    deleted_bpmn_path = ds.split_to_bpmn_paths["train"][0]
+    deleted_img_path = ds.get_img_path(deleted_bpmn_path.stem)
+    deleted_bpmn_path.unlink()
+    deleted_img_path.unlink()
+    ds, coco_json = export_incremental()
+    assert len(n_dumped) == 0 and ds.split_n_imgs["train"] == 1
+    assert coco_json == export_full("coco_full_deleted")
+    # the image of the deleted item is removed from the split directory
+    assert sorted(p.name for p in (tmp_path / "coco_incremental" / "train").iterdir()) == [
+        ds.get_img_path(ds.split_to_bpmn_paths["train"][0].stem).name
+    ]
+
+
+def test_shard_merge(tmp_path):
+    ds = UmlDataset(UML_DATASET_ROOT, tmp_path / "coco", lazy_img=True)
+    BpmnCocoDatasetExport(ds, write_img=False, n_jobs=1).dump_split("train")
+    coco_json = (tmp_path / "coco" / "train.json").read_text()
+
+    ds_sharded = UmlDataset(UML_DATASET_ROOT, tmp_path / "coco_sharded", lazy_img=True)
+    for shard_idx in range(2):
+        with pytest.raises(ValueError, match="missing"):
+            merge_coco_shards(tmp_path / "coco_sharded")
+        BpmnCocoDatasetExport(ds_sharded, write_img=False, n_jobs=1, shard=(shard_idx, 3)).dump_split("train")
+    BpmnCocoDatasetExport(ds_sharded, write_img=False, n_jobs=1, shard=(2, 3)).dump_split("train")
+
+    assert merge_coco_shards(tmp_path / "coco_sharded") == {"train": tmp_path / "coco_sharded" / "train.json"}
+    assert (tmp_path / "coco_sharded" / "train.json").read_text() == coco_json
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_checkpoint_resume(tmp_path, n_jobs):
+    ds = UmlDataset(UML_DATASET_ROOT, tmp_path / "coco", lazy_img=True)
+    BpmnCocoDatasetExport(ds, write_img=False, n_jobs=1).dump_split("train")
+    coco_json = (tmp_path / "coco" / "train.json").read_text()
+
+    dataset_root = tmp_path / "uml-dataset"
+    shutil.copytree(UML_DATASET_ROOT, dataset_root)
+    bpmn_path = dataset_root / "data" / "annotations" / "umlDiagram_train.bpmn"
+    bpmn = bpmn_path.read_text()
+    bpmn_path.write_text("<malformed")
+
+    # the failed item is reported instead of aborting the export
+    ds_checkpoint = UmlDataset(dataset_root, tmp_path / "coco_checkpoint", lazy_img=True)
+    BpmnCocoDatasetExport(ds_checkpoint, write_img=False, n_jobs=n_jobs, checkpoint=True).dump_split("train")
+    errors = json.loads((tmp_path / "coco_checkpoint" / "train_errors.json").read_text())
+    assert [e["bpmn"] for e in errors] == ["umlDiagram_train.bpmn"]
+    # lxml's XMLSyntaxError cannot be pickled, worker processes report it as RuntimeError
+    assert errors[0]["error"].startswith("XMLSyntaxError" if n_jobs == 1 else 'RuntimeError("XMLSyntaxError')
+    assert json.loads((tmp_path / "coco_checkpoint" / "train.json").read_text())["images"] == []
+
+    # resuming retries the failed item
+    bpmn_path.write_text(bpmn)
+    BpmnCocoDatasetExport(ds_checkpoint, write_img=False, n_jobs=n_jobs, resume=True).dump_split("train")
+    assert (tmp_path / "coco_checkpoint" / "train.json").read_text() == coco_json
+    assert not (tmp_path / "coco_checkpoint" / "train_errors.json").exists()
+    assert not (tmp_path / "coco_checkpoint" / ".journal" / "train.jsonl").exists()
+
+
+def test_checkpoint_resume_excluded_categories(tmp_path, monkeypatch):
+    dataset_root = create_synthetic_dataset(tmp_path / "dataset", Mode.BPMN, n_files=6, n_elements=10)
+    excluded_categories = {"sequenceFlow", "messageFlow"}
+    ds = HdBpmnDataset(dataset_root, tmp_path / "coco", lazy_img=True, excluded_categories=excluded_categories)
+    BpmnCocoDatasetExport(ds, n_jobs=1).dump_split("train")
+    coco_json = (tmp_path / "coco" / "train.json").read_text()
+
+    bpmn_path = ds.split_to_bpmn_paths["train"][0]
+    bpmn = bpmn_path.read_text()
+    bpmn_path.write_text("<malformed")
+    ds_checkpoint = HdBpmnDataset(
+        dataset_root, tmp_path / "coco_checkpoint", lazy_img=True, excluded_categories=excluded_categories
+    )
+    BpmnCocoDatasetExport(ds_checkpoint, n_jobs=1, checkpoint=True).dump_split("train")
+    assert (tmp_path / "coco_checkpoint" / ".journal" / "train.jsonl").exists()
+
+    # the options of the journal header match, so only the failed item is exported again
+    dumped_idxs = []
+    dump_image = BpmnCocoDatasetExport.dump_image
+
+    def count_dump_image(self, idx, *args):
+        dumped_idxs.append(idx)
+        return dump_image(self, idx, *args)
+
+    monkeypatch.setattr(BpmnCocoDatasetExport, "dump_image", count_dump_image)
+    bpmn_path.write_text(bpmn)
+    BpmnCocoDatasetExport(ds_checkpoint, n_jobs=1, resume=True).dump_split("train")
+    assert dumped_idxs == [0]
+    assert (tmp_path / "coco_checkpoint" / "train.json").read_text() == coco_json
+
+
+def test_profile_export(tmp_path):
+    ds = UmlDataset(UML_DATASET_ROOT, tmp_path / "coco", lazy_img=True)
+    BpmnCocoDatasetExport(ds, write_img=False, n_jobs=1).dump_split("train")
+    coco_json = (tmp_path / "coco" / "train.json").read_text()
+
+    profiler = Profiler()
+    with profiler.activate():
+        BpmnCocoDatasetExport(ds, write_img=True, n_jobs=2).dump_split("train")
+    assert (tmp_path / "coco" / "train.json").read_text() == coco_json
+
+    # the stages of the worker processes are sent back to the parent
+    assert {"dump_image", "parse_xml", "read_img", "scale_bbs", "write_img"}.issubset(profiler.stages.keys())
+    bpmn_path = str(ds.split_to_bpmn_paths["train"][0])
+    assert profiler.slowest_files() == [bpmn_path]
+    assert profiler.files[bpmn_path].n_elements > 0
@@ -1,6 +1,53 @@
+import dataclasses
+import logging
 from pathlib import Path
 
-from pybpmn.uml_parser import UmlParser
+import joblib
+import numpy as np
+import pytest
+import yamlu
+from lxml import etree
+from yamlu.img import Annotation, BoundingBox
+
+from pybpmn.base_parser import DiagramParser
+from pybpmn.batch import effective_n_jobs
+from pybpmn.dataset import HdBpmnDataset
+from pybpmn.mode import Mode
+from pybpmn.parser import BpmnParser, get_category
+from pybpmn.synthetic import create_synthetic_dataset, generate_bpmn_diagram
+from pybpmn.uml_parser import UML_NOTATION, UmlParser, _shape_to_anns
+from pybpmn.util import (
+    create_img_path_index,
+    create_model_id_index,
+    find_annotation_background_width,
+    get_annotation_background_width,
+    parse_annotation_background_width,
+    parse_bpmn_document,
+    scale_anns_to_img,
+)
+
+
+def _assert_anns_equal(anns, expected):
+    """compares the annotations field by field, including the types of the coordinates"""
+    assert len(anns) == len(expected)
+    ann_idxs = {id(a): i for i, a in enumerate(anns)}
+    expected_idxs = {id(a): i for i, a in enumerate(expected)}
+    for a, e in zip(anns, expected):
+        assert a.category == e.category
+        assert a.bb.tlbr == e.bb.tlbr
+        assert [type(v) for v in a.bb.tlbr] == [type(v) for v in e.bb.tlbr]
+        assert a.bb.allow_neg_coord == e.bb.allow_neg_coord
+
+        fields, expected_fields = a.extra_fields, e.extra_fields
+        assert list(fields.keys()) == list(expected_fields.keys())
+        for k, v in expected_fields.items():
+            if isinstance(v, Annotation):
+                assert ann_idxs[id(fields[k])] == expected_idxs[id(v)], k
+            elif isinstance(v, np.ndarray):
+                assert fields[k].dtype == v.dtype, k
+                np.testing.assert_array_equal(fields[k], v)
+            else:
+                assert type(fields[k]) is type(v) and fields[k] == v, k
 
 
 def test_parse_bpmn():
@@ -12,3 +59,269 @@ def test_parse_bpmn():
     ai = parser.parse_bpmn_img(bpmn_path, img_path)
     assert len(ai.annotations) > 0
     assert ai.filename == img_path.name
+
+
+def test_parse_bpmn_lazy_img():
+    resource_path = Path(__file__).resolve().parent / "resources"
+    bpmn_path = resource_path / "umlDiagram.bpmn"
+    img_path = resource_path / "umlDiagram.jpeg"
+
+    ai = UmlParser().parse_bpmn_img(bpmn_path, img_path)
+    ai_lazy = UmlParser(lazy_img=True).parse_bpmn_img(bpmn_path, img_path)
+    assert ai_lazy.size == ai.size
+    assert [a.bb for a in ai_lazy.annotations] == [a.bb for a in ai.annotations]
+    assert ai_lazy.img.size == ai.img.size
+
+
+def test_parse_bpmn_target_max_size():
+    resource_path = Path(__file__).resolve().parent / "resources"
+    bpmn_path = resource_path / "umlDiagram.bpmn"
+    img_path = resource_path / "umlDiagram.jpeg"
+
+    ai = UmlParser().parse_bpmn_img(bpmn_path, img_path)
+    for lazy_img in [False, True]:
+        ai_small = UmlParser(target_max_size=500, lazy_img=lazy_img).parse_bpmn_img(bpmn_path, img_path)
+        assert max(ai_small.size) == 500
+        assert ai_small.img.size == (ai_small.width, ai_small.height)
+
+        # the columnar format keeps decoding the image at the downscaled size
+        parser = UmlParser(target_max_size=500, lazy_img=lazy_img)
+        ai_converted = parser.parse_bpmn_img_columnar(bpmn_path, img_path).to_annotated_image()
+        assert ai_converted.size == ai_small.size
+        assert ai_converted.img.size == (ai_converted.width, ai_converted.height)
+
+        # annotations and their min sizes are computed for the downscaled image
+        scale = ai_small.width / ai.width
+        for a_small, a in zip(ai_small.annotations, ai.annotations):
+            np.testing.assert_allclose(a_small.bb.tlbr, np.array(a.bb.tlbr) * scale, atol=0.01)
+            if "waypoints" in a:
+                np.testing.assert_allclose(a_small.waypoints, a.waypoints * scale)
+                np.testing.assert_allclose(a_small.head, a.head * scale)
+
+    # images are not upscaled
+    assert UmlParser(target_max_size=10000).parse_bpmn_img(bpmn_path, img_path).size == ai.size
+
+
+def test_parse_bpmn_cache(tmp_path):
+    bpmn_path = Path(__file__).resolve().parent / "resources" / "umlDiagram.bpmn"
+
+    anns = UmlParser().parse_bpmn_anns(bpmn_path)
+    UmlParser(cache_dir=tmp_path).parse_bpmn_anns(bpmn_path)
+    anns_cached = UmlParser(cache_dir=tmp_path).parse_bpmn_anns(bpmn_path)
+    assert len(list(tmp_path.glob("*/*.pkl"))) == 1
+    _assert_anns_equal(anns_cached, anns)
+
+    UmlParser(cache_dir=tmp_path, excluded_categories={"Label"}).parse_bpmn_anns(bpmn_path)
+    assert len(list(tmp_path.glob("*/*.pkl"))) == 2
+
+
+def test_parse_bpmn_columnar():
+    resource_path = Path(__file__).resolve().parent / "resources"
+    bpmn_path = resource_path / "umlDiagram.bpmn"
+    img_path = resource_path / "umlDiagram.jpeg"
+
+    parser = UmlParser()
+    ai = parser.parse_bpmn_img(bpmn_path, img_path)
+    ai_columnar = parser.parse_bpmn_img_columnar(bpmn_path, img_path)
+    assert len(ai_columnar) == len(ai)
+    assert ai_columnar.annotations.bbs.shape == (len(ai), 4)
+
+    ai_converted = ai_columnar.to_annotated_image()
+    _assert_anns_equal(ai_converted.annotations, ai.annotations)
+    # some bounding boxes do not allow negative coordinates
+    assert not all(a.bb.allow_neg_coord for a in ai.annotations)
+    assert ai_converted.img.size == ai.img.size
+
+
+def test_parse_bpmn_streaming(tmp_path):
+    bpmn_path = Path(__file__).resolve().parent / "resources" / "umlDiagram.bpmn"
+    anns = UmlParser().parse_bpmn_anns(bpmn_path)
+    anns_streaming = UmlParser(streaming=True).parse_bpmn_anns(bpmn_path)
+    assert [repr(a) for a in anns_streaming] == [repr(a) for a in anns]
+
+    # diagram in front of the model: the BPMNDI elements can only be converted at the end of the document
+    bpmn_xml, _ = generate_bpmn_diagram(50)
+    model_start, di_start, di_end = (bpmn_xml.index(s) for s in ["<process", "<bpmndi:BPMNDiagram", "</definitions>"])
+    reordered_xml = (
+        bpmn_xml[:model_start] + bpmn_xml[di_start:di_end] + bpmn_xml[model_start:di_start] + bpmn_xml[di_end:]
+    )
+    for xml in [bpmn_xml, reordered_xml]:
+        bpmn_path = tmp_path / "diagram.bpmn"
+        bpmn_path.write_text(xml)
+        bw, anns = BpmnParser()._parse_bpmn_file(bpmn_path)
+        bw_streaming, anns_streaming = BpmnParser(streaming=True)._parse_bpmn_file(bpmn_path)
+        assert bw_streaming == bw
+        assert [repr(a) for a in anns_streaming] == [repr(a) for a in anns]
+
+
+def test_get_category():
+    ns = "http://www.omg.org/spec/BPMN/20100524/MODEL"
+    model = etree.fromstring(
+        f'<process xmlns="{ns}"><startEvent><messageEventDefinition /></startEvent>'
+        "<intermediateThrowEvent /><subProcess /><dataObjectReference /></process>"
+    )
+    shape, expanded_shape = etree.fromstring("<shape />"), etree.fromstring('<shape isExpanded="true" />')
+
+    # resolved categories are cached, therefore each element is resolved twice
+    for _ in range(2):
+        assert get_category(shape, model[0]) == "messageStartEvent"
+        assert get_category(shape, model[1]) == "intermediateEvent"
+        assert get_category(shape, model[2]) == "subProcessCollapsed"
+        assert get_category(expanded_shape, model[2]) == "subProcessExpanded"
+        assert get_category(shape, model[3]) == "dataObject"
+
+
+def test_custom_notation():
+    bpmn_path = Path(__file__).resolve().parent / "resources" / "umlDiagram.bpmn"
+
+    def shape_to_anns(shape, model_element):
+        anns = _shape_to_anns(shape, model_element)
+        for a in anns:
+            a.shape_id = shape.get("id")
+        return anns
+
+    class CustomParser(UmlParser):
+        notation = dataclasses.replace(UML_NOTATION, name="custom", shape_to_anns=shape_to_anns)
+
+    for streaming in [False, True]:
+        anns = CustomParser(streaming=streaming).parse_bpmn_anns(bpmn_path)
+        shape_anns = [a for a in anns if "waypoints" not in a]
+        assert len(shape_anns) > 0
+        assert all(a.shape_id is not None for a in shape_anns)
+
+
+def test_diagram_parser_abstract():
+    assert DiagramParser.__abstractmethods__ == {"get_parse_config", "_get_min_sizes", "_link_anns"}
+    with pytest.raises(TypeError):
+        DiagramParser()
+
+    class IncompleteParser(DiagramParser):
+        notation = UML_NOTATION
+
+        def get_parse_config(self):
+            return {}
+
+    with pytest.raises(TypeError):
+        IncompleteParser()
+    assert BpmnParser().get_parse_config() and UmlParser().get_parse_config()
+
+
+def test_create_model_id_index():
+    bpmn_path = Path(__file__).resolve().parent / "resources" / "umlDiagram.bpmn"
+    root = parse_bpmn_document(bpmn_path).getroot()
+    process = root.find("process", root.nsmap)
+
+    id_to_obj = create_model_id_index(root)
+    assert len(id_to_obj) > 0
+    assert set(id_to_obj.keys()) == {e.get("id") for e in process.iter() if e is not process and e.get("id")}
+    assert all(id_to_obj[e.get("id")] == e for e in process.iterdescendants() if e.get("id") is not None)
+
+
+def test_parse_many(tmp_path):
+    bpmn_path = Path(__file__).resolve().parent / "resources" / "umlDiagram.bpmn"
+    invalid_bpmn_path = tmp_path / "invalid.bpmn"
+    invalid_bpmn_path.write_text("<definitions>")
+
+    results = list(UmlParser().parse_many([bpmn_path, invalid_bpmn_path, bpmn_path], n_jobs=2))
+    assert [r.bpmn_path for r in results] == [bpmn_path, invalid_bpmn_path, bpmn_path]
+    assert [r.ok for r in results] == [True, False, True]
+    assert len(results[0].result) > 0
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_parse_many_bounded(executor):
+    bpmn_path = Path(__file__).resolve().parent / "resources" / "umlDiagram.bpmn"
+    n_consumed = []
+
+    def iter_bpmn_paths():
+        for i in range(100):
+            n_consumed.append(i)
+            yield bpmn_path
+
+    results = UmlParser().parse_many(iter_bpmn_paths(), executor=executor, n_jobs=2, chunksize=3)
+    assert next(results).ok
+    # at most 4 * n_jobs chunks are submitted ahead
+    assert len(n_consumed) <= 4 * 2 * 3
+    assert sum(r.ok for r in results) == 99 and len(n_consumed) == 100
+
+
+def test_effective_n_jobs():
+    assert effective_n_jobs(2) == 2
+    assert effective_n_jobs(0) == 1
+    assert effective_n_jobs(-1) == joblib.cpu_count()
+    assert effective_n_jobs(-joblib.cpu_count() - 5) == 1
+
+
+def test_scale_anns_to_img():
+    def create_anns():
+        waypoints = np.array([[10, 40], [110, 41]])
+        arrow = Annotation("arrow", BoundingBox(40, 10, 42, 110, allow_neg_coord=True), waypoints=waypoints)
+        return [
+            Annotation("node", BoundingBox(-5, 20, 30, 70, allow_neg_coord=True)),
+            arrow,
+            Annotation("node", BoundingBox(50, 150, 90, 230, allow_neg_coord=True)),
+        ]
+
+    anns = create_anns()
+    scale_anns_to_img(anns, 0.5, np.array([np.nan, 20, np.nan]), 100, 100, "test", logging.getLogger(__name__))
+
+    expected_bbs = [bb.scale(0.5) for bb in (a.bb for a in create_anns())]
+    expected_bbs[0] = expected_bbs[0].clip_to_image(100, 100)
+    expected_bbs[1] = expected_bbs[1].pad_min_size(20, 20)
+    expected_bbs[2] = expected_bbs[2].clip_to_image(100, 100)
+    assert [a.bb.tlbr for a in anns] == [bb.tlbr for bb in expected_bbs]
+    assert anns[1].waypoints.tolist() == [[5, 20], [55, 20.5]]
+    assert anns[1].head.tolist() == [55, 20.5]
+
+
+def test_get_annotation_background_width(tmp_path):
+    bpmn_path = Path(__file__).resolve().parent / "resources" / "umlDiagram.bpmn"
+    document = parse_bpmn_document(bpmn_path)
+    assert get_annotation_background_width(document) == parse_annotation_background_width(bpmn_path) == 1000
+
+    bpmn_path_no_meta = tmp_path / "no_meta.bpmn"
+    bpmn_path_no_meta.write_text(bpmn_path.read_text().replace('<!-- {"backgroundSize":1000} -->', ""))
+    document_no_meta = parse_bpmn_document(bpmn_path_no_meta)
+    assert find_annotation_background_width(document_no_meta) is None
+    with pytest.raises(AssertionError):
+        get_annotation_background_width(document_no_meta)
+    with pytest.raises(AssertionError):
+        parse_annotation_background_width(bpmn_path_no_meta)
+
+
+def test_create_img_path_index(tmp_path):
+    images_root = tmp_path / "images"
+    rel_paths = ["ex1/ex1_w1.jpg", "ex1/ex1_w2.png", "ex2/ex2_w1.jpg", "ex2/dup.jpg", "ex2/dup.png", "ex2/.hidden.jpg"]
+    for rel_path in rel_paths:
+        (images_root / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (images_root / rel_path).touch()
+    (images_root / "top.jpg").touch()
+
+    # same as the glob that was used per image before
+    index = create_img_path_index(images_root, subdir_depth=1)
+    for img_id in ["ex1_w1", "ex1_w2", "ex2_w1", "dup", "missing", "top"]:
+        glob_paths = [str(p.relative_to(images_root)) for p in yamlu.glob(images_root, f"*/{img_id}.*")]
+        assert index.get(img_id, []) == glob_paths
+    assert index["dup"] == ["ex2/dup.jpg", "ex2/dup.png"]
+    assert ".hidden" not in index
+
+    assert create_img_path_index(images_root) == {"top": ["top.jpg"]}
+    assert create_img_path_index(images_root / "ex1") == {"ex1_w1": ["ex1_w1.jpg"], "ex1_w2": ["ex1_w2.png"]}
+
+
+def test_get_img_path_missing_duplicate(tmp_path):
+    dataset_root = create_synthetic_dataset(tmp_path / "dataset", Mode.BPMN, n_files=3, n_elements=5)
+    ds = HdBpmnDataset(hdbpmn_root=dataset_root, coco_dataset_root=tmp_path / "coco", lazy_img=True)
+    img_ids = [p.stem for p in ds.split_to_bpmn_paths["train"] + ds.split_to_bpmn_paths["val"]]
+    img_path = ds.get_img_path(img_ids[0])
+    assert img_path == yamlu.glob(ds.images_root, f"*/{img_ids[0]}.*")[0]
+
+    img_path.with_suffix(".png").touch()
+    ds.get_img_path(img_ids[1]).unlink()
+    ds = HdBpmnDataset(hdbpmn_root=dataset_root, coco_dataset_root=tmp_path / "coco", lazy_img=True)
+    # the index-based lookup fails with an AssertionError for both missing and duplicate images
+    with pytest.raises(AssertionError, match=img_ids[0]):
+        ds.get_img_path(img_ids[0])
+    with pytest.raises(AssertionError, match=img_ids[1]):
+        ds.get_img_path(img_ids[1])
+
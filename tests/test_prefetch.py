@@ -0,0 +1,52 @@
+import pytest
+
+from pybpmn.dataset import HdBpmnDataset
+from pybpmn.mode import Mode
+from pybpmn.prefetch import split_order
+from pybpmn.synthetic import create_synthetic_dataset
+
+
+@pytest.fixture(scope="module")
+def ds(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("prefetch")
+    dataset_root = create_synthetic_dataset(tmp_path / "dataset", Mode.BPMN, n_files=24, n_elements=10)
+    return HdBpmnDataset(hdbpmn_root=dataset_root, coco_dataset_root=tmp_path / "coco", lazy_img=True)
+
+
+def _summary(ann_img):
+    return ann_img.filename, [(a.category, tuple(a.bb.tlbr)) for a in ann_img.annotations]
+
+
+@pytest.mark.parametrize("prefetch", [1, 3])
+def test_iter_split(ds, prefetch):
+    expected = [_summary(ds.get_split_ann_img("train", idx)) for idx in range(ds.split_n_imgs["train"])]
+
+    ann_imgs = list(ds.iter_split("train", prefetch=prefetch, n_workers=2))
+    assert [_summary(ai) for ai in ann_imgs] == expected
+    # images are decoded in the background
+    assert all(ai._img is not None for ai in ann_imgs)
+
+
+def test_iter_split_shuffle(ds, monkeypatch):
+    n_imgs = ds.split_n_imgs["train"]
+    order = split_order(n_imgs, shuffle=True, seed=1)
+    assert sorted(order) == list(range(n_imgs)) and order != list(range(n_imgs))
+    assert split_order(n_imgs, shuffle=True, seed=1) == order
+
+    filenames = [ai.filename for ai in ds.iter_split("train", shuffle=True, seed=1, decode_img=False)]
+    assert filenames == [ds.get_split_ann_img("train", idx).filename for idx in order]
+
+    # stopping early does not read the remaining items
+    read_idxs = []
+    get_split_ann_img = ds.get_split_ann_img
+
+    def counting_get_split_ann_img(split, idx):
+        read_idxs.append(idx)
+        return get_split_ann_img(split, idx)
+
+    monkeypatch.setattr(ds, "get_split_ann_img", counting_get_split_ann_img)
+    prefetch = 2
+    it = ds.iter_split("train", prefetch=prefetch)
+    next(it)
+    it.close()
+    assert 0 in read_idxs and len(read_idxs) <= prefetch + 1 < n_imgs
@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from pybpmn.profiling import Profiler, get_profiler, profile_stage
+from pybpmn.uml_parser import UmlParser
+
+
+def test_profile_disabled():
+    assert get_profiler() is None
+    # the same no-op context manager is returned for every stage
+    assert profile_stage("a") is profile_stage("b", "file.bpmn")
+
+
+def test_profile_parse_bpmn_img():
+    resource_path = Path(__file__).resolve().parent / "resources"
+    bpmn_path = resource_path / "umlDiagram.bpmn"
+    img_path = resource_path / "umlDiagram.jpeg"
+
+    profiler = Profiler()
+    with profiler.activate():
+        assert get_profiler() is profiler
+        ai = UmlParser().parse_bpmn_img(bpmn_path, img_path)
+    assert get_profiler() is None
+
+    assert set(profiler.stages.keys()) == {"read_img", "parse_xml", "scale_bbs"}
+    file_stats = profiler.files[str(bpmn_path)]
+    assert file_stats.n_elements == len(ai.annotations)
+    assert abs(file_stats.total_s - sum(file_stats.stages.values())) < 1e-9
+
+    merged = Profiler()
+    merged.merge(profiler)
+    merged.merge(profiler)
+    assert merged.stages["parse_xml"].count == 2
+    assert "parse_xml" in merged.summary_table()
@@ -0,0 +1,168 @@
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+from yamlu import img_ops
+
+from pybpmn import vis
+from pybpmn.mode import Mode
+from pybpmn.parser import BpmnParser
+from pybpmn.render import get_parser, render_anns, render_bpmn
+from pybpmn.synthetic import create_synthetic_dataset
+from pybpmn.uml_dataset import UmlDataset
+from pybpmn.uml_parser import UmlParser
+from pybpmn.util import parse_annotation_background_width, parse_bpmn_document
+from pybpmn.vis import (
+    Visualizer,
+    bpmn_to_image,
+    create_split_overlays,
+    get_anns_bounding_box,
+    get_bpmn_bounding_box,
+)
+
+RESOURCE_PATH = Path(__file__).resolve().parent / "resources"
+UML_DATASET_ROOT = Path(__file__).resolve().parent.parent / "example-dataset" / "uml-dataset"
+
+
+def test_get_parser(tmp_path):
+    assert isinstance(get_parser(parse_bpmn_document(RESOURCE_PATH / "umlDiagram.bpmn")), UmlParser)
+
+    dataset_root = create_synthetic_dataset(tmp_path / "dataset", Mode.BPMN, n_files=1, n_elements=20)
+    bpmn_path = next(dataset_root.rglob("*.bpmn"))
+    assert isinstance(get_parser(parse_bpmn_document(bpmn_path)), BpmnParser)
+    assert render_bpmn(bpmn_path).getbbox() is not None
+
+
+def test_render_anns():
+    anns = UmlParser().parse_bpmn_anns(RESOURCE_PATH / "umlDiagram.bpmn")
+    img = render_anns(anns)
+    assert img.mode == "RGBA"
+    assert img.size == (max(int(np.ceil(a.bb.r)) for a in anns) + 1, max(int(np.ceil(a.bb.b)) for a in anns) + 1)
+
+    # shapes are drawn at their BPMNDI positions
+    img_np = np.asarray(img.convert("L"))
+    shape = next(a for a in anns if a.category == "Class")
+    assert img_np[round(shape.bb.t), round(shape.bb.l):round(shape.bb.r)].max() == 0
+    assert img_np[round(shape.bb.t) - 5, round(shape.bb.l):round(shape.bb.r)].min() == 255
+
+    img_scaled = render_anns(anns, scale=2.0, size=(100, 50))
+    assert img_scaled.size == (100, 50)
+
+
+def test_create_bpmn_overlay_img():
+    vis = Visualizer.from_img_path(RESOURCE_PATH / "umlDiagram.jpeg")
+    img_overlay = vis.create_bpmn_overlay_img(RESOURCE_PATH / "umlDiagram.bpmn")
+    assert img_overlay.size == vis.img.size
+
+
+def _overlay_with_img_ops(vis: Visualizer, img_bpmn: Image.Image, scale: float) -> np.ndarray:
+    """reference implementation of create_overlayed_hw_img, composed of the img_ops functions"""
+    img_bpmn = img_bpmn.resize((round(img_bpmn.width * scale), round(img_bpmn.height * scale)), Image.BILINEAR)
+    img_transparent = img_ops.black_to_color(img_ops.white_to_transparency(img_bpmn, thresh=200), vis.color)
+    img_np = np.asarray(img_transparent).copy()
+    img_np[..., -1] = np.round(img_np[..., -1] * vis.alpha).astype(img_np.dtype)
+    img_expected = vis.img.convert("RGBA")
+    img_expected.paste(Image.fromarray(img_np), mask=Image.fromarray(img_np))
+    return np.asarray(img_expected)[..., :3]
+
+
+def test_create_overlayed_hw_img():
+    vis = Visualizer.from_img_path(RESOURCE_PATH / "umlDiagram.jpeg", alpha=0.5)
+    anns = UmlParser().parse_bpmn_anns(RESOURCE_PATH / "umlDiagram.bpmn")
+    img_bpmn = render_anns(anns, scale=0.5, size=(vis.img.width // 2, vis.img.height // 2))
+    img_overlay = vis.create_overlayed_hw_img(img_bpmn, img_w=vis.img.width / 2)
+    assert img_overlay.mode == "RGBA" and img_overlay.size == vis.img.size
+    np.testing.assert_array_equal(np.asarray(img_overlay)[..., :3], _overlay_with_img_ops(vis, img_bpmn, 2.0))
+
+    # a render at the size of the image is not resized
+    img_bpmn = render_anns(anns, size=vis.img.size)
+    img_overlay = vis.create_overlayed_hw_img(img_bpmn)
+    np.testing.assert_array_equal(np.asarray(img_overlay)[..., :3], _overlay_with_img_ops(vis, img_bpmn, 1.0))
+
+
+def test_create_overlayed_hw_img_bpmn_to_image():
+    bpmn_path = RESOURCE_PATH / "umlDiagram.bpmn"
+    vis = Visualizer.from_img_path(RESOURCE_PATH / "umlDiagram.jpeg")
+    # the render has the extent of the diagram, which has a different aspect ratio than the image
+    img_bpmn = bpmn_to_image(bpmn_path)
+    img_w = parse_annotation_background_width(bpmn_path)
+    img_overlay = vis.create_overlayed_hw_img(img_bpmn, img_w=img_w)
+    assert img_overlay.size == vis.img.size
+
+    # the render is scaled uniformly and placed at the origin, i.e. not stretched to the image
+    scale = vis.img.width / img_w
+    img_scaled = Image.new("RGBA", vis.img.size, "white")
+    img_scaled.paste(img_bpmn.resize((round(img_bpmn.width * scale), round(img_bpmn.height * scale)), Image.BILINEAR))
+    np.testing.assert_array_equal(np.asarray(img_overlay)[..., :3], _overlay_with_img_ops(vis, img_scaled, 1.0))
+
+
+def test_create_split_overlays(tmp_path):
+    ds = UmlDataset(UML_DATASET_ROOT, tmp_path / "coco", lazy_img=True)
+    sheet_path = tmp_path / "sheet.jpg"
+    paths = create_split_overlays(
+        ds, "train", out_dir=tmp_path / "overlays", contact_sheet_path=sheet_path, tile_size=64
+    )
+    assert paths == [tmp_path / "overlays" / f"{p.stem}.jpg" for p in ds.split_to_bpmn_paths["train"]] + [sheet_path]
+    assert all(p.exists() for p in paths)
+
+
+def test_create_split_overlays_process_pool(tmp_path):
+    ds = UmlDataset(UML_DATASET_ROOT, tmp_path / "coco", lazy_img=True)
+    paths = create_split_overlays(ds, "train", out_dir=tmp_path / "serial", n_jobs=1)
+    paths_pool = create_split_overlays(ds, "train", out_dir=tmp_path / "pool", n_jobs=2)
+    assert [p.name for p in paths_pool] == [p.name for p in paths]
+    for path, path_pool in zip(paths, paths_pool):
+        np.testing.assert_array_equal(np.asarray(Image.open(path_pool)), np.asarray(Image.open(path)))
+
+
+def test_create_split_overlays_tile_only(tmp_path, monkeypatch):
+    ds = UmlDataset(UML_DATASET_ROOT, tmp_path / "coco", lazy_img=True)
+    full_sheet_path = tmp_path / "full_sheet.png"
+    create_split_overlays(ds, "train", out_dir=tmp_path / "overlays", contact_sheet_path=full_sheet_path, tile_size=64)
+
+    resized_reads = []
+    read_img_resized = vis.read_img_resized
+    monkeypatch.setattr(vis, "read_img_resized", lambda *args: resized_reads.append(args) or read_img_resized(*args))
+    sheet_path = tmp_path / "sheet.png"
+    paths = create_split_overlays(ds, "train", contact_sheet_path=sheet_path, tile_size=64)
+
+    assert paths == [sheet_path]
+    assert len(resized_reads) == ds.split_n_imgs["train"]
+    # rendering at tile size only differs from downscaling the full overlay by resampling
+    sheet, full_sheet = np.asarray(Image.open(sheet_path), float), np.asarray(Image.open(full_sheet_path), float)
+    assert sheet.shape == full_sheet.shape
+    assert np.abs(sheet - full_sheet).mean() < 10
+
+
+def test_get_bpmn_bounding_box():
+    bpmn_path = RESOURCE_PATH / "umlDiagram.bpmn"
+    bb = get_bpmn_bounding_box(bpmn_path)
+    anns = UmlParser().parse_bpmn_anns(bpmn_path)
+    assert (bb.l, bb.t, bb.r, bb.b) == (min(a.bb.l for a in anns), min(a.bb.t for a in anns),
+                                        max(a.bb.r for a in anns), max(a.bb.b for a in anns))
+    bb_anns = get_anns_bounding_box(anns)
+    assert (bb_anns.l, bb_anns.t, bb_anns.r, bb_anns.b) == (bb.l, bb.t, bb.r, bb.b)
+
+
+def test_get_bpmn_bounding_box_local_prefix(tmp_path):
+    # the waypoint prefix is only declared on the diagram element
+    bpmn_path = tmp_path / "diagram.bpmn"
+    bpmn_path.write_text("""<?xml version="1.0" encoding="UTF-8"?>
+<definitions xmlns="http://www.omg.org/spec/BPMN/20100524/MODEL"
+             xmlns:bpmndi="http://www.omg.org/spec/BPMN/20100524/DI"
+             xmlns:omgdc="http://www.omg.org/spec/DD/20100524/DC">
+  <bpmndi:BPMNDiagram id="Diagram" xmlns:omgdi="http://www.omg.org/spec/DD/20100524/DI">
+    <bpmndi:BPMNPlane id="Plane">
+      <bpmndi:BPMNShape id="Shape" bpmnElement="Task">
+        <omgdc:Bounds x="5" y="10" width="50" height="40" />
+      </bpmndi:BPMNShape>
+      <bpmndi:BPMNEdge id="Edge" bpmnElement="Flow">
+        <omgdi:waypoint x="55" y="30" />
+        <omgdi:waypoint x="90" y="100" />
+      </bpmndi:BPMNEdge>
+    </bpmndi:BPMNPlane>
+  </bpmndi:BPMNDiagram>
+</definitions>
+""")
+    bb = get_bpmn_bounding_box(bpmn_path)
+    assert (bb.t, bb.l, bb.b, bb.r) == (10, 5, 101, 91)
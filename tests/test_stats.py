@@ -0,0 +1,78 @@
+import csv
+from pathlib import Path
+
+import numpy as np
+
+from pybpmn.dataset import HdBpmnDataset
+from pybpmn.mode import Mode
+from pybpmn.stats import Histogram, compute_stats, merge_stats, read_stats_json, write_stats_csv, write_stats_json
+from pybpmn.synthetic import create_synthetic_dataset
+from pybpmn.uml_dataset import UmlDataset
+
+UML_DATASET_ROOT = Path(__file__).resolve().parent.parent / "example-dataset" / "uml-dataset"
+
+
+def test_histogram():
+    hist = Histogram(log=True)
+    hist.add([0.5, 1, 3, 4, 7.9, 100])
+    assert hist.bins == {0: 1, 1: 1, 2: 1, 4: 2, 64: 1}
+    assert (hist.n, hist.min, hist.max) == (6, 0.5, 100)
+
+    other = Histogram(log=True)
+    other.add([5])
+    hist.merge(other)
+    assert hist.bins[4] == 3 and hist.n == 7
+    assert Histogram.from_dict(hist.to_dict()) == hist
+
+
+def test_compute_stats(tmp_path):
+    ds = UmlDataset(UML_DATASET_ROOT, tmp_path / "coco", lazy_img=True)
+    split_to_stats = compute_stats(ds, ["train"])
+    stats = split_to_stats["train"]
+
+    ann_img = ds.get_split_ann_img("train", 0)
+    anns = ann_img.annotations
+    assert stats.n_imgs == 1 and stats.errors == []
+    assert sum(stats.category_counts.values()) == len(anns)
+    assert stats.anns_per_img.bins == {len(anns): 1}
+    assert np.isclose(sum(h.total for h in stats.bb_widths.values()), sum(a.bb.w for a in anns))
+    edge_lengths = [np.hypot(*np.diff(np.asarray(a.waypoints, dtype=float), axis=0).T).sum()
+                    for a in anns if "waypoints" in a]
+    assert np.isclose(sum(h.total for h in stats.edge_lengths.values()), sum(edge_lengths))
+    assert sum(h.n for h in stats.n_waypoints.values()) == len(edge_lengths)
+
+    # the stats of shards add up
+    merged = merge_stats([split_to_stats, split_to_stats])["train"]
+    assert merged.n_imgs == 2
+    assert merged.category_counts == {c: 2 * n for c, n in stats.category_counts.items()}
+
+    json_path = tmp_path / "stats.json"
+    write_stats_json(split_to_stats, json_path)
+    assert read_stats_json(json_path) == split_to_stats
+
+    csv_path = tmp_path / "stats.csv"
+    write_stats_csv(split_to_stats, csv_path)
+    with csv_path.open() as f:
+        rows = list(csv.DictReader(f))
+    assert sum(int(r["count"]) for r in rows if r["metric"] == "category_count") == len(anns)
+
+
+def test_get_split_columnar_ann_img(tmp_path):
+    dataset_root = create_synthetic_dataset(tmp_path / "dataset", Mode.BPMN, n_files=3, n_elements=30)
+    datasets = [
+        UmlDataset(UML_DATASET_ROOT, tmp_path / "coco_uml"),
+        HdBpmnDataset(hdbpmn_root=dataset_root, coco_dataset_root=tmp_path / "coco_bpmn"),
+    ]
+    for ds in datasets:
+        for split in ds.splits:
+            for idx in range(ds.split_n_imgs[split]):
+                ai = ds.get_split_ann_img(split, idx)
+                ai_columnar = ds.get_split_columnar_ann_img(split, idx)
+                # the categories are translated in the same way
+                assert ai_columnar.annotations.categories == [a.category for a in ai.annotations]
+                np.testing.assert_allclose(ai_columnar.annotations.bbs, [a.bb.tlbr for a in ai.annotations])
+                # and the "id" field is renamed
+                anns_converted = ai_columnar.to_annotated_image().annotations
+                for a_converted, a in zip(anns_converted, ai.annotations):
+                    assert list(a_converted.extra_fields) == list(a.extra_fields)
+                    assert a_converted.extra_fields.get("bpmn_id") == a.extra_fields.get("bpmn_id")
@@ -0,0 +1,22 @@
+import pytest
+
+from pybpmn.dataset import HdBpmnDataset
+from pybpmn.mode import Mode
+from pybpmn.synthetic import create_synthetic_dataset
+from pybpmn.uml_dataset import UmlDataset
+
+
+@pytest.mark.parametrize("mode", [Mode.BPMN, Mode.UML_CLASS])
+@pytest.mark.parametrize("n_elements", [10, 500])
+def test_create_synthetic_dataset(tmp_path, mode, n_elements):
+    dataset_root = create_synthetic_dataset(tmp_path / "dataset", mode, n_files=4, n_elements=n_elements)
+
+    if mode == Mode.BPMN:
+        ds = HdBpmnDataset(hdbpmn_root=dataset_root, coco_dataset_root=tmp_path / "coco")
+    else:
+        ds = UmlDataset(uml_dataset_root=dataset_root, coco_dataset_root=tmp_path / "coco")
+    assert sum(ds.split_n_imgs.values()) == 4
+
+    ai = ds.get_split_ann_img("train", 0)
+    assert 0.8 * n_elements <= len(ai.annotations) <= 1.3 * n_elements
+    assert all(a.bb.is_within_img(ai.width, ai.height) for a in ai.annotations)